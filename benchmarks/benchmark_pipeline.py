@@ -0,0 +1,229 @@
+# Pipeline benchmark
+#
+# Generates synthetic inputs at each size and runs the validator, the
+# transformation and the monitor on them the way they run in production:
+# each script in a fresh process, from a folder holding event-file-input.
+# Records each script's wall time and the per-stage timings (wall, CPU,
+# peak memory, rows) from the run manifests the scripts write, and saves
+# them as JSON. Given a baseline results file, every timing is also
+# reported as a ratio to the baseline.
+#
+#   python benchmarks/benchmark_pipeline.py [n_rows ...] [--label NAME] [--baseline RESULTS.json]
+#
+# Inputs are generated once per size and reused while the generator
+# settings are unchanged. 10^8 rows take roughly 15 GB of CSV.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Dict, List
+
+import pandas as pd
+
+import synthetic_events
+
+SIZES = [10**5, 10**6, 10**7, 10**8]
+DAYS = 7
+SEED = 0
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = "benchmark_runs"  # Generated inputs (kept per size) and the outputs of the last run
+RESULTS_DIR = os.path.join(REPO_DIR, "benchmarks", "results")
+
+# Script and the name its run manifests are saved under
+SCRIPTS = {
+    "validation": ("part1-data-quality/data_validation_framework.py", "validation"),
+    "transformation": ("part2-transformation/transformation_pipeline.py", "transformation"),
+    "monitoring": ("part4-monitoring/production_monitoring.py", "monitoring"),
+}
+
+# Generator settings that shape the inputs; inputs are regenerated when they change
+GENERATOR_SETTINGS = [
+    "N_CLIENTS",
+    "ANONYMOUS_SHARE",
+    "UTM_SHARE",
+    "N_USER_AGENTS",
+    "CONVERSION_RATE",
+    "EVENTS_PER_VISIT",
+    "VISIT_MINUTES",
+    "EMPTY_EVENT_NAME_SHARE",
+    "RENAME_CLIENT_ID_FROM_DAY",
+    "DROP_REFERRER_FROM_DAY",
+    "START_DATE",
+]
+
+
+def prepare_inputs(n_rows: int) -> str:
+
+    # Reuses the inputs of an earlier benchmark when they were generated the same way
+    input_dir = os.path.join(WORK_DIR, str(n_rows), "inputs")
+    settings_path = os.path.join(input_dir, "settings.json")
+
+    settings = {
+        "n_rows": n_rows,
+        "days": DAYS,
+        "seed": SEED,
+        **{name: getattr(synthetic_events, name) for name in GENERATOR_SETTINGS},
+    }
+
+    if os.path.exists(settings_path):
+        with open(settings_path) as f:
+            if json.load(f) == settings:
+                return input_dir
+
+    shutil.rmtree(input_dir, ignore_errors=True)
+    synthetic_events.write_event_files(os.path.join(input_dir, "event-file-input"), n_rows, DAYS, SEED)
+
+    with open(settings_path, "w") as f:
+        json.dump(settings, f, indent=2)
+
+    return input_dir
+
+
+def latest_manifest(run_dir: str, script: str) -> Dict:
+
+    manifest_dir = os.path.join(run_dir, "run_manifests")
+    names = sorted(
+        name for name in os.listdir(manifest_dir)
+        if name.startswith(f"{script}-")
+    ) if os.path.isdir(manifest_dir) else []
+
+    if not names:
+        return None
+
+    with open(os.path.join(manifest_dir, names[-1])) as f:
+        return json.load(f)
+
+
+def run_script(run_dir: str, name: str) -> Dict:
+
+    path, manifest_name = SCRIPTS[name]
+
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, os.path.join(REPO_DIR, path)],
+        cwd=run_dir,
+        capture_output=True,
+        text=True
+    )
+    wall_seconds = time.perf_counter() - started
+
+    # A failing monitor only means it raised alerts; the other scripts must succeed
+    if completed.returncode != 0 and name != "monitoring":
+        raise RuntimeError(f"{name} failed:\n{completed.stderr[-3000:]}")
+
+    manifest = latest_manifest(run_dir, manifest_name)
+
+    return {
+        "wall_seconds": wall_seconds,
+        "returncode": completed.returncode,
+        "stages": manifest["stages"] if manifest else [],
+    }
+
+
+def benchmark_size(n_rows: int) -> Dict:
+
+    input_dir = prepare_inputs(n_rows)
+
+    # A fresh run folder, so no index, cache or state from an earlier run is reused
+    run_dir = os.path.join(WORK_DIR, str(n_rows), "run")
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    os.symlink(
+        os.path.abspath(os.path.join(input_dir, "event-file-input")),
+        os.path.join(run_dir, "event-file-input")
+    )
+
+    scripts = {}
+    for name in SCRIPTS:
+        scripts[name] = run_script(run_dir, name)
+        print(f"{n_rows:>12,} rows  {name:<15} {scripts[name]['wall_seconds']:9.2f}s", flush=True)
+
+    return {"rows": n_rows, "scripts": scripts}
+
+
+def git_commit() -> str:
+
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: Dict, baseline: Dict) -> List[Dict]:
+    """
+    One row per script and stage present in both runs at the same size:
+    baseline seconds, current seconds and their ratio (above 1 is slower).
+    """
+    baseline_runs = {run["rows"]: run for run in baseline["runs"]}
+    rows = []
+
+    for run in results["runs"]:
+        if run["rows"] not in baseline_runs:
+            continue
+
+        for name, script in run["scripts"].items():
+            before = baseline_runs[run["rows"]]["scripts"].get(name)
+            if before is None:
+                continue
+
+            timings = [("total", before["wall_seconds"], script["wall_seconds"])]
+            before_stages = {stage["stage"]: stage for stage in before["stages"]}
+            timings += [
+                (stage["stage"], before_stages[stage["stage"]]["wall_seconds"], stage["wall_seconds"])
+                for stage in script["stages"]
+                if stage["stage"] in before_stages
+            ]
+
+            for stage, before_seconds, seconds in timings:
+                rows.append({
+                    "rows": run["rows"],
+                    "script": name,
+                    "stage": stage,
+                    "baseline_seconds": round(before_seconds, 3),
+                    "seconds": round(seconds, 3),
+                    "ratio": round(seconds / before_seconds, 2) if before_seconds else None,
+                })
+
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on synthetic events")
+    parser.add_argument("sizes", nargs="*", type=lambda value: int(float(value)), default=SIZES)
+    parser.add_argument("--label", default=datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S"))
+    parser.add_argument("--baseline", help="Results file to compare against")
+    args = parser.parse_args()
+
+    results = {
+        "label": args.label,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "days": DAYS,
+        "runs": [benchmark_size(n_rows) for n_rows in args.sizes],
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_path = os.path.join(RESULTS_DIR, f"{args.label}.json")
+    with open(results_path, "w") as f:
+        json.dump(results, f, indent=2)
+    print("results:", results_path)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            comparison = pd.DataFrame(compare(results, json.load(f)))
+        print(comparison.to_string(index=False))
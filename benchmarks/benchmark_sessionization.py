@@ -0,0 +1,121 @@
+# Sessionization benchmark
+#
+# Times the integer sessionization kernel against the previous pandas
+# implementation (string identities, sort, two groupby passes) on events
+# from synthetic_events and checks that both assign the same session_id to
+# every event.
+#
+#   python benchmarks/benchmark_sessionization.py [n_events]
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import synthetic_events
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "part2-transformation"))
+from sessionization import encode_identities, sessionize
+
+SESSION_TIMEOUT_MINUTES = 30
+
+N_EVENTS = 10_000_000
+DAYS = 30
+SEED = 0
+
+
+def session_inputs(n_events: int, seed: int = SEED) -> pd.DataFrame:
+
+    # Client id and event time of the generated events, in shuffled row
+    # order so the kernel's sort is part of what is timed
+    events = synthetic_events.generate_events(n_events, DAYS, seed)
+    order = np.random.default_rng(seed).permutation(len(events))
+
+    return pd.DataFrame({
+        "client_id": events["client_id"].to_numpy()[order],
+        "event_ts": pd.to_datetime(events["timestamp"].to_numpy()[order], format="ISO8601", utc=True),
+    })
+
+
+def assign_session_ids_reference(events: pd.DataFrame) -> pd.Series:
+
+    # The pandas implementation assign_sessions used before the integer kernel
+    df = events.copy()
+
+    df["session_identity"] = np.where(
+        df["client_id"].notna(),
+        df["client_id"].astype(str),
+        "anon_event_" + df.index.astype(str)
+    )
+
+    df = df.sort_values(["session_identity", "event_ts"])
+
+    df["prev_event_ts"] = df.groupby("session_identity")["event_ts"].shift(1)
+    df["minutes_since_prev"] = (
+        (df["event_ts"] - df["prev_event_ts"])
+        .dt.total_seconds()
+        .div(60)
+    )
+    df["is_new_session"] = (
+        df["minutes_since_prev"].isna()
+        | (df["minutes_since_prev"] > SESSION_TIMEOUT_MINUTES)
+    ).astype(int)
+    df["session_index"] = df.groupby("session_identity")["is_new_session"].cumsum()
+
+    return df["session_identity"] + "_" + df["session_index"].astype(str)
+
+
+def assign_session_ids_kernel(events: pd.DataFrame) -> pd.Series:
+
+    identity_codes, decode_identities = encode_identities(events["client_id"])
+
+    order, session_key, session_index = sessionize(
+        identity_codes,
+        events["event_ts"].values.astype("datetime64[ns]", copy=False).view("int64"),
+        timeout_ns=SESSION_TIMEOUT_MINUTES * 60 * 10**9
+    )
+
+    first_events = np.flatnonzero(np.diff(session_key, prepend=-1))
+    session_ids = np.array(
+        [
+            f"{identity}_{index}"
+            for identity, index in zip(
+                decode_identities(identity_codes[order][first_events]).tolist(),
+                session_index[first_events].tolist()
+            )
+        ],
+        dtype=object
+    )
+
+    return pd.Series(session_ids[session_key], index=events.index[order])
+
+
+def measure(func, *args):
+
+    started = time.perf_counter()
+    result = func(*args)
+
+    return result, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    n_events = int(float(sys.argv[1])) if len(sys.argv) > 1 else N_EVENTS
+
+    events = session_inputs(n_events)
+
+    kernel_ids, kernel_seconds = measure(assign_session_ids_kernel, events)
+    reference_ids, reference_seconds = measure(assign_session_ids_reference, events)
+
+    # Same order and same id for every event
+    assert kernel_ids.index.equals(reference_ids.index)
+    assert (kernel_ids.to_numpy() == reference_ids.to_numpy()).all()
+
+    print({
+        "events": n_events,
+        "sessions": int(kernel_ids.nunique()),
+        "reference_seconds": round(reference_seconds, 2),
+        "kernel_seconds": round(kernel_seconds, 2),
+        "speedup": round(reference_seconds / kernel_seconds, 1),
+    })
@@ -0,0 +1,72 @@
+# Timestamp parsing benchmark
+#
+# Times parse_timestamps against pd.to_datetime(errors="coerce", utc=True) on
+# the timestamp column of synthetic_events and checks that both give the
+# same values and the same invalid_count the validator reports.
+#
+#   python benchmarks/benchmark_timestamp_parsing.py [n_rows]
+
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import synthetic_events
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "part1-data-quality"))
+from timestamp_parsing import parse_timestamps
+
+N_ROWS = 5_000_000
+DAYS = 30
+INVALID_SHARE = 0.001
+OTHER_FORMAT_SHARE = 0.001
+
+
+def synthetic_timestamps(n_rows: int, seed: int = 0) -> pd.Series:
+
+    # The generated events' timestamps, in the export's format, with a few
+    # unparseable values and a few in another layout
+    rng = np.random.default_rng(seed)
+
+    values = synthetic_events.generate_events(n_rows, DAYS, seed)["timestamp"]
+
+    other = rng.random(n_rows) < OTHER_FORMAT_SHARE
+    values[other] = pd.to_datetime(values[other], format="ISO8601").dt.strftime("%Y-%m-%d %H:%M:%S")
+
+    values[rng.random(n_rows) < INVALID_SHARE] = "not a timestamp"
+
+    return values
+
+
+def measure(func, *args):
+
+    started = time.perf_counter()
+    result = func(*args)
+
+    return result, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    n_rows = int(float(sys.argv[1])) if len(sys.argv) > 1 else N_ROWS
+
+    values = synthetic_timestamps(n_rows)
+
+    fast, fast_seconds = measure(parse_timestamps, values)
+    reference, reference_seconds = measure(
+        lambda column: pd.to_datetime(column, errors="coerce", utc=True),
+        values
+    )
+
+    # Same timestamps, same invalid_count
+    assert fast.equals(reference)
+    assert int(fast.isna().sum()) == int(reference.isna().sum())
+
+    print({
+        "rows": n_rows,
+        "invalid_count": int(fast.isna().sum()),
+        "reference_seconds": round(reference_seconds, 2),
+        "fast_seconds": round(fast_seconds, 2),
+        "speedup": round(reference_seconds / fast_seconds, 1),
+    })
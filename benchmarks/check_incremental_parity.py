@@ -0,0 +1,133 @@
+# Incremental run parity check
+#
+# Checks that adding the input files one day at a time with INCREMENTAL_MODE
+# builds the same fact tables as one run from scratch over all of them: on
+# synthetic_events files, and on a small fixture whose sessions cross
+# midnight, so the sessions a new file continues are reopened and
+# renumbered. Each run works in its own folder under a temporary directory.
+# Exits non-zero on the first table that differs.
+#
+#   python benchmarks/check_incremental_parity.py [n_rows]
+
+import os
+import shutil
+import sys
+import tempfile
+from typing import Dict
+
+import pandas as pd
+
+import synthetic_events
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "part2-transformation"))
+import transformation_pipeline as pipeline
+from table_storage import read_table
+
+N_ROWS = 20_000
+DAYS = 4
+SEED = 0
+
+FACT_TABLES = ["events_with_sessions", "sessions", "fact_conversions", "fact_attribution"]
+
+HEADER = "client_id,page_url,referrer,timestamp,event_name,event_data,user_agent\n"
+
+# Clients a and b each have closed sessions on the first day and one still
+# open at midnight, which the second day's events continue
+MIDNIGHT_FIXTURE = {
+    "events_20250301.csv": HEADER + (
+        "a,https://puffy.com/,,2025-03-01T08:00:00.000000Z,page_viewed,,Mozilla/5.0 (iPhone)\n"
+        "a,https://puffy.com/?utm_source=google&utm_medium=cpc,https://www.google.com/,"
+        "2025-03-01T23:50:00.000000Z,page_viewed,,Mozilla/5.0 (iPhone)\n"
+        "b,https://puffy.com/,,2025-03-01T01:00:00.000000Z,page_viewed,,Mozilla/5.0 (Windows NT 10.0)\n"
+        "b,https://puffy.com/checkout,https://puffy.com/,2025-03-01T01:05:00.000000Z,checkout_completed,"
+        "\"{\"\"transaction_id\"\": \"\"t0\"\", \"\"revenue\"\": 50.0}\",Mozilla/5.0 (Windows NT 10.0)\n"
+        "b,https://puffy.com/?utm_source=facebook&utm_medium=social,,"
+        "2025-03-01T05:00:00.000000Z,page_viewed,,Mozilla/5.0 (Windows NT 10.0)\n"
+        "b,https://puffy.com/,,2025-03-01T23:55:00.000000Z,page_viewed,,Mozilla/5.0 (Windows NT 10.0)\n"
+    ),
+    "events_20250302.csv": HEADER + (
+        "a,https://puffy.com/products/mattress,https://puffy.com/,"
+        "2025-03-02T00:05:00.000000Z,page_viewed,,Mozilla/5.0 (iPhone)\n"
+        "a,https://puffy.com/checkout,https://puffy.com/,2025-03-02T00:10:00.000000Z,checkout_completed,"
+        "\"{\"\"transaction_id\"\": \"\"t1\"\", \"\"revenue\"\": 100.0}\",Mozilla/5.0 (iPhone)\n"
+        "b,https://puffy.com/products/pillow,https://puffy.com/,"
+        "2025-03-02T00:05:00.000000Z,page_viewed,,Mozilla/5.0 (Windows NT 10.0)\n"
+    ),
+}
+
+
+def run_pipeline(run_dir: str, input_folder: str, incremental: bool) -> None:
+
+    # The pipeline writes its tables and state to the working directory
+    cwd = os.getcwd()
+    os.chdir(run_dir)
+    try:
+        pipeline.TransformationPipeline(
+            folder_path=input_folder,
+            incremental=incremental,
+            cache_dir=None
+        ).run()
+    finally:
+        os.chdir(cwd)
+
+
+def fact_tables(run_dir: str) -> Dict[str, pd.DataFrame]:
+
+    return {table: read_table(table, run_dir) for table in FACT_TABLES}
+
+
+def check(input_folder: str, work_dir: str) -> int:
+    """
+    Runs the pipeline on input_folder from scratch and one file at a time,
+    and compares the fact tables. Returns the number of rows compared.
+    """
+    input_files = sorted(os.listdir(input_folder))
+
+    full_dir = os.path.join(work_dir, "full")
+    os.makedirs(full_dir)
+    run_pipeline(full_dir, os.path.abspath(input_folder), incremental=False)
+
+    incremental_dir = os.path.join(work_dir, "incremental")
+    arrived = os.path.join(incremental_dir, "event-file-input")
+    os.makedirs(arrived)
+    for file_name in input_files:
+        shutil.copy(os.path.join(input_folder, file_name), arrived)
+        run_pipeline(incremental_dir, arrived, incremental=True)
+
+    expected = fact_tables(full_dir)
+    actual = fact_tables(incremental_dir)
+    compared = 0
+
+    for table in FACT_TABLES:
+        try:
+            pd.testing.assert_frame_equal(actual[table], expected[table])
+        except AssertionError as error:
+            raise AssertionError(
+                f"{table} of {os.path.basename(input_folder)}: incremental run differs from full run\n{error}"
+            ) from None
+        compared += len(expected[table])
+
+    return compared
+
+
+if __name__ == "__main__":
+    n_rows = int(float(sys.argv[1])) if len(sys.argv) > 1 else N_ROWS
+
+    pipeline.PROFILER.enabled = False
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        fixture = os.path.join(work_dir, "midnight_fixture")
+        os.makedirs(fixture)
+        for file_name, content in MIDNIGHT_FIXTURE.items():
+            with open(os.path.join(fixture, file_name), "w") as f:
+                f.write(content)
+
+        synthetic = os.path.join(work_dir, "synthetic")
+        synthetic_events.write_event_files(synthetic, n_rows, DAYS, SEED)
+
+        checked = (
+            check(fixture, os.path.join(work_dir, "midnight_fixture_runs"))
+            + check(synthetic, os.path.join(work_dir, "synthetic_runs"))
+        )
+
+    print(f"Incremental runs match full runs on {checked:,} fact table rows")
@@ -0,0 +1,110 @@
+# UTM extraction parity check
+#
+# Checks that the columnar extract_utm_columns gives the same UTM values as
+# the per-URL reference extract_utm_params: on hand-picked edge cases
+# (percent-encoded keys and values, repeated keys, fragments, empty values,
+# missing URLs) and on random URLs assembled from the same pieces. Exits
+# non-zero on the first mismatch.
+#
+#   python benchmarks/check_utm_parity.py [n_random_urls]
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "part2-transformation"))
+from transformation_pipeline import UTM_PARAMS, extract_utm_columns, extract_utm_params
+
+N_RANDOM_URLS = 20_000
+SEED = 0
+
+EDGE_CASE_URLS = [
+    None,
+    np.nan,
+    "",
+    "https://puffy.com/",
+    "https://puffy.com/?",
+    "https://puffy.com/?utm_source=google&utm_medium=cpc&utm_campaign=spring&utm_content=banner",
+    # Percent-encoded keys and values
+    "https://puffy.com/?utm%5Fsource=google&utm_medium=cpc",
+    "https://puffy.com/?utm_sourc%65=google",
+    "https://puffy.com/?%75tm_source=a&utm_source=b",
+    "https://puffy.com/?utm_campaign=x%20y&utm_content=a+b",
+    "https://puffy.com/?utm_campaign=%zz&utm_source=%E2%9C%93",
+    "https://puffy.com/?utm_source=100%25",
+    # Repeated keys: the first value wins, skipping empty ones
+    "https://puffy.com/?utm_source=a&utm_source=b",
+    "https://puffy.com/?utm_source=&utm_source=b",
+    "https://puffy.com/?utm_source&utm_source=b",
+    # Fragments
+    "https://puffy.com/?utm_source=a#utm_medium=b",
+    "https://puffy.com/#?utm_source=a",
+    "https://puffy.com/?utm_source=a#frag?utm_medium=b",
+    # Empty values and bare keys
+    "https://puffy.com/?utm_source=&utm_medium=cpc",
+    "https://puffy.com/?utm_source&utm_medium",
+    "https://puffy.com/?utm_source==x",
+    # Look-alike keys and separators
+    "https://puffy.com/?xutm_source=a&utm_sourcex=b",
+    "https://puffy.com/?UTM_SOURCE=a",
+    "https://puffy.com/?utm_source=a;utm_medium=b",
+    "https://puffy.com/?&&utm_source=a&&",
+    "https://puffy.com/?a=1?utm_source=b",
+    "https://puffy.com/?utm_source=a=b",
+    # Characters urlsplit strips
+    "https://puffy.com/?utm_\tsource=a&utm_medium=b\n",
+    "https://puffy.com/?utm_source=a\r&utm_medium=c",
+]
+
+# Pieces random URLs are assembled from
+KEYS = UTM_PARAMS + ["utm%5Fsource", "utm_sourc%65", "UTM_SOURCE", "xutm_medium", "ref", ""]
+VALUES = ["google", "", "a+b", "x%20y", "%zz", "%E2%9C%93", "a=b", "100%25", "?", "#frag", "\t"]
+SEPARATORS = ["&&", ";", "=", "#", "?"]
+
+
+def random_urls(n_urls: int, seed: int = SEED) -> list:
+
+    rng = np.random.default_rng(seed)
+    urls = []
+
+    for _ in range(n_urls):
+        query = ""
+        for _ in range(rng.integers(0, 6)):
+            if query:
+                query += SEPARATORS[rng.integers(len(SEPARATORS))] if rng.random() < 0.2 else "&"
+            query += KEYS[rng.integers(len(KEYS))]
+            if rng.random() < 0.9:
+                query += "=" + VALUES[rng.integers(len(VALUES))]
+        urls.append("https://puffy.com/p?" + query)
+
+    return urls
+
+
+def check(urls: list) -> int:
+    """
+    Compares both extractors on urls. Returns the number of URLs checked.
+    """
+    columns = extract_utm_columns(pd.Series(urls, dtype=object)).astype(object)
+
+    for position, url in enumerate(urls):
+        expected = extract_utm_params(url)
+        for param in UTM_PARAMS:
+            value = columns[param].iloc[position]
+            value = None if pd.isna(value) else value
+            if value != expected[param]:
+                raise AssertionError(
+                    f"{param} of {url!r}: extract_utm_columns gave {value!r}, "
+                    f"extract_utm_params gave {expected[param]!r}"
+                )
+
+    return len(urls)
+
+
+if __name__ == "__main__":
+    n_random_urls = int(float(sys.argv[1])) if len(sys.argv) > 1 else N_RANDOM_URLS
+
+    checked = check(EDGE_CASE_URLS) + check(random_urls(n_random_urls))
+
+    print(f"extract_utm_columns matches extract_utm_params on {checked:,} URLs")
@@ -0,0 +1,264 @@
+# Synthetic event generator
+#
+# Writes event CSVs shaped like the exports SCHEMA_CONTRACT describes, one
+# file per day (events_YYYYMMDD.csv), at any scale. Events arrive in visits:
+# a visitor (a known client or anonymous), a start time, then events spread
+# over the next VISIT_MINUTES. A visit may land on a UTM-tagged URL, and a
+# known client's visit may end in a checkout with a transaction in
+# event_data. Schema drift from the real exports can be injected: client_id
+# renamed to clientId and referrer dropped from a given day on.
+#
+# Every benchmark in this folder draws its inputs from here: the pipeline
+# benchmark from the files, the kernel benchmarks from generate_events.
+#
+#   python benchmarks/synthetic_events.py <output folder> [n_rows]
+
+import json
+import os
+import sys
+from typing import Dict, Iterator, Tuple
+
+import numpy as np
+import pandas as pd
+
+N_ROWS = 1_000_000
+DAYS = 7
+START_DATE = "2025-02-23"
+
+N_CLIENTS = 50_000  # Distinct client ids
+ANONYMOUS_SHARE = 0.2  # Share of visits without a client id
+UTM_SHARE = 0.4  # Share of visits whose landing URL carries UTM parameters
+N_USER_AGENTS = 50  # Distinct user agent strings
+CONVERSION_RATE = 0.03  # Share of visits that end in checkout_completed
+
+EVENTS_PER_VISIT = 5
+VISIT_MINUTES = 20
+EMPTY_EVENT_NAME_SHARE = 0.0  # Share of events with a blank event_name, which validation reports
+
+RENAME_CLIENT_ID_FROM_DAY = None  # Day index from which client_id is exported as clientId (the real exports: 5)
+DROP_REFERRER_FROM_DAY = None  # Day index from which referrer is missing (the real exports: 4)
+
+BLOCK_ROWS = 1_000_000  # Rows generated and written at a time
+
+UTM_SOURCES = {
+    "google": ["cpc", "organic"],
+    "facebook": ["social", "cpc"],
+    "instagram": ["social"],
+    "tiktok": ["social", "video"],
+    "email": ["newsletter", "crm"],
+    "affiliate": ["aff"],
+}
+UTM_CAMPAIGNS = ["spring_sale", "mattress_launch", "retargeting", "brand", "holiday_bundle"]
+UTM_CONTENTS = [None, "banner", "carousel", "video_a", "video_b"]
+
+PAGE_PATHS = ["", "products/mattress", "products/pillow", "products/bundle", "reviews", "cart", "checkout"]
+REFERRERS = [None, "https://www.google.com/", "https://www.facebook.com/", "https://www.instagram.com/", "https://t.co/"]
+
+PLATFORMS = [
+    ("Windows NT 10.0; Win64; x64", "Chrome/{v}.0.0.0 Safari/537.36"),
+    ("Macintosh; Intel Mac OS X 10_15_7", "Version/{v}.0 Safari/605.1.15"),
+    ("X11; Linux x86_64", "Firefox/{v}.0"),
+    ("iPhone; CPU iPhone OS 17_0 like Mac OS X", "Version/{v}.0 Mobile/15E148 Safari/604.1"),
+    ("iPad; CPU OS 17_0 like Mac OS X", "Version/{v}.0 Mobile/15E148 Safari/604.1"),
+    ("Linux; Android 14; Pixel 8", "Chrome/{v}.0.0.0 Mobile Safari/537.36"),
+    ("Windows NT 10.0; Win64; x64", "Edg/{v}.0.0.0"),
+]
+
+FUNNEL_EVENTS = ["page_viewed", "product_added_to_cart", "checkout_started", "checkout_completed"]
+BROWSE_EVENTS = ["page_viewed", "page_viewed", "page_viewed", "product_added_to_cart", "email_filled_on_popup"]
+
+
+def user_agent_pool(n_user_agents: int) -> np.ndarray:
+
+    # Platform and browser templates, cycled through browser versions
+    user_agents = []
+    for i in range(n_user_agents):
+        platform, browser = PLATFORMS[i % len(PLATFORMS)]
+        version = 100 + i // len(PLATFORMS)
+        user_agents.append(
+            f"Mozilla/5.0 ({platform}) AppleWebKit/537.36 (KHTML, like Gecko) {browser.format(v=version)}"
+        )
+
+    return np.array(user_agents, dtype=object)
+
+
+def landing_url_pool() -> np.ndarray:
+
+    urls = []
+    for source, mediums in UTM_SOURCES.items():
+        for medium in mediums:
+            for campaign in UTM_CAMPAIGNS:
+                for content in UTM_CONTENTS:
+                    query = f"utm_source={source}&utm_medium={medium}&utm_campaign={campaign}"
+                    if content is not None:
+                        query += f"&utm_content={content}"
+                    urls.append(f"https://puffy.com/?{query}")
+
+    return np.array(urls, dtype=object)
+
+
+def _visits(rng: np.random.Generator, n_rows: int) -> Tuple[np.ndarray, np.ndarray]:
+
+    # Visit of each event (sorted) and each event's position in its visit
+    n_visits = max(n_rows // EVENTS_PER_VISIT, 1)
+    visit = np.sort(rng.integers(0, n_visits, n_rows))
+
+    starts = np.flatnonzero(np.diff(visit, prepend=-1))
+    position = np.arange(n_rows) - np.repeat(starts, np.diff(np.append(starts, n_rows)))
+
+    return np.unique(visit, return_inverse=True)[1], position
+
+
+def generate_block(
+    rng: np.random.Generator,
+    n_rows: int,
+    day_start_ns: int,
+    transaction_prefix: str
+) -> pd.DataFrame:
+    """
+    n_rows events in whole visits starting on the day that begins at
+    day_start_ns, in (visit, time) order.
+    """
+    user_agents = user_agent_pool(N_USER_AGENTS)
+    landing_urls = landing_url_pool()
+
+    visit, position = _visits(rng, n_rows)
+    n_visits = visit.max() + 1 if n_rows else 0
+
+    visit_sizes = np.bincount(visit, minlength=n_visits)
+    is_last = position == visit_sizes[visit] - 1
+
+    # Visit attributes
+    visit_client = rng.integers(0, N_CLIENTS, n_visits)
+    visit_anonymous = rng.random(n_visits) < ANONYMOUS_SHARE
+    visit_utm = rng.random(n_visits) < UTM_SHARE
+    # Checkouts come from known clients, as in the exports
+    visit_converts = (rng.random(n_visits) < CONVERSION_RATE / (1 - ANONYMOUS_SHARE)) & ~visit_anonymous
+    visit_user_agent = rng.integers(0, N_USER_AGENTS, n_visits)
+    visit_landing = rng.integers(0, len(landing_urls), n_visits)
+    visit_referrer = rng.integers(0, len(REFERRERS), n_visits)
+    visit_start = rng.integers(0, 86_400, n_visits)
+
+    # Events
+    client_id = np.char.add("client_", visit_client[visit].astype(str)).astype(object)
+    client_id[visit_anonymous[visit]] = None
+
+    # Offsets into the visit, increasing within each visit
+    span = VISIT_MINUTES * 60
+    offsets = np.sort(visit * span + rng.integers(0, span, n_rows)) - visit * span
+    event_ns = day_start_ns + (visit_start[visit] + offsets) * 10**9
+    timestamp = np.char.add(
+        np.datetime_as_string(event_ns.astype("datetime64[ns]").astype("datetime64[us]"), unit="us"),
+        "Z"
+    ).astype(object)
+
+    paths = np.array(PAGE_PATHS)[rng.integers(0, len(PAGE_PATHS), n_rows)]
+    page_url = np.char.add("https://puffy.com/", paths).astype(object)
+    landing_with_utm = (position == 0) & visit_utm[visit]
+    page_url[landing_with_utm] = landing_urls[visit_landing[visit][landing_with_utm]]
+
+    referrer = np.array(REFERRERS, dtype=object)[visit_referrer[visit]]
+    referrer[position > 0] = "https://puffy.com/"
+
+    event_name = np.array(BROWSE_EVENTS, dtype=object)[rng.integers(0, len(BROWSE_EVENTS), n_rows)]
+
+    # Converting visits end in the checkout funnel
+    converts = visit_converts[visit]
+    steps_left = visit_sizes[visit] - 1 - position
+    funnel = converts & (steps_left < len(FUNNEL_EVENTS))
+    event_name[funnel] = np.array(FUNNEL_EVENTS, dtype=object)[len(FUNNEL_EVENTS) - 1 - steps_left[funnel]]
+
+    if EMPTY_EVENT_NAME_SHARE:
+        event_name[(rng.random(n_rows) < EMPTY_EVENT_NAME_SHARE) & ~(converts & is_last)] = " "
+
+    checkout = np.flatnonzero(converts & is_last)
+    revenue = np.round(rng.uniform(200, 2_500, len(checkout)), 2)
+    event_data = np.full(n_rows, None, dtype=object)
+    event_data[checkout] = [
+        json.dumps({"transaction_id": f"{transaction_prefix}{i}", "revenue": float(amount)})
+        for i, amount in enumerate(revenue)
+    ]
+
+    user_agent = user_agents[visit_user_agent[visit]]
+
+    return pd.DataFrame({
+        "client_id": client_id,
+        "page_url": page_url,
+        "referrer": referrer,
+        "timestamp": timestamp,
+        "event_name": event_name,
+        "event_data": event_data,
+        "user_agent": user_agent,
+    })
+
+
+def generate_event_files(
+    n_rows: int = N_ROWS,
+    days: int = DAYS,
+    seed: int = 0
+) -> Iterator[Tuple[str, int, pd.DataFrame]]:
+    """
+    Yields (file name, day index, block of events) in file order; a day's
+    file is the concatenation of its blocks.
+    """
+    day_seeds = np.random.SeedSequence(seed).spawn(days)
+    start_ns = pd.Timestamp(START_DATE, tz="UTC").value
+
+    for day in range(days):
+        rng = np.random.default_rng(day_seeds[day])
+        day_rows = n_rows // days + (1 if day < n_rows % days else 0)
+        day_start_ns = start_ns + day * 86_400 * 10**9
+        file_name = f"events_{pd.Timestamp(day_start_ns, tz='UTC'):%Y%m%d}.csv"
+
+        for block, first in enumerate(range(0, day_rows, BLOCK_ROWS)):
+            events = generate_block(
+                rng,
+                min(BLOCK_ROWS, day_rows - first),
+                day_start_ns,
+                transaction_prefix=f"t{day}_{block}_"
+            )
+            yield file_name, day, apply_drift(events, day)
+
+
+def generate_events(n_rows: int = N_ROWS, days: int = DAYS, seed: int = 0) -> pd.DataFrame:
+    """
+    Every generated event as one frame, in file order, for benchmarks that
+    run in memory instead of on files.
+    """
+    return pd.concat(
+        [events for _, _, events in generate_event_files(n_rows, days, seed)],
+        ignore_index=True
+    )
+
+
+def apply_drift(events: pd.DataFrame, day: int) -> pd.DataFrame:
+
+    if DROP_REFERRER_FROM_DAY is not None and day >= DROP_REFERRER_FROM_DAY:
+        events = events.drop(columns="referrer")
+
+    if RENAME_CLIENT_ID_FROM_DAY is not None and day >= RENAME_CLIENT_ID_FROM_DAY:
+        events = events.rename(columns={"client_id": "clientId"})
+
+    return events
+
+
+def write_event_files(folder: str, n_rows: int = N_ROWS, days: int = DAYS, seed: int = 0) -> Dict[str, int]:
+    """
+    Writes the generated files to folder. Returns the row count per file.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rows = {}
+
+    for file_name, _, events in generate_event_files(n_rows, days, seed):
+        path = os.path.join(folder, file_name)
+        events.to_csv(path, index=False, mode="a" if file_name in rows else "w", header=file_name not in rows)
+        rows[file_name] = rows.get(file_name, 0) + len(events)
+
+    return rows
+
+
+if __name__ == "__main__":
+    folder = sys.argv[1]
+    n_rows = int(float(sys.argv[2])) if len(sys.argv) > 2 else N_ROWS
+
+    print(write_event_files(folder, n_rows))
@@ -1,5 +1,20 @@
 FOLDER_PATH = "event-file-input"  # Edit path to the folder containing the event csvs. Make sure there are no other csvs there.
 
+STREAMING_MODE = False  # Validate each file in chunks of CHUNK_SIZE rows so memory stays flat on large files
+CHUNK_SIZE = 250_000
+
+VALIDATION_WORKERS = None  # Worker processes for validation; None uses every core, 1 validates serially in this process
+SPLIT_FILE_BYTES = 512 * 1024 * 1024  # Files larger than this are split into CHUNK_SIZE chunks across the workers
+
+SAMPLE_RATE = None  # Approximate mode: check this share of rows (e.g. 0.01) instead of every row; None scans every row
+SAMPLE_MIN_BYTES = 64 * 1024 * 1024  # Files smaller than this are always scanned in full
+SAMPLE_BLOCK_ROWS = 100  # Consecutive rows read from each random offset
+SAMPLE_CONFIDENCE = 0.95  # Confidence level of the estimated failure count intervals
+SAMPLE_SEED = 0
+
+PROFILE_STAGES = True  # Record time, CPU, peak memory and rows of each check and save them as a run manifest
+RUN_MANIFEST_DIR = "run_manifests"
+
 SCHEMA_CONTRACT = {
     "required_columns": [
         "client_id",
@@ -48,12 +63,16 @@ SCHEMA_CONTRACT = {
     "allow_extra_columns": False
 }
 
+from stage_profiler import PROFILER, profile_stage
+
+@profile_stage
 def check_schema(df, schema):
     expected = set(schema["columns"].keys())
     actual = set(df.columns)
 
-    missing = list(set(schema["required_columns"]) - actual)
-    unexpected = list(actual - expected) if not schema["allow_extra_columns"] else []
+    # Sorted so results are identical whichever process produced them
+    missing = sorted(set(schema["required_columns"]) - actual)
+    unexpected = sorted(actual - expected) if not schema["allow_extra_columns"] else []
 
     dtype_mismatches = []
     for col, rules in schema["columns"].items():
@@ -77,38 +96,16 @@ def check_schema(df, schema):
         }
     }
 
-def check_column_rules(df, schema):
-    failures = []
-
-    for col, rules in schema["columns"].items():
-        if col not in df.columns:
-            continue
-
-        series = df[col]
-
-        # Nullability
-        if not rules.get("nullable", True):
-            nulls = series.isna().sum()
-            if nulls > 0:
-                failures.append({
-                    "check": "not_null",
-                    "column": col,
-                    "null_count": int(nulls)
-                })
-
-        # Datetime parsing
-        if rules.get("parseable_datetime"):
-            parsed = pd.to_datetime(series, errors="coerce", utc=True)
-            invalid = parsed.isna().sum()
-            if invalid > 0:
-                failures.append({
-                    "check": "parseable_datetime",
-                    "column": col,
-                    "invalid_count": int(invalid)
-                })
-
-    return failures
+@profile_stage
+def check_column_rules(df, schema, parsed=None, masks=None):
+    # The contract's column and cross-column rules, compiled into vectorized
+    # checks by the rule engine (see validation_rules.py for the rule keys).
+    # parsed, when given, receives the parsed values of each parseable_datetime
+    # column so callers can reuse them instead of parsing the column again;
+    # masks, when given, receives each check's row-level violation mask
+    return evaluate_contract(df, schema, parsed, masks)
 
+@profile_stage
 def check_event_semantics(df):
     failures = []
 
@@ -124,14 +121,14 @@ def check_event_semantics(df):
 
 from datetime import datetime
 
-def validate_events_csv(df, file_name, schema):
+def validate_events_csv(df, file_name, schema, parsed=None):
     results = []
 
     schema_result = check_schema(df, schema)
     if not schema_result["success"]:
         results.append(schema_result)
 
-    results.extend(check_column_rules(df, schema))
+    results.extend(check_column_rules(df, schema, parsed))
     results.extend(check_event_semantics(df))
 
     return {
@@ -142,23 +139,385 @@ def validate_events_csv(df, file_name, schema):
         "failed_checks": results
     }
 
+import numpy as np
 import pandas as pd
 import glob
 import os
+from schema_index import SCHEMA_INDEX_PATH, build_schema_index, drift_transitions
+from validation_rules import evaluate_contract, plan_checks
+
+def summarize_chunk(df, schema, parsed=None):
+    # Per-chunk failure counts and dtypes, small enough to send back from a worker process.
+    # Columns that must be unique also send their distinct values, since
+    # duplicates can span chunks.
+    return {
+        "row_count": len(df),
+        "dtypes": dict(df.dtypes),
+        "failures": check_column_rules(df, schema, parsed) + check_event_semantics(df),
+        "unique_values": {
+            col: pd.unique(df[col].dropna())
+            for col, rules in schema["columns"].items()
+            if rules.get("unique") and col in df.columns
+        },
+    }
+
+def merge_chunk_summaries(file_name, summaries, schema):
+    # Same result as validate_events_csv on the whole file, built from chunk summaries.
+    # Counts are summed across chunks and column dtypes are widened the way
+    # read_csv would widen them over the full file.
+    row_count = 0
+    dtypes = {}
+    failures = {}
+    unique_values = {}
+
+    for summary in summaries:
+        row_count += summary["row_count"]
+
+        for col, values in summary.get("unique_values", {}).items():
+            unique_values.setdefault(col, []).append(values)
+
+        for col, dtype in summary["dtypes"].items():
+            if col in dtypes and dtypes[col] != dtype:
+                dtype = np.result_type(dtypes[col], dtype)
+            dtypes[col] = dtype
+
+        for failure in summary["failures"]:
+            key = (failure["check"], failure.get("column"))
+            count_key = "null_count" if "null_count" in failure else "invalid_count"
+
+            if key in failures:
+                failures[key][count_key] += failure[count_key]
+            else:
+                failures[key] = dict(failure)
+
+    # Non-missing values of a unique column less its distinct values across all chunks
+    for col, chunk_values in unique_values.items():
+        non_missing = sum(len(values) for values in chunk_values)
+        if ("unique", col) in failures:
+            non_missing += failures[("unique", col)]["invalid_count"]
+
+        duplicates = non_missing - len(pd.unique(np.concatenate(chunk_values)))
+        failures.pop(("unique", col), None)
+        if duplicates > 0:
+            failures[("unique", col)] = {"check": "unique", "column": col, "invalid_count": duplicates}
+
+    results = []
+
+    # Schema only depends on the header and dtypes, so check an empty frame that carries them
+    header = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in dtypes.items()})
+    schema_result = check_schema(header, schema)
+    if not schema_result["success"]:
+        results.append(schema_result)
+
+    # Emit failures in the same order as the single-pass validator
+    for key in plan_checks(schema, dtypes) + [("event_name_not_empty", None)]:
+        if key in failures:
+            results.append(failures[key])
+
+    return {
+        "file": file_name,
+        "validated_at": datetime.utcnow().isoformat(),
+        "row_count": row_count,
+        "success": len(results) == 0,
+        "failed_checks": results
+    }
+
+def validate_events_csv_chunked(file_path, schema, chunksize=CHUNK_SIZE):
+    # Chunks are summarized lazily, so only one is in memory at a time
+    summaries = (
+        summarize_chunk(chunk, schema)
+        for chunk in pd.read_csv(file_path, chunksize=chunksize)
+    )
+
+    return merge_chunk_summaries(os.path.basename(file_path), summaries, schema)
+
+# Sampled validation
+#
+# With SAMPLE_RATE set, large files are checked on a stratified sample: the
+# data is cut into equal byte ranges and SAMPLE_BLOCK_ROWS rows are read from
+# a random offset in each, so only the sampled bytes are read. The exports
+# hold one record per line, which is what lets a read start mid-file.
+# Schema drift only needs the header, so the column set is checked exactly
+# from the header row. Column rules report estimated failure counts with
+# confidence intervals; any violation in the sample (including a dtype that
+# does not match the contract) escalates the file to a full scan.
+
+import io
+import math
+from statistics import NormalDist
+
+def wilson_interval(failures, n, confidence):
+    # Wilson score interval for a proportion; well behaved at zero failures
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    p = failures / n
+    denominator = 1 + z ** 2 / n
+    centre = (p + z ** 2 / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z ** 2 / (4 * n ** 2)) / denominator
+
+    return max(0.0, centre - half_width), min(1.0, centre + half_width)
+
+def read_sample_lines(file_path, rate, block_rows, seed):
+    # Returns the header line, the sampled data lines and the estimated number of data rows
+    rng = np.random.default_rng(seed)
+    size = os.path.getsize(file_path)
+
+    with open(file_path, "rb") as f:
+        header = f.readline()
+        data_start = f.tell()
+
+        # Row width from the first block sizes the number of strata
+        head = [f.readline() for _ in range(block_rows)]
+        head = [line for line in head if line]
+        if not head:
+            return header, [], 0
+
+        line_bytes = sum(map(len, head)) / len(head)
+        n_strata = max(1, math.ceil(rate * (size - data_start) / line_bytes / block_rows))
+        bounds = np.linspace(data_start, size, n_strata + 1).astype(np.int64)
+
+        lines = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            f.seek(int(rng.integers(start, end)) if end > start else int(start))
+            if f.tell() > data_start:
+                f.readline()  # Partial line
+
+            # Lines starting inside the stratum, so strata never overlap
+            for _ in range(block_rows):
+                if f.tell() >= end:
+                    break
+                line = f.readline()
+                if not line:
+                    break
+                lines.append(line)
 
-all_results = []
+    if lines:
+        line_bytes = sum(map(len, lines)) / len(lines)
 
-for file_path in glob.glob(os.path.join(FOLDER_PATH, "*.csv")):
+    return header, lines, round((size - data_start) / line_bytes)
+
+def validate_file_sampled(file_path, schema, rate=None):
+    rate = rate or SAMPLE_RATE
     file_name = os.path.basename(file_path)
 
+    if os.path.getsize(file_path) < SAMPLE_MIN_BYTES or rate >= 1:
+        return validate_file(file_path, schema, sampled=False)
+
+    header, lines, estimated_rows = read_sample_lines(file_path, rate, SAMPLE_BLOCK_ROWS, SAMPLE_SEED)
+    sample = pd.read_csv(io.BytesIO(header + b"".join(lines)))
+
+    # Exact: the column set comes from the header alone
+    columns = pd.read_csv(io.BytesIO(header), nrows=0).columns
+    results = []
+    schema_result = check_schema(
+        pd.DataFrame({col: pd.Series(dtype=sample[col].dtype) for col in columns}),
+        schema
+    )
+    details = schema_result["details"]
+    if details["missing_columns"] or details["unexpected_columns"]:
+        results.append({
+            "check": "schema",
+            "success": False,
+            "details": {**details, "dtype_mismatches": []}
+        })
+
+    observed = {
+        (failure["check"], failure.get("column")): failure.get("null_count", failure.get("invalid_count"))
+        for failure in check_column_rules(sample, schema) + check_event_semantics(sample)
+    }
+
+    estimated_failures = []
+    for check, col in plan_checks(schema, columns) + [("event_name_not_empty", None)]:
+        failures = observed.get((check, col), 0)
+        low, high = wilson_interval(failures, len(sample), SAMPLE_CONFIDENCE) if len(sample) else (0.0, 1.0)
+        estimated_failures.append({
+            "check": check,
+            "column": col,
+            "sample_count": int(failures),
+            "estimated_count": round(failures / len(sample) * estimated_rows) if len(sample) else 0,
+            "interval": [math.floor(low * estimated_rows), math.ceil(high * estimated_rows)],
+        })
+
+    sample_report = {
+        "rate": rate,
+        "rows": len(sample),
+        "confidence": SAMPLE_CONFIDENCE,
+        "estimated_failures": estimated_failures,
+        "escalated": bool(observed or details["dtype_mismatches"]),
+    }
+
+    # Any violation in the sample: exact counts from a full scan
+    if sample_report["escalated"]:
+        result = validate_file(file_path, schema, sampled=False)
+        result["sample"] = sample_report
+        return result
+
+    return {
+        "file": file_name,
+        "validated_at": datetime.utcnow().isoformat(),
+        "row_count": estimated_rows,
+        "approximate": True,
+        "success": len(results) == 0,
+        "failed_checks": results,
+        "sample": sample_report,
+    }
+
+def validate_file(file_path, schema, sampled=True):
+    if sampled and SAMPLE_RATE:
+        return validate_file_sampled(file_path, schema)
+
+    if STREAMING_MODE:
+        return validate_events_csv_chunked(file_path=file_path, schema=schema)
+
     df = pd.read_csv(file_path)
 
-    validation_result = validate_events_csv(
+    return validate_events_csv(
         df=df,
-        file_name=file_name,
-        schema=SCHEMA_CONTRACT
+        file_name=os.path.basename(file_path),
+        schema=schema
     )
 
-    all_results.append(validation_result)
+# Parallel validation
+#
+# Files are independent, so each one is validated in its own worker process.
+# Files larger than SPLIT_FILE_BYTES are read here in CHUNK_SIZE chunks and the
+# chunks are spread over the workers instead, then merged back per file.
+
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+def _timed_task(func, *args):
+    # Stage timings recorded in the worker travel back with the task timing
+    PROFILER.reset()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    result = func(*args)
+
+    timing = {
+        "pid": os.getpid(),
+        "wall_seconds": time.perf_counter() - wall_start,
+        "cpu_seconds": time.process_time() - cpu_start,
+        "stages": PROFILER.snapshot(),
+    }
+
+    return result, timing
+
+def summarize_worker_timings(timings, wall_seconds):
+    workers = {}
+
+    for timing in timings:
+        PROFILER.merge(timing.pop("stages", []))
+
+        worker = workers.setdefault(timing["pid"], {
+            "pid": timing["pid"],
+            "tasks": 0,
+            "rows": 0,
+            "wall_seconds": 0.0,
+            "cpu_seconds": 0.0,
+        })
+        worker["tasks"] += 1
+        worker["rows"] += timing["rows"]
+        worker["wall_seconds"] += timing["wall_seconds"]
+        worker["cpu_seconds"] += timing["cpu_seconds"]
+
+    for worker in workers.values():
+        worker["rows_per_second"] = (
+            worker["rows"] / worker["wall_seconds"] if worker["wall_seconds"] else 0.0
+        )
+
+    total_rows = sum(worker["rows"] for worker in workers.values())
+
+    return {
+        "workers": sorted(workers.values(), key=lambda worker: worker["pid"]),
+        "wall_seconds": wall_seconds,
+        "rows": total_rows,
+        "rows_per_second": total_rows / wall_seconds if wall_seconds else 0.0,
+    }
+
+def run_parallel_validation(file_paths, schema, workers=None):
+    """
+    Validates file_paths across a pool of worker processes.
+    Returns the per-file results in file_paths order and a timing report
+    with wall time and rows per second for each worker.
+    """
+    started = time.perf_counter()
+    timings = []
+    results = []
+
+    max_workers = workers or os.cpu_count()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+
+        # Submit whole files first so the pool is busy while large files are being split
+        pending = []
+        for file_path in file_paths:
+            # Sampled files are read in one task: only the sample is read unless it escalates
+            if os.path.getsize(file_path) > SPLIT_FILE_BYTES and not SAMPLE_RATE:
+                pending.append((file_path, None))
+            else:
+                pending.append((file_path, pool.submit(_timed_task, validate_file, file_path, schema)))
+
+        for file_path, future in pending:
+            if future is not None:
+                result, timing = future.result()
+                timing["rows"] = result["row_count"]
+                timings.append(timing)
+                results.append(result)
+                continue
+
+            # Keep at most two chunks per worker in flight to bound memory
+            summaries = []
+            in_flight = deque()
+
+            def collect(chunk_future):
+                summary, timing = chunk_future.result()
+                timing["rows"] = summary["row_count"]
+                timings.append(timing)
+                summaries.append(summary)
+
+            for chunk in pd.read_csv(file_path, chunksize=CHUNK_SIZE):
+                in_flight.append(pool.submit(_timed_task, summarize_chunk, chunk, schema))
+                if len(in_flight) >= 2 * max_workers:
+                    collect(in_flight.popleft())
+
+            while in_flight:
+                collect(in_flight.popleft())
+
+            results.append(
+                merge_chunk_summaries(os.path.basename(file_path), summaries, schema)
+            )
+
+    return results, summarize_worker_timings(timings, time.perf_counter() - started)
+
+
+def main() -> None:
+    PROFILER.enabled = PROFILE_STAGES
+    file_paths = sorted(glob.glob(os.path.join(FOLDER_PATH, "*.csv")))
+
+    # Drift between consecutive files, from headers and small samples only
+    schema_index = build_schema_index(file_paths, SCHEMA_INDEX_PATH)
+    print({
+        "indexed_files": len(schema_index),
+        "reused_fingerprints": sum(entry["reused"] for entry in schema_index.values()),
+        "drift_transitions": drift_transitions(schema_index),
+    })
+
+    if VALIDATION_WORKERS == 1:
+        all_results = [validate_file(file_path, SCHEMA_CONTRACT) for file_path in file_paths]
+    else:
+        all_results, worker_report = run_parallel_validation(
+            file_paths,
+            SCHEMA_CONTRACT,
+            workers=VALIDATION_WORKERS
+        )
+        print(worker_report)
+
+    print(all_results)
+
+    if PROFILE_STAGES:
+        print("run manifest:", PROFILER.write_run_manifest(RUN_MANIFEST_DIR, "validation", files=len(file_paths)))
+
 
-print(all_results)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
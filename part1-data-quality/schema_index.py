@@ -0,0 +1,163 @@
+# Schema fingerprint index
+#
+# Records the header and the dtypes of a small sample of each input file,
+# keyed by the file's sha256, in a JSON index file. Drift (dropped, added,
+# renamed or retyped columns) is reported from the index in one pass,
+# without loading whole files. Files whose size and mtime match
+# the index are not opened again; a changed file is hashed, and a known hash
+# (a renamed or copied file) reuses its entry without reading the data.
+#
+# file_fingerprint is also how the transformation's incremental runs tell
+# which input files changed.
+
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List
+
+import pandas as pd
+
+SCHEMA_INDEX_PATH = "schema_index.json"  # Header and sample dtypes of every input file, reused while a file is unchanged; None disables the index
+SCHEMA_SAMPLE_ROWS = 1_000  # Rows read per file to infer dtypes
+
+INDEX_VERSION = 1
+
+
+def file_fingerprint(file_path: str, known: Dict = None) -> Dict:
+    """
+    Name, size, mtime and sha256 of a file. The sha256 of known, an earlier
+    fingerprint of the same file, is reused while its size and mtime match.
+    """
+    stat = os.stat(file_path)
+
+    # Size and mtime are enough to skip hashing unchanged files
+    if known and known["size"] == stat.st_size and known["mtime"] == stat.st_mtime:
+        digest = known["sha256"]
+    else:
+        sha256 = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                sha256.update(block)
+        digest = sha256.hexdigest()
+
+    return {
+        "name": os.path.basename(file_path),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": digest,
+    }
+
+
+def read_fingerprint(file_path: str, sample_rows: int = SCHEMA_SAMPLE_ROWS) -> Dict:
+    """
+    Columns in header order and the dtypes read_csv infers for the first
+    sample_rows rows.
+    """
+    sample = pd.read_csv(file_path, nrows=sample_rows)
+
+    return {
+        "columns": list(sample.columns),
+        "dtypes": {col: str(dtype) for col, dtype in sample.dtypes.items()},
+        "sample_rows": len(sample),
+    }
+
+
+def load_schema_index(index_path: str) -> Dict:
+
+    if index_path and os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index.get("version") == INDEX_VERSION:
+            return index
+
+    return {"version": INDEX_VERSION, "fingerprints": {}, "files": {}}
+
+
+def build_schema_index(file_paths: List[str], index_path: str = None) -> Dict[str, Dict]:
+    """
+    Returns the fingerprint of each file, by path, in file_paths order.
+    With index_path given, the index is read from and saved back to it so
+    unchanged files are skipped on later runs. Each entry also carries the
+    file's size and mtime and says whether it was reused from the index.
+    """
+    index = load_schema_index(index_path)
+    entries = {}
+
+    for file_path in file_paths:
+        name = os.path.basename(file_path)
+        fingerprint = file_fingerprint(file_path, index["files"].get(name))
+        sha256 = fingerprint["sha256"]
+
+        reused = sha256 in index["fingerprints"]
+        if not reused:
+            index["fingerprints"][sha256] = read_fingerprint(file_path)
+
+        index["files"][name] = {"size": fingerprint["size"], "mtime": fingerprint["mtime"], "sha256": sha256}
+        entries[file_path] = {
+            "file": name,
+            "size": fingerprint["size"],
+            "mtime": fingerprint["mtime"],
+            "sha256": sha256,
+            "reused": reused,
+            **index["fingerprints"][sha256],
+        }
+
+    if index_path:
+        with open(index_path, "w") as f:
+            json.dump(index, f, indent=2)
+
+    return entries
+
+
+def _normalized(col: str) -> str:
+
+    # client_id, clientId and ClientID all normalize to clientid
+    return re.sub(r"[^a-z0-9]", "", col.lower())
+
+
+def drift_transitions(entries: Dict[str, Dict]) -> List[Dict]:
+    """
+    Compares each file's fingerprint with the previous file's and returns
+    one transition per change: columns added, removed, renamed (a removed
+    and an added column that differ only in case or punctuation) and
+    dtype changes of columns both files share.
+    """
+    transitions = []
+    previous = None
+
+    for entry in entries.values():
+        if previous is not None:
+            before = previous["columns"]
+            after = entry["columns"]
+
+            added = [col for col in after if col not in before]
+            removed = [col for col in before if col not in after]
+
+            renamed = []
+            for old in list(removed):
+                matches = [new for new in added if _normalized(new) == _normalized(old)]
+                if matches:
+                    renamed.append({"from": old, "to": matches[0]})
+                    removed.remove(old)
+                    added.remove(matches[0])
+
+            dtype_changes = [
+                {"column": col, "from": previous["dtypes"][col], "to": entry["dtypes"][col]}
+                for col in after
+                if col in before and previous["dtypes"][col] != entry["dtypes"][col]
+            ]
+
+            if added or removed or renamed or dtype_changes:
+                transitions.append({
+                    "from_file": previous["file"],
+                    "to_file": entry["file"],
+                    "added_columns": added,
+                    "removed_columns": removed,
+                    "renamed_columns": renamed,
+                    "dtype_changes": dtype_changes,
+                })
+
+        previous = entry
+
+    return transitions
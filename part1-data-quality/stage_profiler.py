@@ -0,0 +1,195 @@
+# Stage profiling
+#
+# Pipeline stages are functions decorated with @profile_stage. Every call
+# records wall time, CPU time, peak RSS and the rows going in and out (rows
+# of the DataFrames passed in and returned), aggregated per stage name.
+# write_run_manifest saves them as a JSON run manifest, one file per run,
+# which monitoring compares against earlier runs.
+#
+# Peak RSS is the process high-water mark while the stage ran: on Linux it
+# is reset when an outermost stage starts, elsewhere it is the peak of the
+# process so far. Nested stages report the peak since the outermost began.
+
+import functools
+import json
+import os
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List
+
+import pandas as pd
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+def _reset_peak_rss() -> bool:
+
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mib() -> float:
+
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    if resource is None:
+        return None
+
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if os.uname().sysname == "Darwin" else peak / 1024
+
+
+def count_rows(value) -> int:
+    """
+    Rows of a DataFrame or Series, or of those inside a list or tuple
+    (a list of input frames, a tuple of returned tables); None otherwise.
+    """
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return len(value)
+
+    if isinstance(value, (list, tuple)):
+        counts = [count_rows(item) for item in value]
+        counts = [count for count in counts if count is not None]
+        return sum(counts) if counts else None
+
+    return None
+
+
+class StageProfiler:
+
+    def __init__(self):
+        self.enabled = True
+        self.stages: Dict[str, Dict] = {}
+        self._depth = 0
+
+    def profile(self, func: Callable = None, name: str = None) -> Callable:
+        """
+        Decorator recording every call of func as stage name
+        (func's name by default).
+        """
+        if func is None:
+            return functools.partial(self.profile, name=name)
+
+        stage = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not self.enabled:
+                return func(*args, **kwargs)
+
+            if self._depth == 0:
+                _reset_peak_rss()
+
+            self._depth += 1
+            wall_start = time.perf_counter()
+            cpu_start = time.process_time()
+            try:
+                result = func(*args, **kwargs)
+            finally:
+                self._depth -= 1
+
+            self.record(
+                stage,
+                wall_seconds=time.perf_counter() - wall_start,
+                cpu_seconds=time.process_time() - cpu_start,
+                peak_rss_mib=_peak_rss_mib(),
+                rows_in=count_rows(list(args) + list(kwargs.values())),
+                rows_out=count_rows(result),
+            )
+
+            return result
+
+        return wrapper
+
+    def record(self, stage: str, calls: int = 1, **metrics) -> None:
+
+        totals = self.stages.setdefault(stage, {
+            "stage": stage,
+            "calls": 0,
+            "wall_seconds": 0.0,
+            "cpu_seconds": 0.0,
+            "peak_rss_mib": None,
+            "rows_in": None,
+            "rows_out": None,
+        })
+        totals["calls"] += calls
+
+        for key, value in metrics.items():
+            if value is None:
+                continue
+            if key == "peak_rss_mib":
+                totals[key] = value if totals[key] is None else max(totals[key], value)
+            else:
+                totals[key] = value if totals[key] is None else totals[key] + value
+
+    def snapshot(self) -> List[Dict]:
+
+        return [dict(totals) for totals in self.stages.values()]
+
+    def merge(self, stages: List[Dict]) -> None:
+        """
+        Adds stage totals recorded elsewhere, e.g. in a worker process.
+        """
+        for totals in stages:
+            metrics = {key: value for key, value in totals.items() if key not in ("stage", "calls")}
+            self.record(totals["stage"], calls=totals["calls"], **metrics)
+
+    def reset(self) -> None:
+
+        self.stages = {}
+
+    def write_run_manifest(self, manifest_dir: str, script: str, **details) -> str:
+        """
+        Saves the stages recorded so far, and any details given (row counts,
+        settings), as manifest_dir/<script>-<UTC time>.json. Returns its path.
+        """
+        finished_at = datetime.now(timezone.utc)
+        manifest = {
+            "script": script,
+            "finished_at": finished_at.isoformat(),
+            "stages": self.snapshot(),
+            **details,
+        }
+
+        os.makedirs(manifest_dir, exist_ok=True)
+        path = os.path.join(manifest_dir, f"{script}-{finished_at:%Y%m%dT%H%M%S%f}.json")
+        with open(path, "w") as f:
+            json.dump(manifest, f, indent=2)
+
+        return path
+
+
+# Shared by every script in the process, so stages of imported modules land in the same manifest
+PROFILER = StageProfiler()
+profile_stage = PROFILER.profile
+
+
+def load_run_manifests(manifest_dir: str, script: str) -> List[Dict]:
+    """
+    The run manifests script wrote to manifest_dir, oldest first.
+    """
+    manifests = []
+
+    if not os.path.isdir(manifest_dir):
+        return manifests
+
+    for name in sorted(os.listdir(manifest_dir)):
+        if name.startswith(f"{script}-") and name.endswith(".json"):
+            with open(os.path.join(manifest_dir, name)) as f:
+                manifests.append(json.load(f))
+
+    return sorted(manifests, key=lambda manifest: manifest["finished_at"])
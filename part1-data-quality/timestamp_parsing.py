@@ -0,0 +1,186 @@
+# Timestamp parsing
+#
+# parse_timestamps gives the same result as
+#   pd.to_datetime(values, errors="coerce", utc=True)
+# (so invalid counts stay exact) but takes the fast routes pandas does not:
+#   - the format is guessed up front from the first value, the one pandas
+#     infers it from; a format sniffed from a wider sample could differ from
+#     pandas' and change which values come out NaT
+#   - distinct strings are parsed once and broadcast back when values repeat
+#   - values laid out exactly like an ISO 8601 UTC first value
+#     ("2025-02-23T02:17:51.000000Z") are decoded with vectorized arithmetic
+#     on their digits instead of strptime; everything else goes through
+#     pandas with the guessed format
+
+import numpy as np
+import pandas as pd
+from pandas.tseries.api import guess_datetime_format
+
+SAMPLE_SIZE = 1_000  # Values sampled to decide whether parsing distinct values pays off
+CACHE_UNIQUE_SHARE = 0.7  # Parse distinct values only when fewer than this share of the sample is unique
+ISO_BLOCK_SIZE = 1_000_000
+
+# Strings pandas skips when it looks for the value to infer the format from
+_NAT_STRINGS = {"", "NaT", "nat", "NAT", "nan", "NaN", "NAN"}
+
+# Inferred formats whose "Z"-suffixed values are decoded from their digits
+_ISO_UTC_FORMATS = {
+    "%Y-%m-%dT%H:%M:%S%z",
+    "%Y-%m-%dT%H:%M:%S.%f%z",
+    "%Y-%m-%d %H:%M:%S%z",
+    "%Y-%m-%d %H:%M:%S.%f%z",
+}
+
+
+def _first_value(values: np.ndarray):
+
+    for value in values:
+        if pd.isna(value) or (isinstance(value, str) and value in _NAT_STRINGS):
+            continue
+        return value
+
+    return None
+
+
+def _sample(values: pd.Series, sample_size: int) -> pd.Series:
+
+    # Evenly spaced rows, so the sample covers the whole column
+    if len(values) <= sample_size:
+        return values
+
+    return values.iloc[np.linspace(0, len(values) - 1, sample_size).astype(np.int64)]
+
+
+def _char_codes(values: np.ndarray, width: int) -> np.ndarray:
+
+    # One row of character codes per value, zero-padded to width
+    try:
+        text = values.astype(f"S{width}")
+        return text.view(np.uint8).reshape(len(values), width)
+    except UnicodeEncodeError:
+        text = values.astype(f"U{width}")
+        return text.view(np.uint32).reshape(len(values), width)
+
+
+def _digits(chars: np.ndarray, start: int, stop: int) -> np.ndarray:
+
+    number = np.zeros(len(chars), dtype=np.int64)
+    for i in range(start, stop):
+        number = number * 10 + (chars[:, i].astype(np.int64) - ord("0"))
+
+    return number
+
+
+def _parse_iso_utc(values: np.ndarray, template: str) -> tuple:
+
+    # Decodes the values laid out exactly like template, an ISO 8601 value
+    # ending in "Z" ("YYYY-MM-DD?HH:MM:SS[.fff…]Z"): same length, digits where
+    # it has digits, the same separators elsewhere. The fields are turned
+    # into nanoseconds arithmetically. Values with fields pandas might treat
+    # differently (out-of-range fields, years near the nanosecond limits)
+    # are left out. Returns positions and int64 nanoseconds.
+    width = len(template)
+    pattern = np.frombuffer(template.encode("ascii"), dtype=np.uint8)
+    is_digit = (pattern >= ord("0")) & (pattern <= ord("9"))
+
+    positions = []
+    parsed = []
+
+    # Blocks bound the size of the fixed-width copies
+    n_blocks = max(1, -(-len(values) // ISO_BLOCK_SIZE))
+    for block in np.array_split(np.arange(len(values)), n_blocks):
+        # One extra column: it is zero only for values no longer than the template
+        chars = _char_codes(values[block], width + 1)
+        digits = (chars[:, :width] >= ord("0")) & (chars[:, :width] <= ord("9"))
+        matches = (
+            np.all(np.where(is_digit, digits, chars[:, :width] == pattern), axis=1)
+            & (chars[:, width] == 0)
+        )
+
+        chars = chars[matches]
+        year = _digits(chars, 0, 4)
+        month = _digits(chars, 5, 7)
+        day = _digits(chars, 8, 10)
+        hour = _digits(chars, 11, 13)
+        minute = _digits(chars, 14, 16)
+        second = _digits(chars, 17, 19)
+
+        # Digits after the "." up to the "Z", scaled to nanoseconds
+        fraction_digits = max(width - 21, 0)
+        fraction = _digits(chars, 20, 20 + fraction_digits) * 10 ** (9 - fraction_digits)
+
+        months = (year - 1970) * 12 + (month - 1)
+        month_start = months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+        month_days = (months + 1).astype("datetime64[M]").astype("datetime64[D]").astype(np.int64) - month_start
+
+        valid = (
+            (year > 1677) & (year < 2262)
+            & (month >= 1) & (month <= 12)
+            & (day >= 1) & (day <= month_days)
+            & (hour < 24) & (minute < 60) & (second < 60)
+        )
+
+        seconds = (month_start + day - 1) * 86_400 + hour * 3_600 + minute * 60 + second
+
+        positions.append(block[matches][valid])
+        parsed.append((seconds * 10**9 + fraction)[valid])
+
+    if not positions:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    return np.concatenate(positions), np.concatenate(parsed)
+
+
+def _parse_distinct(values: np.ndarray, fmt: str) -> np.ndarray:
+
+    # int64 nanoseconds since the epoch (NaT for invalid values)
+    parsed = np.full(len(values), np.iinfo(np.int64).min, dtype=np.int64)
+    rest = np.ones(len(values), dtype=bool)
+
+    first = _first_value(values)
+    if fmt in _ISO_UTC_FORMATS and first.endswith("Z"):
+        positions, nanoseconds = _parse_iso_utc(values, first)
+        parsed[positions] = nanoseconds
+        rest[positions] = False
+
+    if rest.any():
+        parsed[rest] = (
+            pd.to_datetime(pd.Series(values[rest], dtype=object), format=fmt, errors="coerce", utc=True)
+            .values
+            .view(np.int64)
+        )
+
+    return parsed
+
+
+def parse_timestamps(values: pd.Series) -> pd.Series:
+    """
+    Same result as pd.to_datetime(values, errors="coerce", utc=True),
+    with datetime64[ns, UTC] dtype and the index of values. The format
+    comes from the first non-missing value, as in pandas, so values in
+    other formats are NaT there as well.
+    """
+    first = _first_value(values.to_numpy())
+    fmt = guess_datetime_format(first) if isinstance(first, str) else None
+
+    # No format pandas could infer either: it parses element by element, so leave it to pandas
+    if fmt is None:
+        return pd.to_datetime(values, errors="coerce", utc=True)
+
+    sample = _sample(values, SAMPLE_SIZE)
+    if sample.nunique(dropna=False) < CACHE_UNIQUE_SHARE * len(sample):
+        codes, distinct = pd.factorize(values)
+        parsed = np.append(
+            _parse_distinct(np.asarray(distinct, dtype=object), fmt),
+            np.iinfo(np.int64).min
+        )[codes]
+    else:
+        missing = values.isna().to_numpy()
+        parsed = np.full(len(values), np.iinfo(np.int64).min, dtype=np.int64)
+        parsed[~missing] = _parse_distinct(values.to_numpy(dtype=object)[~missing], fmt)
+
+    return pd.Series(
+        pd.DatetimeIndex(parsed.view("datetime64[ns]")).tz_localize("UTC"),
+        index=values.index,
+        name=values.name
+    )
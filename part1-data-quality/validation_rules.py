@@ -0,0 +1,238 @@
+# Validation rule engine
+#
+# Compiles the column rules of a schema contract into a plan and evaluates
+# it column by column. Each column is factorized once; value rules run on
+# its distinct values and their results are broadcast back through the
+# codes, so adding rules to a column costs per distinct value, not per row.
+#
+# Column rules (keys of schema["columns"][col]):
+#   nullable: False          the column has no missing values
+#   parseable_datetime: True values parse as timestamps
+#   must_start_with: "http"  values start with the prefix (or any of a list)
+#   matches: r"[a-z_]+"      values match the regular expression in full
+#   allowed_values: [...]    values are one of the listed values
+#   min: 0 / max: 100        values are numbers within the bounds
+#   unique: True             no value appears twice
+# Missing values only fail nullable; the other rules skip them.
+#
+# Cross-column rules (schema["row_rules"]) apply column rules to the rows
+# where another column passes its own rules, e.g.
+#   {"check": "checkout_has_event_data",
+#    "when": {"column": "event_name", "allowed_values": ["checkout_completed"]},
+#    "then": {"column": "event_data", "nullable": False}}
+#
+# New value rules are added by registering a function of the distinct values
+# and the rule's parameter that returns True where a value violates it.
+
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+from timestamp_parsing import parse_timestamps
+
+VALUE_RULES: Dict[str, Callable] = {}
+
+
+def value_rule(key: str) -> Callable:
+
+    def register(func: Callable) -> Callable:
+        VALUE_RULES[key] = func
+        return func
+
+    return register
+
+
+@value_rule("must_start_with")
+def violates_prefix(values: pd.Series, prefix) -> np.ndarray:
+
+    prefixes = tuple(prefix) if isinstance(prefix, (list, tuple)) else prefix
+    return ~values.astype(str).str.startswith(prefixes).to_numpy(dtype=bool)
+
+
+@value_rule("matches")
+def violates_pattern(values: pd.Series, pattern: str) -> np.ndarray:
+
+    return ~values.astype(str).str.fullmatch(pattern).to_numpy(dtype=bool)
+
+
+@value_rule("allowed_values")
+def violates_enum(values: pd.Series, allowed: List) -> np.ndarray:
+
+    return ~values.isin(allowed).to_numpy(dtype=bool)
+
+
+@value_rule("min")
+def violates_min(values: pd.Series, bound) -> np.ndarray:
+
+    # Values that are not numbers fail range rules too
+    return ~(pd.to_numeric(values, errors="coerce") >= bound).to_numpy(dtype=bool)
+
+
+@value_rule("max")
+def violates_max(values: pd.Series, bound) -> np.ndarray:
+
+    return ~(pd.to_numeric(values, errors="coerce") <= bound).to_numpy(dtype=bool)
+
+
+def compile_column_plan(rules: Dict) -> List[Tuple[str, object]]:
+    """
+    The checks declared for one column, in evaluation order, as
+    (check name, parameter) pairs. Keys that are not rules (dtype,
+    nullable: True) are left out.
+    """
+    plan = []
+
+    if not rules.get("nullable", True):
+        plan.append(("not_null", None))
+    if rules.get("parseable_datetime"):
+        plan.append(("parseable_datetime", None))
+
+    for key, param in rules.items():
+        if key in VALUE_RULES:
+            plan.append((key, param))
+
+    if rules.get("unique"):
+        plan.append(("unique", None))
+
+    return plan
+
+
+def plan_checks(schema: Dict, columns: List[str]) -> List[Tuple[str, str]]:
+    """
+    (check, column) of every check validating a frame with these columns
+    runs, in the order failures are reported.
+    """
+    checks = [
+        (check, col)
+        for col, rules in schema["columns"].items()
+        if col in columns
+        for check, _ in compile_column_plan(rules)
+    ]
+
+    for rule in schema.get("row_rules", []):
+        if rule["when"]["column"] in columns and rule["then"]["column"] in columns:
+            checks.append((rule["check"], None))
+
+    return checks
+
+
+def _failure(check: str, col: str, count: int) -> Dict:
+
+    if check == "not_null":
+        return {"check": check, "column": col, "null_count": count}
+
+    failure = {"check": check, "column": col, "invalid_count": count}
+    if col is None:
+        del failure["column"]
+
+    return failure
+
+
+def evaluate_column(
+    series: pd.Series,
+    plan: List[Tuple[str, object]],
+    parsed: Dict = None,
+    masks: bool = False
+) -> Dict[str, object]:
+    """
+    Runs a column's plan. Returns, per check, its violation count, or its
+    row-level violation mask when masks is True. With parsed given, the
+    parsed timestamps of a parseable_datetime column are stored in it.
+    """
+    results = {}
+    missing = series.isna().to_numpy()
+
+    codes = None
+    value_counts = None
+
+    for check, param in plan:
+        if check == "not_null":
+            violations = missing
+
+        elif check == "parseable_datetime":
+            timestamps = parse_timestamps(series)
+            if parsed is not None:
+                parsed[series.name] = timestamps
+            violations = timestamps.isna().to_numpy()
+
+        else:
+            # Factorized once, on the first value rule of the column
+            if codes is None:
+                codes, distinct = pd.factorize(series)
+                distinct = pd.Series(distinct, dtype=object)
+                value_counts = np.bincount(codes[codes >= 0], minlength=len(distinct))
+
+            if check == "unique":
+                # Every occurrence after the first of a value
+                if masks:
+                    violations = pd.Series(codes).duplicated().to_numpy() & (codes >= 0)
+                else:
+                    results[check] = int((value_counts - 1).clip(min=0).sum())
+                    continue
+            else:
+                bad = VALUE_RULES[check](distinct, param)
+                if not masks:
+                    results[check] = int(value_counts[bad].sum())
+                    continue
+                violations = np.append(bad, False)[codes]
+
+        results[check] = violations if masks else int(violations.sum())
+
+    return results
+
+
+def evaluate_contract(
+    df: pd.DataFrame,
+    schema: Dict,
+    parsed: Dict = None,
+    masks: Dict = None
+) -> List[Dict]:
+    """
+    Failures of every column and cross-column rule of schema that df
+    violates, in plan_checks order. With masks given, it receives the
+    row-level violation mask of every check, keyed by (check, column).
+    """
+    failures = []
+
+    for col, rules in schema["columns"].items():
+        if col not in df.columns:
+            continue
+
+        plan = compile_column_plan(rules)
+        if not plan:
+            continue
+
+        results = evaluate_column(df[col], plan, parsed, masks=masks is not None)
+
+        for check, _ in plan:
+            if masks is not None:
+                masks[(check, col)] = results[check]
+            count = int(results[check].sum()) if masks is not None else results[check]
+            if count > 0:
+                failures.append(_failure(check, col, count))
+
+    for rule in schema.get("row_rules", []):
+        when, then = rule["when"], rule["then"]
+        if when["column"] not in df.columns or then["column"] not in df.columns:
+            continue
+
+        applies = ~_any_violation(df[when["column"]], when) & df[when["column"]].notna().to_numpy()
+        violations = applies & _any_violation(df[then["column"]], then)
+
+        if masks is not None:
+            masks[(rule["check"], None)] = violations
+        if violations.any():
+            failures.append(_failure(rule["check"], None, int(violations.sum())))
+
+    return failures
+
+
+def _any_violation(series: pd.Series, rules: Dict) -> np.ndarray:
+
+    violations = np.zeros(len(series), dtype=bool)
+
+    for mask in evaluate_column(series, compile_column_plan(rules), masks=True).values():
+        violations |= mask
+
+    return violations
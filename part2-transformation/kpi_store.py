@@ -0,0 +1,149 @@
+# Daily KPI store
+#
+# An append-only CSV of per-day business metrics, updated at the end of each
+# transformation run, so monitoring reads a few rows per day instead of
+# rescanning the fact tables. Each row is one value:
+#
+#   date, attribution_model, metric, value, recorded_at
+#
+# Day-level metrics (events, sessions, conversions, revenue) have no
+# attribution_model. Per model: attributed_revenue, direct_revenue and
+# direct_share, where direct revenue is credited to utm_source "direct".
+# Events are dated by event_ts, sessions by their start, conversions and
+# their attribution by conversion_ts, all in UTC.
+#
+# A run appends only the values that differ from the latest stored ones, so
+# a day restated by a later run (late files, a rebuild) gets a newer row and
+# readers keep the latest row of each (date, model, metric).
+
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+
+DAY_METRICS = ["events", "sessions", "conversions", "revenue"]
+MODEL_METRICS = ["attributed_revenue", "direct_revenue", "direct_share"]
+
+# Columns build_daily_kpis reads from each table
+SOURCE_COLUMNS = {
+    "events_with_sessions": ["event_ts"],
+    "sessions": ["session_start_ts"],
+    "fact_conversions": ["conversion_id", "conversion_ts", "revenue"],
+    "fact_attribution": ["conversion_id", "attribution_model", "utm_source", "revenue"],
+}
+
+KPI_KEY = ["date", "attribution_model", "metric"]
+KPI_COLUMNS = KPI_KEY + ["value", "recorded_at"]
+
+
+def _dates(ts: pd.Series) -> pd.Series:
+
+    return ts.dt.tz_convert("UTC").dt.strftime("%Y-%m-%d")
+
+
+def build_daily_kpis(
+    events_with_sessions: pd.DataFrame,
+    sessions: pd.DataFrame,
+    fact_conversions: pd.DataFrame,
+    fact_attribution: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Every metric of every day the tables cover, as (date,
+    attribution_model, metric, value) rows. Days with events but no
+    conversions get zero conversions and revenue.
+    """
+    conversion_dates = _dates(fact_conversions["conversion_ts"])
+
+    day_metrics = pd.DataFrame({
+        "events": _dates(events_with_sessions["event_ts"]).value_counts(),
+        "sessions": _dates(sessions["session_start_ts"]).value_counts(),
+        "conversions": conversion_dates.value_counts(),
+        "revenue": fact_conversions["revenue"].groupby(conversion_dates.to_numpy()).sum(),
+    }).fillna(0)
+    day_metrics.index.name = "date"
+
+    # Attribution rows take the date of their conversion
+    attribution = fact_attribution[["conversion_id", "attribution_model", "utm_source", "revenue"]].merge(
+        pd.DataFrame({
+            "conversion_id": fact_conversions["conversion_id"].to_numpy(),
+            "date": conversion_dates.to_numpy(),
+        }),
+        on="conversion_id",
+        how="left"
+    )
+    attribution["attribution_model"] = attribution["attribution_model"].astype(str)
+    attribution["direct_revenue"] = attribution["revenue"].where(attribution["utm_source"] == "direct", 0.0)
+
+    model_metrics = (
+        attribution
+        .groupby(["date", "attribution_model"])[["revenue", "direct_revenue"]]
+        .sum()
+        .rename(columns={"revenue": "attributed_revenue"})
+    )
+    model_metrics["direct_share"] = (
+        model_metrics["direct_revenue"] / model_metrics["attributed_revenue"]
+    ).where(model_metrics["attributed_revenue"] > 0, 0.0)
+
+    day_rows = day_metrics[DAY_METRICS].stack().rename("value").reset_index()
+    day_rows.columns = ["date", "metric", "value"]
+    day_rows["attribution_model"] = ""
+
+    model_rows = model_metrics[MODEL_METRICS].stack().rename("value").reset_index()
+    model_rows.columns = ["date", "attribution_model", "metric", "value"]
+
+    return (
+        pd.concat([day_rows, model_rows], ignore_index=True)[KPI_KEY + ["value"]]
+        .sort_values(KPI_KEY, ignore_index=True)
+    )
+
+
+def load_daily_kpis(store_path: str) -> pd.DataFrame:
+    """
+    The latest value of every (date, attribution_model, metric) in the store,
+    sorted by key; empty when there is no store yet.
+    """
+    if not os.path.exists(store_path):
+        return pd.DataFrame(columns=KPI_COLUMNS)
+
+    kpis = pd.read_csv(store_path, dtype={"attribution_model": str}, keep_default_na=False)
+
+    return (
+        kpis
+        .drop_duplicates(KPI_KEY, keep="last")
+        .sort_values(KPI_KEY, ignore_index=True)
+    )
+
+
+def append_daily_kpis(store_path: str, kpis: pd.DataFrame, tolerance: float = 1e-9) -> int:
+    """
+    Appends the values of kpis that are new or differ from the stored ones.
+    Returns the number of rows appended.
+    """
+    stored = load_daily_kpis(store_path)
+
+    merged = kpis.merge(stored[KPI_KEY + ["value"]], on=KPI_KEY, how="left", suffixes=("", "_stored"))
+    changed = merged[
+        merged["value_stored"].isna()
+        | ((merged["value"] - merged["value_stored"].astype(float)).abs() > tolerance)
+    ]
+
+    if len(changed):
+        rows = changed[KPI_KEY + ["value"]].assign(
+            recorded_at=datetime.now(timezone.utc).isoformat()
+        )
+        rows.to_csv(store_path, mode="a", header=not os.path.exists(store_path), index=False)
+
+    return len(changed)
+
+
+def kpi_series(kpis: pd.DataFrame, metric: str, attribution_model: str = "") -> pd.Series:
+    """
+    One metric (of one model) as a float series indexed by date.
+    """
+    rows = kpis[(kpis["metric"] == metric) & (kpis["attribution_model"] == attribution_model)]
+
+    return pd.Series(
+        rows["value"].astype(float).to_numpy(),
+        index=pd.to_datetime(rows["date"]),
+        name=metric
+    ).sort_index()
@@ -0,0 +1,95 @@
+# Event payload decoding
+#
+# Decodes the JSON event_data column in bulk and pulls the requested fields
+# into typed arrays. orjson is used when it is installed, the standard
+# library json module otherwise. Rows that do not decode, lack a field or
+# hold a value that does not convert are reported with their position and
+# reason instead of raising, so callers can quarantine them.
+
+import json
+from typing import Callable, Dict, Tuple
+
+import numpy as np
+import pandas as pd
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+
+def _map_checked(func: Callable, items: list) -> Tuple[list, Dict[int, str]]:
+
+    # One map over the whole batch; only if it fails are rows retried one by
+    # one to find which positions are bad
+    try:
+        return list(map(func, items)), {}
+    except Exception:
+        pass
+
+    results = [None] * len(items)
+    errors = {}
+
+    for position, item in enumerate(items):
+        try:
+            results[position] = func(item)
+        except Exception as exc:
+            errors[position] = f"{type(exc).__name__}: {exc}"
+
+    return results, errors
+
+
+def _field_reader(name: str, convert: Callable) -> Callable:
+
+    def read(payload):
+        if not isinstance(payload, dict):
+            raise TypeError(f"payload is a {type(payload).__name__}, not an object")
+        value = payload[name]
+        return value if convert is None else convert(value)
+
+    return read
+
+
+def decode_payload_fields(
+    payloads: pd.Series,
+    fields: Dict[str, Callable]
+) -> Tuple[pd.DataFrame, pd.Series]:
+    """
+    Decodes each JSON payload once and extracts fields, a mapping of field
+    name → converter (e.g. float), or None to keep the decoded value as is.
+    Returns:
+      - one column per field, indexed like payloads: float64 for float
+        converters, object otherwise. Bad rows are missing in every column.
+      - the reason each bad row failed, indexed by its label
+    """
+    decoded, errors = _map_checked(_loads, payloads.tolist())
+
+    extracted = {}
+    for name, convert in fields.items():
+        values, field_errors = _map_checked(_field_reader(name, convert), decoded)
+        extracted[name] = values
+
+        # The first failure of a row is the one reported
+        for position, reason in field_errors.items():
+            errors.setdefault(position, f"{name}: {reason}")
+
+    bad = sorted(errors)
+
+    columns = {}
+    for name, convert in fields.items():
+        missing = np.nan if convert is float else None
+        values = extracted[name]
+        for position in bad:
+            values[position] = missing
+
+        columns[name] = pd.Series(
+            values,
+            index=payloads.index,
+            dtype=np.float64 if convert is float else object
+        )
+
+    return (
+        pd.DataFrame(columns, index=payloads.index),
+        pd.Series([errors[position] for position in bad], index=payloads.index[bad], dtype=object),
+    )
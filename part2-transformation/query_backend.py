@@ -0,0 +1,207 @@
+# SQL query backend
+#
+# An optional embedded DuckDB database over the tables the transformation
+# wrote: each stored table is a view on its files (Parquet, Arrow IPC or
+# CSV), so nothing is loaded up front. Queries run vectorized on every core,
+# read only the columns and event_date partitions they need, and spill to
+# disk past DUCKDB_MEMORY_LIMIT, so months of history can be queried without
+# fitting in memory.
+#
+# QUERIES holds the daily KPIs monitoring is built on and common analysis
+# queries; any other SQL can be run against the views as well.
+#
+#   python part2-transformation/query_backend.py [--dir DIR] <query name | SQL>
+#
+# Needs duckdb (pip install duckdb); without it the pandas readers in
+# table_storage are used instead.
+
+import argparse
+import os
+from typing import List
+
+import pandas as pd
+
+from table_storage import PARTITION_COLUMNS, detect_format, open_dataset, table_path
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+# Tables exposed as views, when they are stored
+TABLES = list(PARTITION_COLUMNS) + ["quarantined_conversions", "fact_attribution"]
+
+DUCKDB_THREADS = None  # None: one per core
+DUCKDB_MEMORY_LIMIT = None  # e.g. "4GB"; past it operators spill to DUCKDB_TEMP_DIR. None: DuckDB's default (80% of RAM)
+DUCKDB_TEMP_DIR = None  # Spill folder; None: DuckDB's default, next to the database
+
+# UTC day of a timestamp, as the YYYY-MM-DD strings the KPI store and partitions use
+UTC_DATE_MACRO = "CREATE MACRO utc_date(ts) AS strftime(timezone('UTC', CAST(ts AS TIMESTAMPTZ)), '%Y-%m-%d')"
+
+QUERIES = {
+    # Same rows as kpi_store.build_daily_kpis
+    "daily_kpis": """
+        WITH day_values AS (
+            SELECT utc_date(event_ts) AS date, 'events' AS metric, COUNT(*)::DOUBLE AS value
+            FROM events_with_sessions WHERE event_ts IS NOT NULL GROUP BY 1
+            UNION ALL
+            SELECT utc_date(session_start_ts), 'sessions', COUNT(*)::DOUBLE
+            FROM sessions WHERE session_start_ts IS NOT NULL GROUP BY 1
+            UNION ALL
+            SELECT utc_date(conversion_ts), 'conversions', COUNT(*)::DOUBLE
+            FROM fact_conversions WHERE conversion_ts IS NOT NULL GROUP BY 1
+            UNION ALL
+            SELECT utc_date(conversion_ts), 'revenue', COALESCE(SUM(revenue), 0)::DOUBLE
+            FROM fact_conversions WHERE conversion_ts IS NOT NULL GROUP BY 1
+        ),
+        -- Days with events but no conversions get zero conversions and revenue
+        day_rows AS (
+            SELECT date, '' AS attribution_model, metric, COALESCE(value, 0.0) AS value
+            FROM (SELECT DISTINCT date FROM day_values)
+            CROSS JOIN (VALUES ('events'), ('sessions'), ('conversions'), ('revenue')) metrics(metric)
+            LEFT JOIN day_values USING (date, metric)
+        ),
+        -- Attribution rows take the date of their conversion
+        model_values AS (
+            SELECT
+                utc_date(c.conversion_ts) AS date,
+                CAST(a.attribution_model AS VARCHAR) AS attribution_model,
+                COALESCE(SUM(a.revenue), 0)::DOUBLE AS attributed_revenue,
+                COALESCE(SUM(a.revenue) FILTER (WHERE a.utm_source = 'direct'), 0)::DOUBLE AS direct_revenue
+            FROM fact_attribution a
+            JOIN fact_conversions c USING (conversion_id)
+            WHERE c.conversion_ts IS NOT NULL AND a.attribution_model IS NOT NULL
+            GROUP BY 1, 2
+        ),
+        model_rows AS (
+            UNPIVOT (
+                SELECT
+                    *,
+                    CASE WHEN attributed_revenue > 0 THEN direct_revenue / attributed_revenue ELSE 0.0 END AS direct_share
+                FROM model_values
+            )
+            ON attributed_revenue, direct_revenue, direct_share
+            INTO NAME metric VALUE value
+        )
+        SELECT date, attribution_model, metric, value FROM day_rows
+        UNION ALL
+        SELECT date, attribution_model, metric, value FROM model_rows
+        ORDER BY date, attribution_model, metric
+    """,
+    # Revenue credited to each channel under each attribution model
+    "revenue_by_channel": """
+        SELECT
+            CAST(attribution_model AS VARCHAR) AS attribution_model,
+            utm_source,
+            utm_medium,
+            COUNT(DISTINCT conversion_id) AS conversions,
+            SUM(revenue) AS revenue,
+            SUM(revenue) / SUM(SUM(revenue)) OVER (PARTITION BY CAST(attribution_model AS VARCHAR)) AS revenue_share
+        FROM fact_attribution
+        GROUP BY 1, 2, 3
+        ORDER BY attribution_model, revenue DESC
+    """,
+    # Share of revenue credited to direct traffic, per model
+    "direct_share": """
+        SELECT
+            CAST(attribution_model AS VARCHAR) AS attribution_model,
+            SUM(revenue) FILTER (WHERE utm_source = 'direct') AS direct_revenue,
+            SUM(revenue) AS attributed_revenue,
+            COALESCE(SUM(revenue) FILTER (WHERE utm_source = 'direct'), 0) / SUM(revenue) AS direct_share
+        FROM fact_attribution
+        GROUP BY ALL
+        ORDER BY attribution_model
+    """,
+    # Sessions, conversions and conversion rate per day and landing device
+    "conversion_rate_by_device": """
+        SELECT
+            utc_date(session_start_ts) AS date,
+            landing_device_type,
+            COUNT(*) AS sessions,
+            COUNT(*) FILTER (WHERE has_conversion) AS converting_sessions,
+            COUNT(*) FILTER (WHERE has_conversion) / COUNT(*) AS conversion_rate
+        FROM sessions
+        GROUP BY ALL
+        ORDER BY date, landing_device_type
+    """,
+}
+
+
+def available() -> bool:
+
+    return duckdb is not None
+
+
+def _view_source(con, name: str, base_dir: str) -> str:
+
+    fmt = detect_format(name, base_dir)
+    path = table_path(name, fmt, base_dir).replace("'", "''")
+
+    if fmt == "parquet":
+        # union_by_name merges the schemas of partitions whose columns differ
+        return f"read_parquet('{path}/**/*.parquet', hive_partitioning = true, union_by_name = true)"
+
+    if fmt == "csv":
+        return f"read_csv('{path}', header = true)"
+
+    # DuckDB has no Arrow IPC reader; the pyarrow dataset is scanned lazily instead
+    con.register(f"{name}_dataset", open_dataset(name, base_dir, fmt))
+
+    return f"{name}_dataset"
+
+
+def connect(base_dir: str = ".", tables: List[str] = TABLES):
+    """
+    An in-memory DuckDB connection with a view per table stored in
+    base_dir. Tables that were not written are skipped.
+    """
+    if duckdb is None:
+        raise ImportError("The SQL query backend needs duckdb: pip install duckdb")
+
+    con = duckdb.connect()
+
+    if DUCKDB_THREADS is not None:
+        con.execute(f"SET threads = {int(DUCKDB_THREADS)}")
+    if DUCKDB_MEMORY_LIMIT is not None:
+        con.execute(f"SET memory_limit = '{DUCKDB_MEMORY_LIMIT}'")
+    if DUCKDB_TEMP_DIR is not None:
+        con.execute(f"SET temp_directory = '{DUCKDB_TEMP_DIR}'")
+
+    con.execute(UTC_DATE_MACRO)
+
+    for name in tables:
+        try:
+            source = _view_source(con, name, base_dir)
+        except FileNotFoundError:
+            continue
+        con.execute(f"CREATE VIEW {name} AS SELECT * FROM {source}")
+
+    return con
+
+
+def query(con, name_or_sql: str) -> pd.DataFrame:
+    """
+    Runs a query from QUERIES by name, or any SQL, and returns the result.
+    """
+    return con.execute(QUERIES.get(name_or_sql, name_or_sql)).df()
+
+
+def daily_kpis(base_dir: str = ".") -> pd.DataFrame:
+    """
+    kpi_store.build_daily_kpis computed in DuckDB over the stored tables.
+    """
+    con = connect(base_dir, list(PARTITION_COLUMNS) + ["fact_attribution"])
+    try:
+        return query(con, "daily_kpis")
+    finally:
+        con.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the pipeline's output tables with DuckDB")
+    parser.add_argument("--dir", default=".", help="Folder the transformation wrote its tables to")
+    parser.add_argument("query", help=f"One of {', '.join(QUERIES)}, or SQL")
+    args = parser.parse_args()
+
+    with pd.option_context("display.max_rows", None, "display.width", None):
+        print(query(connect(os.path.abspath(args.dir)), args.query))
@@ -0,0 +1,156 @@
+# Sessionization kernel
+#
+# Sessions are computed on integer identity codes and int64 timestamps: one
+# stable sort, then a single vectorized pass (diff, gap mask, cumsum) marks
+# session boundaries. Session ids are only turned into strings once per
+# session, never once per event.
+
+from typing import Callable, Tuple
+
+import numpy as np
+import pandas as pd
+
+ANON_PREFIX = "anon_event_"
+
+
+def _decimal_string_order(labels: np.ndarray) -> np.ndarray:
+
+    # Ranks non-negative integers the way their decimal strings sort ("10" < "2"):
+    # left-align the digits to a common width, then shorter strings first on ties
+    digits = np.ones(len(labels), dtype=np.int64)
+    for power in range(1, 19):
+        digits += labels >= 10 ** power
+
+    width = int(digits.max()) if len(labels) else 1
+    aligned = labels * 10 ** (width - digits)
+
+    order = np.lexsort((digits, aligned))
+    rank = np.empty(len(labels), dtype=np.int64)
+    rank[order] = np.arange(len(labels))
+
+    return rank
+
+
+def _encode_identity_strings(client_id: pd.Series) -> Tuple[np.ndarray, Callable]:
+
+    identities = np.where(
+        client_id.notna(),
+        client_id.astype(str),
+        ANON_PREFIX + client_id.index.astype(str)
+    )
+    codes, uniques = pd.factorize(identities, sort=True)
+
+    return codes.astype(np.int64), lambda selected: uniques[selected]
+
+
+def encode_identities(client_id: pd.Series) -> Tuple[np.ndarray, Callable]:
+    """
+    Encodes the session identity of every event as an int64 code whose order
+    matches the order of the identity strings:
+      - identified events → str(client_id)
+      - anonymous events → "anon_event_" + row label (one identity per event)
+    Returns the codes and a function decoding codes back to identity strings,
+    so strings are only built for the codes that are asked for.
+    """
+    values, uniques = pd.factorize(client_id)
+    names = np.asarray(uniques.astype(str), dtype=object)
+
+    is_anon = values < 0
+    labels = client_id.index[is_anon]
+
+    # Identities only need strings when a client id could sort inside the
+    # anonymous block, or row labels are not non-negative integers
+    if (
+        any(name.startswith(ANON_PREFIX) for name in names)
+        or not pd.api.types.is_integer_dtype(labels)
+        or (len(labels) and labels.min() < 0)
+    ):
+        return _encode_identity_strings(client_id)
+
+    # Different client ids with the same str() share an identity
+    name_codes, names = pd.factorize(names)
+    names = np.asarray(names, dtype=object)
+
+    name_order = np.argsort(names, kind="stable")
+    name_rank = np.empty(len(names), dtype=np.int64)
+    name_rank[name_order] = np.arange(len(names))
+
+    # Every anonymous identity shares ANON_PREFIX, so each client id sorts
+    # entirely before or entirely after the anonymous block
+    before = names < ANON_PREFIX
+    n_before = int(before.sum())
+    n_anon = int(is_anon.sum())
+
+    name_code = np.where(before, name_rank, name_rank + n_anon)
+
+    anon_labels = labels.to_numpy(dtype=np.int64)
+    anon_rank = _decimal_string_order(anon_labels)
+
+    codes = np.empty(len(client_id), dtype=np.int64)
+    codes[~is_anon] = name_code[name_codes[values[~is_anon]]]
+    codes[is_anon] = n_before + anon_rank
+
+    sorted_names = names[name_order]
+    anon_by_rank = np.empty(n_anon, dtype=np.int64)
+    anon_by_rank[anon_rank] = anon_labels
+
+    def decode(selected: np.ndarray) -> np.ndarray:
+
+        selected = np.asarray(selected, dtype=np.int64)
+        decoded = np.empty(len(selected), dtype=object)
+
+        anon = (selected >= n_before) & (selected < n_before + n_anon)
+        after = selected >= n_before + n_anon
+        client = ~anon
+
+        decoded[client] = sorted_names[np.where(after, selected - n_anon, selected)[client]]
+        decoded[anon] = [ANON_PREFIX + str(label) for label in anon_by_rank[selected[anon] - n_before]]
+
+        return decoded
+
+    return codes, decode
+
+
+def sessionize(
+    identity_codes: np.ndarray,
+    event_ts: np.ndarray,
+    timeout_ns: int,
+    missing_ts: np.ndarray = None
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Assigns sessions in one sorted pass.
+    A new session starts at each identity's first event and after every gap
+    longer than timeout_ns. Events with missing_ts set always start their own
+    session and sort after the identity's timed events, like NaT in pandas.
+    Returns:
+      - order: stable permutation sorting events by identity, then time
+      - session_key: 0-based global session number of each sorted event
+      - session_index: 1-based session number within the identity
+    """
+    event_ts = np.asarray(event_ts, dtype=np.int64)
+    if missing_ts is not None:
+        event_ts = np.where(missing_ts, np.iinfo(np.int64).max, event_ts)
+
+    order = np.lexsort((event_ts, identity_codes))
+    codes = identity_codes[order]
+    ts = event_ts[order]
+
+    n = len(codes)
+    identity_start = np.ones(n, dtype=bool)
+    is_new = np.ones(n, dtype=bool)
+
+    if n > 1:
+        identity_start[1:] = codes[1:] != codes[:-1]
+        is_new[1:] = identity_start[1:] | (np.diff(ts) > timeout_ns)
+
+    if missing_ts is not None:
+        is_new |= missing_ts[order]
+
+    session_key = np.cumsum(is_new) - 1
+
+    # Key of each identity's first session, carried forward along the identity
+    starts = np.flatnonzero(identity_start)
+    first_key = np.repeat(session_key[starts], np.diff(np.append(starts, n)))
+    session_index = session_key - first_key + 1
+
+    return order, session_key, session_index
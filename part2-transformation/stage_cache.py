@@ -0,0 +1,217 @@
+# Stage result cache
+#
+# Stores the output of a pipeline stage under a key hashed from everything
+# the output depends on: the keys of its inputs (input files by sha256,
+# upstream stages by their own keys), its settings and the source code of
+# the functions it runs. A stage whose key is in the cache is loaded instead
+# of recomputed; changing a setting or a function only invalidates the
+# stages that use it and the ones downstream of them.
+#
+# Entries are pickles in one directory, <key>.pkl with a <key>.json sidecar
+# (stage, size, creation time). Reading an entry touches its mtime; when the
+# directory grows past max_bytes the least recently used entries go first.
+#
+#   python part2-transformation/stage_cache.py [--dir DIR] list
+#   python part2-transformation/stage_cache.py [--dir DIR] purge [--stage NAME]
+
+import argparse
+import hashlib
+import inspect
+import json
+import os
+import pickle
+from datetime import datetime, timezone
+from typing import Dict, List
+
+CACHE_VERSION = 1
+
+
+def source_fingerprint(obj) -> str:
+    """
+    Source of a function, class or module; the bytecode when the source is
+    not available.
+    """
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        code = getattr(obj, "__code__", None)
+        return code.co_code.hex() if code is not None else repr(obj)
+
+
+def stage_key(stage: str, inputs: List[str], params: Dict, functions: List) -> str:
+    """
+    Cache key of a stage: a sha256 of its name, the keys (or file hashes)
+    of its inputs, its parameters and the source of its functions.
+    """
+    sha256 = hashlib.sha256()
+    sha256.update(json.dumps(
+        {
+            "version": CACHE_VERSION,
+            "stage": stage,
+            "inputs": list(inputs),
+            "params": params,
+        },
+        sort_keys=True,
+        default=repr
+    ).encode())
+
+    for func in functions:
+        sha256.update(source_fingerprint(func).encode())
+
+    return sha256.hexdigest()
+
+
+class StageCache:
+
+    def __init__(self, cache_dir: str, max_bytes: int = None):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def _path(self, key: str, ext: str) -> str:
+
+        return os.path.join(self.cache_dir, f"{key}.{ext}")
+
+    def _count(self, stage: str, outcome: str) -> None:
+
+        counts = self.stats.setdefault(stage, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+    def get(self, stage: str, key: str):
+        """
+        The cached output of key, or None on a miss.
+        """
+        path = self._path(key, "pkl")
+
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self._count(stage, "misses")
+            return None
+
+        os.utime(path)
+        self._count(stage, "hits")
+
+        return value
+
+    def put(self, stage: str, key: str, value) -> None:
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Written under a temporary name so a crash never leaves a truncated entry
+        path = self._path(key, "pkl")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+        with open(self._path(key, "json"), "w") as f:
+            json.dump({
+                "key": key,
+                "stage": stage,
+                "bytes": os.path.getsize(path),
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            }, f, indent=2)
+
+        self.evict()
+
+    def entries(self) -> List[Dict]:
+        """
+        Every entry with its stage, size, creation and last use time, most
+        recently used first.
+        """
+        if not os.path.isdir(self.cache_dir):
+            return []
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".pkl"):
+                continue
+
+            key = name[:-len(".pkl")]
+            try:
+                with open(self._path(key, "json")) as f:
+                    entry = json.load(f)
+                last_used = os.path.getmtime(self._path(key, "pkl"))
+            except (OSError, ValueError):
+                entry = {"key": key, "stage": None, "bytes": os.path.getsize(self._path(key, "pkl"))}
+                last_used = 0.0
+
+            entry["last_used"] = last_used
+            entries.append(entry)
+
+        return sorted(entries, key=lambda entry: entry["last_used"], reverse=True)
+
+    def remove(self, key: str) -> None:
+
+        for ext in ["pkl", "json"]:
+            try:
+                os.remove(self._path(key, ext))
+            except FileNotFoundError:
+                pass
+
+    def evict(self) -> List[str]:
+        """
+        Removes least recently used entries until the cache fits in
+        max_bytes. Returns the removed keys.
+        """
+        if self.max_bytes is None:
+            return []
+
+        entries = self.entries()
+        total = sum(entry["bytes"] for entry in entries)
+        removed = []
+
+        while entries and total > self.max_bytes:
+            entry = entries.pop()
+            self.remove(entry["key"])
+            total -= entry["bytes"]
+            removed.append(entry["key"])
+
+        return removed
+
+    def purge(self, stage: str = None) -> int:
+        """
+        Removes every entry, or only those of stage. Returns how many.
+        """
+        entries = [
+            entry for entry in self.entries()
+            if stage is None or entry["stage"] == stage
+        ]
+        for entry in entries:
+            self.remove(entry["key"])
+
+        return len(entries)
+
+    def report(self) -> Dict:
+
+        entries = self.entries()
+
+        return {
+            "stages": self.stats,
+            "entries": len(entries),
+            "bytes": sum(entry["bytes"] for entry in entries),
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or purge the pipeline stage cache")
+    parser.add_argument("--dir", default="stage_cache", help="Cache directory (STAGE_CACHE_DIR)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="List entries, most recently used first")
+    purge = commands.add_parser("purge", help="Remove entries")
+    purge.add_argument("--stage", help="Only remove entries of this stage")
+    args = parser.parse_args()
+
+    cache = StageCache(args.dir)
+
+    if args.command == "list":
+        entries = cache.entries()
+        for entry in entries:
+            last_used = datetime.fromtimestamp(entry["last_used"], timezone.utc).isoformat(timespec="seconds")
+            print(f"{entry['key'][:16]}  {str(entry['stage']):<22} {entry['bytes'] / 2**20:10.1f} MiB  last used {last_used}")
+        print(f"{len(entries)} entries, {sum(entry['bytes'] for entry in entries) / 2**20:.1f} MiB in {args.dir}")
+
+    else:
+        print(f"Removed {cache.purge(args.stage)} entries from {args.dir}")
@@ -0,0 +1,101 @@
+# Table manifest
+#
+# A JSON sidecar the transformation writes next to its output tables with
+# what downstream checks need to know about each table without reading it:
+# row count, the first and last timestamp, rows per day (the table's event
+# date partitions) and a checksum of its content. Tables are dated by the
+# column they are partitioned by (event_ts, session_start_ts, conversion_ts);
+# tables without one only get row counts and checksums.
+#
+# The checksum hashes every row's values and label in stored order, so it
+# changes whenever the content does, whatever the output format.
+#
+# latest_input_day is the day of the newest input file. Events past its
+# midnight spill into the next day, which the tables then only partly cover,
+# so checks of the latest day use this one.
+
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+
+from table_storage import PARTITION_COLUMNS
+
+MANIFEST_VERSION = 1
+
+
+def content_checksum(df: pd.DataFrame) -> str:
+
+    row_hashes = pd.util.hash_pandas_object(df, index=True).to_numpy()
+
+    # Column names are part of the content too
+    sha256 = hashlib.sha256(json.dumps([str(col) for col in df.columns]).encode())
+    sha256.update(row_hashes.tobytes())
+
+    return sha256.hexdigest()
+
+
+def table_stats(df: pd.DataFrame, ts_col: str = None) -> Dict:
+
+    stats = {"rows": len(df)}
+
+    if ts_col is not None and ts_col in df.columns:
+        ts = df[ts_col]
+        # Same UTC days as the table's event_date partitions
+        days, counts = np.unique(ts.values.astype("datetime64[D]"), return_counts=True)
+
+        stats.update({
+            "ts_column": ts_col,
+            "min_ts": ts.min().isoformat() if len(df) else None,
+            "max_ts": ts.max().isoformat() if len(df) else None,
+            "rows_per_day": {
+                str(day): int(count)
+                for day, count in zip(days, counts)
+            },
+        })
+
+    stats["checksum"] = content_checksum(df)
+
+    return stats
+
+
+def build_table_manifest(tables: Dict[str, pd.DataFrame], fmt: str, latest_input_day: str = None) -> Dict:
+    """
+    Manifest of tables as written (by name) in storage format fmt.
+    """
+    return {
+        "version": MANIFEST_VERSION,
+        "written_at": datetime.now(timezone.utc).isoformat(),
+        "format": fmt,
+        "latest_input_day": latest_input_day,
+        "tables": {
+            name: table_stats(df, PARTITION_COLUMNS.get(name))
+            for name, df in tables.items()
+        },
+    }
+
+
+def write_table_manifest(manifest: Dict, path: str) -> None:
+
+    # Written to a temporary file first so readers never see a partial manifest
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def load_table_manifest(path: str) -> Dict:
+    """
+    The manifest at path, or None when there is none (or an older version).
+    """
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        manifest = json.load(f)
+
+    return manifest if manifest.get("version") == MANIFEST_VERSION else None
@@ -0,0 +1,259 @@
+# Table storage
+#
+# Reads and writes the pipeline's intermediate and fact tables. Parquet and
+# Arrow IPC tables are hive-partitioned datasets (one directory per table,
+# one sub-directory per event date) that keep categorical and datetime dtypes
+# as well as the pandas index. CSV is kept as a flat export format. A table
+# without rows is stored as one empty file, so it still reads back with its
+# columns.
+#
+# Partitioned tables are read back partition by partition, so row order is
+# not preserved across dates; the index is, and sort_index() restores it.
+
+import glob
+import os
+import shutil
+import uuid
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+STORAGE_FORMATS = {
+    "parquet": "parquet",
+    "arrow": "ipc",
+    "csv": None,
+}
+
+# Timestamp column each table is partitioned by; tables not listed are written unpartitioned
+PARTITION_COLUMNS = {
+    "enriched_events": "event_ts",
+    "events_with_sessions": "event_ts",
+    "sessions": "session_start_ts",
+    "fact_conversions": "conversion_ts",
+}
+
+PARTITION_KEY = "event_date"
+
+
+def table_path(name: str, fmt: str, base_dir: str = ".") -> str:
+
+    if fmt == "csv":
+        return os.path.join(base_dir, f"{name}.csv")
+
+    return os.path.join(base_dir, name)
+
+
+def detect_format(name: str, base_dir: str = ".") -> str:
+    """
+    Works out how a table was written: a dataset directory holding
+    .parquet or .arrow files, or a flat CSV.
+    """
+    path = table_path(name, "parquet", base_dir)
+
+    if os.path.isdir(path):
+        for fmt in ["parquet", "arrow"]:
+            if glob.glob(os.path.join(path, "**", f"*.{fmt}"), recursive=True):
+                return fmt
+
+    if os.path.exists(table_path(name, "csv", base_dir)):
+        return "csv"
+
+    raise FileNotFoundError(f"No stored table named {name} in {os.path.abspath(base_dir)}")
+
+
+def write_table(
+    df: pd.DataFrame,
+    name: str,
+    fmt: str = "parquet",
+    base_dir: str = ".",
+    append: bool = False
+) -> None:
+    """
+    Writes df as table name. With append=True the rows are added to the
+    existing table (used by chunked writers), otherwise it is replaced.
+    """
+    if fmt not in STORAGE_FORMATS:
+        raise ValueError(f"Unknown storage format {fmt}. Expected one of: {', '.join(STORAGE_FORMATS)}")
+
+    path = table_path(name, fmt, base_dir)
+
+    if fmt == "csv":
+        df.to_csv(path, mode="a" if append else "w", header=not append)
+        return
+
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if not append and os.path.exists(path):
+        shutil.rmtree(path)
+
+    # write_dataset writes no file for an empty table; a placeholder file
+    # without rows keeps the table and its schema readable until rows arrive
+    empty_path = os.path.join(path, f"empty.{fmt}")
+
+    if len(df) == 0:
+        if not os.path.exists(path):
+            _write_empty_table(df, empty_path, fmt)
+        return
+
+    if os.path.exists(empty_path):
+        os.remove(empty_path)
+
+    partition_col = PARTITION_COLUMNS.get(name)
+    partitioning = None
+
+    if partition_col is not None:
+        # Day of the (UTC) timestamp, computed on the int64 values instead of per-row strftime
+        days = df[partition_col].values.astype("datetime64[D]")
+        df = df.assign(**{PARTITION_KEY: days.astype(str)})
+        partitioning = ds.partitioning(
+            pa.schema([(PARTITION_KEY, pa.string())]),
+            flavor="hive"
+        )
+
+    ds.write_dataset(
+        pa.Table.from_pandas(df, preserve_index=True),
+        path,
+        format=STORAGE_FORMATS[fmt],
+        partitioning=partitioning,
+        # A unique name per write so appended chunks land next to earlier ones
+        basename_template=f"part-{uuid.uuid4().hex}-{{i}}.{fmt}",
+        existing_data_behavior="overwrite_or_ignore",
+    )
+
+
+def _write_empty_table(df: pd.DataFrame, file_path: str, fmt: str) -> None:
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, preserve_index=True)
+
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    if fmt == "parquet":
+        pq.write_table(table, file_path)
+    else:
+        with pa.ipc.new_file(file_path, table.schema) as writer:
+            writer.write_table(table)
+
+
+def open_dataset(name: str, base_dir: str = ".", fmt: str = None):
+    """
+    Table name (Parquet or Arrow) as a pyarrow dataset, scanned lazily.
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    fmt = fmt or detect_format(name, base_dir)
+    path = table_path(name, fmt, base_dir)
+
+    dataset = ds.dataset(path, format=STORAGE_FORMATS[fmt], partitioning="hive")
+
+    # The dataset schema comes from one fragment; a chunk whose column was all
+    # missing stored it as null, so merge every fragment's schema instead
+    schema = pa.unify_schemas(
+        [dataset.schema] + [fragment.physical_schema for fragment in dataset.get_fragments()],
+        promote_options="permissive"
+    )
+
+    return ds.dataset(path, schema=schema, format=STORAGE_FORMATS[fmt], partitioning="hive")
+
+
+def read_table(
+    name: str,
+    base_dir: str = ".",
+    columns: List[str] = None,
+    filters: List[Tuple] = None,
+    fmt: str = None
+) -> pd.DataFrame:
+    """
+    Reads table name, detecting its format unless fmt is given.
+    columns projects the read to those columns (the index is always kept).
+    filters is a list of (column, op, value) tuples ANDed together, e.g.
+    [("event_date", ">=", "2025-02-27")]; on Parquet and Arrow tables they
+    prune partitions and row groups before any data is decoded.
+    """
+    fmt = fmt or detect_format(name, base_dir)
+    path = table_path(name, fmt, base_dir)
+
+    if fmt == "csv":
+        return _read_csv_table(path, columns, filters)
+
+    import pyarrow.parquet as pq
+
+    dataset = open_dataset(name, base_dir, fmt)
+
+    if columns is not None:
+        index_columns = [
+            col for col in dataset.schema.names
+            if col.startswith("__index_level_")
+        ]
+        columns = list(columns) + index_columns
+
+    table = dataset.to_table(
+        columns=columns,
+        filter=pq.filters_to_expression(filters) if filters else None
+    )
+
+    df = table.to_pandas()
+
+    if PARTITION_KEY in df.columns and (columns is None or PARTITION_KEY not in columns):
+        df = df.drop(columns=PARTITION_KEY)
+
+    return df
+
+
+def _read_csv_table(path: str, columns: List[str], filters: List[Tuple]) -> pd.DataFrame:
+
+    # CSV has no pushdown: filter columns are read and the predicates applied after parsing
+    name = os.path.splitext(os.path.basename(path))[0]
+    partition_col = PARTITION_COLUMNS.get(name)
+
+    filter_columns = {
+        partition_col if col == PARTITION_KEY else col
+        for col, _, _ in filters or []
+    }
+
+    usecols = None
+    if columns is not None:
+        header = pd.read_csv(path, nrows=0).columns
+        wanted = set(columns) | filter_columns
+        usecols = [header[0]] + [col for col in header[1:] if col in wanted]
+
+    df = pd.read_csv(path, index_col=0, usecols=usecols)
+
+    for col, op, value in filters or []:
+        if col == PARTITION_KEY:
+            series = pd.to_datetime(df[partition_col], utc=True).dt.strftime("%Y-%m-%d")
+        else:
+            series = df[col]
+
+        df = df[_compare(series, op, value)]
+
+    if columns is not None:
+        df = df[list(columns)]
+
+    return df
+
+
+def _compare(series: pd.Series, op: str, value) -> np.ndarray:
+
+    if op in ("=", "=="):
+        return series == value
+    if op == "!=":
+        return series != value
+    if op == "<":
+        return series < value
+    if op == "<=":
+        return series <= value
+    if op == ">":
+        return series > value
+    if op == ">=":
+        return series >= value
+    if op == "in":
+        return series.isin(value)
+    if op == "not in":
+        return ~series.isin(value)
+
+    raise ValueError(f"Unsupported filter operator {op}")
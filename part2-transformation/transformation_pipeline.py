@@ -1,10 +1,54 @@
 FOLDER_PATH = "event-file-input"  # Edit path to the folder containing the event csvs. Make sure there are no other csvs there.
 
+STREAMING_MODE = False  # Read, enrich and write events in chunks of CHUNK_SIZE rows instead of loading every file at once
+CHUNK_SIZE = 250_000
+
+OUTPUT_FORMAT = "parquet"  # Storage format of the output tables: "parquet", "arrow" or "csv"
+EXPORT_CSV = False  # Also write a flat CSV copy of every output table
+
+VALIDATE_INPUTS = True  # Run the part 1 data quality checks on each input file as it is read here, so files are parsed once
+
+INCREMENTAL_MODE = False  # Only process input files that were not seen by the previous run
+STATE_DIR = "pipeline_state"  # Where incremental runs keep their state file and table snapshots
+
+PARTITIONS = 1  # Split events by client into this many shards run in parallel (plus one for anonymous events); 1 runs in this process
+PARTITION_WORKERS = None  # Worker processes for the shards; None uses every core
+SPILL_DIR = None  # Where shards are spilled for the workers; None uses the system temp folder
+
+STAGE_CACHE_DIR = "stage_cache"  # Stage outputs keyed by their inputs, settings and code, reused while none of them change; None disables the cache
+STAGE_CACHE_MAX_BYTES = 4 * 1024**3  # Least recently used stage outputs are evicted beyond this size
+
+PROFILE_STAGES = True  # Record time, CPU, peak memory and rows of each stage and save them as a run manifest
+RUN_MANIFEST_DIR = "run_manifests"  # One JSON manifest per run; production monitoring compares stage timings across them
+
+TABLE_MANIFEST_PATH = "table_manifest.json"  # Row counts, time range, rows per day and checksum of each output table, for metadata-only checks
+KPI_STORE_PATH = "daily_kpis.csv"  # Append-only daily revenue, conversions, sessions, events and direct share; monitoring baselines read it
+
 # Building Enriched Events
 
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from datetime import timedelta
+import numpy as np
 import pandas as pd
-from urllib.parse import urlparse, parse_qs
-from typing import Dict, List
+from urllib.parse import urlparse, parse_qs, unquote
+import sys
+from typing import Dict, List, Tuple
+
+from kpi_store import append_daily_kpis, build_daily_kpis
+from stage_cache import StageCache, stage_key
+from table_manifest import build_table_manifest, write_table_manifest
+from table_storage import read_table, table_path, write_table
+
+# Modules shared with the part 1 validator
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "part1-data-quality"))
+from schema_index import SCHEMA_INDEX_PATH, build_schema_index, drift_transitions, file_fingerprint
+from stage_profiler import PROFILER, profile_stage
+
+UTM_PARAMS = ["utm_source", "utm_medium", "utm_campaign", "utm_content"]
 
 
 def extract_utm_params(url: str) -> Dict[str, str]:
@@ -31,6 +75,128 @@ def extract_utm_params(url: str) -> Dict[str, str]:
     }
 
 
+# Columnar UTM extraction
+#
+# parse_qs keeps only "key=value" fields with a non-empty value, percent-decodes
+# keys and values (after turning "+" into a space) and the first value wins.
+# The regexes below reproduce that on the raw query string. Queries with a "%"
+# inside a key cannot be matched literally and fall back to extract_utm_params.
+
+_UNSAFE_URL_CHARS = re.compile(r"[\t\r\n]")
+_ENCODED_KEY = re.compile(r"(?:^|&)[^&=]*%")
+_UTM_PATTERNS = {
+    param: re.compile(r"(?:^|&)" + param + r"=([^&]+)")
+    for param in UTM_PARAMS
+}
+
+
+def _utm_from_query(query: str) -> List[str]:
+
+    values = []
+    for param in UTM_PARAMS:
+        match = _UTM_PATTERNS[param].search(query)
+        if match is None:
+            values.append(None)
+            continue
+
+        value = match.group(1)
+        if "%" in value or "+" in value:
+            value = unquote(value.replace("+", " "))
+        values.append(value)
+
+    return values
+
+
+def extract_utm_columns(urls: pd.Series) -> pd.DataFrame:
+    """
+    Vectorized equivalent of extract_utm_params for a whole column.
+    Each distinct URL is parsed once and the result is broadcast back as
+    categorical columns.
+    """
+    codes, uniques = pd.factorize(urls)
+
+    queries = (
+        pd.Series(uniques, dtype=object)
+        .str.replace(_UNSAFE_URL_CHARS, "", regex=True)
+        .str.split("#", n=1).str[0]
+        .str.partition("?")[2]
+    )
+
+    # Percent-encoded keys are rare enough to go through the reference parser
+    rows = [
+        list(extract_utm_params(url).values())
+        if _ENCODED_KEY.search(query)
+        else _utm_from_query(query)
+        for url, query in zip(uniques, queries)
+    ]
+
+    # NaN URLs are not factorized and get code -1, mapped to an all-None row
+    rows.append([None] * len(UTM_PARAMS))
+
+    utm_df = pd.DataFrame(rows, columns=UTM_PARAMS, dtype=object)
+
+    # Broadcast as categoricals: each row gets the code of its URL's value
+    columns = {}
+    for param in UTM_PARAMS:
+        distinct = pd.Categorical(utm_df[param])
+        columns[param] = pd.Categorical.from_codes(distinct.codes[codes], distinct.categories)
+
+    return pd.DataFrame(columns, index=urls.index)
+
+
+# User agent classification
+#
+# Rules are evaluated in order against the lowercased user agent and the first
+# match wins. Each dimension falls back to its default when nothing matches.
+
+UA_RULES = {
+    "device_type": [
+        ("mobile", re.compile(r"mobile|iphone|android")),
+        ("tablet", re.compile(r"tablet|ipad")),
+    ],
+    "operating_system": [
+        ("Android", re.compile(r"android")),
+        ("iOS", re.compile(r"iphone|ipad|ios")),
+        ("Windows", re.compile(r"windows")),
+        ("MacOS", re.compile(r"mac os|macintosh")),
+        ("Linux", re.compile(r"linux")),
+    ],
+    "browser": [
+        ("Chrome", re.compile(r"^(?=.*chrome).*safari", re.DOTALL)),
+        ("Safari", re.compile(r"^(?!.*chrome).*safari", re.DOTALL)),
+        ("Firefox", re.compile(r"firefox")),
+        ("Edge", re.compile(r"edge")),
+        ("Internet Explorer", re.compile(r"msie|trident")),
+    ],
+}
+
+UA_DEFAULTS = {
+    "device_type": "desktop",
+    "operating_system": "Other",
+    "browser": "Other",
+}
+
+# Stable category dictionaries so that frames built from different files concat cleanly
+UA_CATEGORIES = {
+    "device_type": ["mobile", "tablet", "desktop"],
+    "operating_system": ["Android", "iOS", "Windows", "MacOS", "Linux", "Other"],
+    "browser": ["Chrome", "Safari", "Firefox", "Edge", "Internet Explorer", "Other"],
+    "is_mobile": [False, True],
+}
+
+UA_CACHE_SIZE = 100_000
+UA_CACHE_PATH = "ua_classifier_cache.json"  # Set to None to keep the cache in memory only
+
+
+def _match_rules(ua: str, dimension: str) -> str:
+
+    for label, pattern in UA_RULES[dimension]:
+        if pattern.search(ua):
+            return label
+
+    return UA_DEFAULTS[dimension]
+
+
 def parse_user_agent(ua_string: str) -> Dict[str, str]:
     """
     Lightweight, dependency-free user agent parser
@@ -46,100 +212,243 @@ def parse_user_agent(ua_string: str) -> Dict[str, str]:
 
     ua = ua_string.lower()
 
+    device_type = _match_rules(ua, "device_type")
 
-    # Device
+    return {
+        "device_type": device_type,
+        "operating_system": _match_rules(ua, "operating_system"),
+        "browser": _match_rules(ua, "browser"),
+        "is_mobile": device_type != "desktop",
+    }
 
-    if "mobile" in ua or "iphone" in ua or "android" in ua:
-        device_type = "mobile"
-        is_mobile = True
-    elif "tablet" in ua or "ipad" in ua:
-        device_type = "tablet"
-        is_mobile = True
-    else:
-        device_type = "desktop"
-        is_mobile = False
-
-
-    # Operating System
-
-    if "android" in ua:
-        operating_system = "Android"
-    elif "iphone" in ua or "ipad" in ua or "ios" in ua:
-        operating_system = "iOS"
-    elif "windows" in ua:
-        operating_system = "Windows"
-    elif "mac os" in ua or "macintosh" in ua:
-        operating_system = "MacOS"
-    elif "linux" in ua:
-        operating_system = "Linux"
-    else:
-        operating_system = "Other"
 
+class UserAgentClassifier:
+    """
+    Bounded LRU cache in front of parse_user_agent.
+    Lives for the whole process so repeated user agents across files are
+    classified once, and can be saved to disk to carry over between runs.
+    """
 
-    # Browser
+    def __init__(self, maxsize: int = UA_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
 
-    if "chrome" in ua and "safari" in ua:
-        browser = "Chrome"
-    elif "safari" in ua and "chrome" not in ua:
-        browser = "Safari"
-    elif "firefox" in ua:
-        browser = "Firefox"
-    elif "edge" in ua:
-        browser = "Edge"
-    elif "msie" in ua or "trident" in ua:
-        browser = "Internet Explorer"
-    else:
-        browser = "Other"
+    def classify(self, ua_string: str) -> Tuple:
 
-    return {
-        "device_type": device_type,
-        "operating_system": operating_system,
-        "browser": browser,
-        "is_mobile": is_mobile,
-    }
+        if ua_string in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(ua_string)
+            return self.cache[ua_string]
+
+        self.misses += 1
+        result = tuple(parse_user_agent(ua_string).values())
+
+        self.cache[ua_string] = result
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+            self.evictions += 1
+
+        return result
+
+    def stats(self) -> Dict[str, float]:
+
+        lookups = self.hits + self.misses
+
+        return {
+            "size": len(self.cache),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    @staticmethod
+    def rules_fingerprint() -> str:
+
+        rules = {
+            dimension: [(label, pattern.pattern) for label, pattern in rules]
+            for dimension, rules in UA_RULES.items()
+        }
+        return hashlib.sha256(
+            json.dumps([rules, UA_DEFAULTS], sort_keys=True).encode()
+        ).hexdigest()
+
+    def save(self, path: str) -> None:
+
+        # Written under a temporary name so a killed run never leaves a truncated cache
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "rules_fingerprint": self.rules_fingerprint(),
+                    "entries": [[ua, list(result)] for ua, result in self.cache.items()],
+                },
+                f,
+            )
+        os.replace(tmp_path, path)
+
+    def load(self, path: str) -> None:
+
+        if not os.path.exists(path):
+            return
+
+        # An unreadable cache is rebuilt from scratch rather than failing the run
+        try:
+            with open(path) as f:
+                state = json.load(f)
+            fingerprint = state.get("rules_fingerprint")
+            entries = [(ua, tuple(result)) for ua, result in state["entries"][-self.maxsize:]]
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return
+
+        # Cached results are only valid for the rules that produced them
+        if fingerprint != self.rules_fingerprint():
+            return
+
+        self.cache.update(entries)
+
+
+# Loaded from and saved to UA_CACHE_PATH around each pipeline run
+UA_CLASSIFIER = UserAgentClassifier()
+
+
+def extract_ua_columns(user_agents: pd.Series) -> pd.DataFrame:
+    """
+    Classifies each distinct user agent once through UA_CLASSIFIER and
+    broadcasts device/OS/browser/is_mobile back as categorical columns.
+    """
+    codes, uniques = pd.factorize(user_agents)
+
+    classified = [UA_CLASSIFIER.classify(ua) for ua in uniques]
+
+    columns = {}
+    for i, (name, categories) in enumerate(UA_CATEGORIES.items()):
+        category_codes = np.array(
+            [categories.index(result[i]) for result in classified] + [-1],
+            dtype=np.int8,
+        )
+        # NaN user agents have code -1 and pick the trailing -1 (missing) entry
+        columns[name] = pd.Categorical.from_codes(
+            category_codes[codes],
+            categories=categories,
+        )
+
+    return pd.DataFrame(columns, index=user_agents.index)
 
 #Fix for the client ID schema drift
 
-def resolve_client_id(df: pd.DataFrame) -> pd.Series:
+CLIENT_ID_COLUMNS = ["client_id", "clientId"]
+
+
+def client_id_column(columns: List[str]) -> str:
     """
-    Resolves client identity across schema versions.
+    Picks the client id column of a schema version.
     Priority:
       1. client_id
       2. clientId
     """
-
-    has_client_id = "client_id" in df.columns
-    has_clientID = "clientId" in df.columns
-
-    if has_client_id:
-        return df["client_id"]
-
-    if has_clientID:
-        return df["clientId"]
+    for col in CLIENT_ID_COLUMNS:
+        if col in columns:
+            return col
 
     raise ValueError(
         "No client id column found. Expected one of: client_id, clientID"
     )
 
 
-def build_enriched_events(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+def resolve_client_id(df: pd.DataFrame) -> pd.Series:
+    """
+    Resolves client identity across schema versions.
+    """
+    return df[client_id_column(df.columns)]
+
+
+# Compact event representation
+#
+# Text columns are held as categoricals: an integer code per row and each
+# distinct value stored once, in a sorted (reproducible) dictionary. This
+# covers the wide raw columns too (page_url, user_agent), whose strings are
+# only materialized again when a table is written out.
+
+COMPACT_COLUMNS = ["client_id", "event_name", "page_url", "user_agent"] + UTM_PARAMS
+
+REPORT_MEMORY = True  # Print the in-memory size of each stage's output table
+
+
+def compact_events(df: pd.DataFrame) -> pd.DataFrame:
+
+    return df.astype({
+        col: "category"
+        for col in COMPACT_COLUMNS
+        if col in df.columns and not isinstance(df[col].dtype, pd.CategoricalDtype)
+    })
+
+
+def concat_compact(frames: List[pd.DataFrame], **kwargs) -> pd.DataFrame:
+    """
+    pd.concat that keeps categorical columns categorical: frames whose
+    dictionaries differ are recoded to the union of their categories first,
+    instead of letting concat fall back to object strings.
+    """
+    frames = list(frames)
+    recode = {}
+
+    for col in frames[0].columns:
+        dtypes = [frame[col].dtype for frame in frames if col in frame.columns]
+        if (
+            all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes)
+            and any(dtype != dtypes[0] for dtype in dtypes)
+        ):
+            categories = dtypes[0].categories
+            for dtype in dtypes[1:]:
+                categories = categories.union(dtype.categories)
+            recode[col] = pd.CategoricalDtype(categories)
+
+    if recode:
+        frames = [
+            frame.astype({col: dtype for col, dtype in recode.items() if col in frame.columns})
+            for frame in frames
+        ]
+
+    return pd.concat(frames, **kwargs)
+
 
-    df = pd.concat(dfs, ignore_index=True)
+def report_memory(stage: str, df: pd.DataFrame) -> None:
 
-    df["client_id"] = resolve_client_id(df)
+    if REPORT_MEMORY:
+        size = df.memory_usage(deep=True).sum()
+        print(f"{stage}: {len(df):,} rows, {size / 2**20:,.1f} MiB in memory")
 
 
-    df["event_ts"] = pd.to_datetime(
-        df["timestamp"],
-        errors="coerce",
-        utc=True
+@profile_stage
+def build_enriched_events(dfs: List[pd.DataFrame]) -> pd.DataFrame:
+
+    # Resolve the client id per file, before concat lines up client_id and clientId frames.
+    # Timestamps are parsed per file too, unless validation already parsed them into event_ts.
+    df = pd.concat(
+        [
+            frame.assign(
+                client_id=resolve_client_id(frame),
+                event_ts=(
+                    frame["event_ts"]
+                    if "event_ts" in frame.columns
+                    else parse_timestamps(frame["timestamp"])
+                )
+            )
+            for frame in dfs
+        ],
+        ignore_index=True
     )
 
     # Extract UTM parameters
-    utm_df = df["page_url"].apply(extract_utm_params).apply(pd.Series)
+    utm_df = extract_utm_columns(df["page_url"])
 
     # Parse user agent
-    ua_df = df["user_agent"].apply(parse_user_agent).apply(pd.Series)
+    ua_df = extract_ua_columns(df["user_agent"])
 
     df = pd.concat([df, utm_df, ua_df], axis=1)
 
@@ -162,224 +471,603 @@ def build_enriched_events(dfs: List[pd.DataFrame]) -> pd.DataFrame:
         ]
     ]
 
-    return enriched_events
+    return compact_events(enriched_events)
 
 import glob
-import os
 
-dfs = []
 
-for file_path in glob.glob(os.path.join(FOLDER_PATH, "*.csv")):
-    df = pd.read_csv(file_path)
-    dfs.append(df)
+def list_input_files(folder_path: str) -> List[str]:
+
+    # Sorted so that row labels are stable and files named events_YYYYMMDD.csv arrive in date order
+    return sorted(glob.glob(os.path.join(folder_path, "*.csv")))
 
-enriched_events = build_enriched_events(dfs=dfs)
-# saving incase of later need
-enriched_events.to_csv('enriched_events.csv')
 
-# Sanity Checks
-assert enriched_events["event_ts"].isna().sum() == 0
-assert set(enriched_events.columns) == {
+def input_file_day(file_path: str) -> str:
+
+    # Day a file like events_YYYYMMDD.csv covers, as YYYY-MM-DD; None when its name has no date
+    match = re.search(r"(\d{4})(\d{2})(\d{2})", os.path.basename(file_path))
+
+    return "-".join(match.groups()) if match else None
+
+# Streaming ingestion
+#
+# Only the columns enrichment needs are read, all as strings, so chunks from
+# different files and schema versions line up without dtype inference.
+
+INPUT_COLUMNS = [
     "client_id",
-    "event_name",
-    "event_ts",
+    "clientId",
     "page_url",
-    "utm_source",
-    "utm_medium",
-    "utm_campaign",
-    "utm_content",
-    "device_type",
-    "operating_system",
-    "browser",
-    "is_mobile",
+    "timestamp",
+    "event_name",
+    "event_data",
     "user_agent",
-    "event_data"
-}
+]
 
-assert enriched_events["device_type"].isna().sum() == 0
-assert set(enriched_events["device_type"].unique()).issubset(
-    {"mobile", "tablet", "desktop"}
-)
+INPUT_DTYPES = {col: "object" for col in INPUT_COLUMNS}
 
-# Sessionization
 
-SESSION_TIMEOUT_MINUTES = 30
+def input_usecols(schema_entry: Dict) -> List[str]:
 
-import numpy as np
-import pandas as pd
+    # The input columns a file has, from its schema index entry; fails on a
+    # file without a client id column before any of its data is parsed
+    client_id_column(schema_entry["columns"])
 
+    return [col for col in schema_entry["columns"] if col in INPUT_COLUMNS]
 
-def assign_sessions(enriched_events: pd.DataFrame) -> pd.DataFrame:
 
-    df = enriched_events.copy()
+def iter_event_chunks(
+    folder_path: str,
+    chunksize: int,
+    validation_results: List[Dict] = None,
+    schema_index: Dict[str, Dict] = None
+):
 
-    # Session identity:
-    # - Identified users → client_id
-    # - Anonymous users → per-event anonymous key (no cross-event linking)
+    for file_path in list_input_files(folder_path):
+        if validation_results is None:
+            reader = pd.read_csv(
+                file_path,
+                usecols=(
+                    input_usecols(schema_index[file_path])
+                    if schema_index
+                    else lambda col: col in INPUT_COLUMNS
+                ),
+                dtype=INPUT_DTYPES,
+                chunksize=chunksize
+            )
+            for chunk in reader:
+                yield chunk
+            continue
 
-    df["session_identity"] = np.where(
-        df["client_id"].notna(),
-        df["client_id"].astype(str),
-        "anon_event_" + df.index.astype(str)
-    )
+        from data_validation_framework import SCHEMA_CONTRACT, merge_chunk_summaries, summarize_chunk
 
-    df = df.sort_values(["session_identity", "event_ts"])
+        # Validation needs every column with its inferred dtype; enrichment
+        # then gets the input columns as strings plus the parsed event_ts
+        summaries = []
+        for chunk in pd.read_csv(file_path, chunksize=chunksize):
+            parsed = {}
+            summaries.append(summarize_chunk(chunk, SCHEMA_CONTRACT, parsed))
 
-    df["prev_event_ts"] = (
-        df.groupby("session_identity")["event_ts"].shift(1)
-    )
+            columns = [col for col in chunk.columns if col in INPUT_COLUMNS]
+            chunk = chunk[columns].astype({col: "object" for col in columns})
+            if "timestamp" in parsed:
+                chunk["event_ts"] = parsed["timestamp"]
+
+            yield chunk
+
+        validation_results.append(
+            merge_chunk_summaries(os.path.basename(file_path), summaries, SCHEMA_CONTRACT)
+        )
+
+
+# Validation on read
+#
+# The part 1 checks run on the frames read here anyway, and the timestamps
+# they parse become event_ts, so no input file or timestamp column is parsed
+# twice across validation and transformation. The validator is imported
+# where it is used, so runs with VALIDATE_INPUTS off never load it.
 
-    df["minutes_since_prev"] = (
-        (df["event_ts"] - df["prev_event_ts"])
-        .dt.total_seconds()
-        .div(60)
+from timestamp_parsing import parse_timestamps
+
+
+def read_input_file(
+    file_path: str,
+    validation_results: List[Dict] = None,
+    schema_entry: Dict = None
+) -> pd.DataFrame:
+    """
+    Reads one input file. With validation_results given, the file is also
+    validated against SCHEMA_CONTRACT, its result appended, and the parsed
+    timestamp column kept as event_ts. Otherwise, with the file's schema
+    index entry given, only the input columns are parsed.
+    """
+    if validation_results is None:
+        return pd.read_csv(
+            file_path,
+            usecols=input_usecols(schema_entry) if schema_entry else None
+        )
+
+    from data_validation_framework import SCHEMA_CONTRACT, validate_events_csv
+
+    df = pd.read_csv(file_path)
+
+    parsed = {}
+    validation_results.append(
+        validate_events_csv(df, os.path.basename(file_path), SCHEMA_CONTRACT, parsed=parsed)
     )
 
-    df["is_new_session"] = (
-        df["minutes_since_prev"].isna()
-        | (df["minutes_since_prev"] > SESSION_TIMEOUT_MINUTES)
-    ).astype(int)
+    if "timestamp" in parsed:
+        df["event_ts"] = parsed["timestamp"]
+
+    return df
+
+
+def check_enriched_events(enriched_events: pd.DataFrame) -> None:
+
+    assert enriched_events["event_ts"].isna().sum() == 0
+    assert set(enriched_events.columns) == {
+        "client_id",
+        "event_name",
+        "event_ts",
+        "page_url",
+        "utm_source",
+        "utm_medium",
+        "utm_campaign",
+        "utm_content",
+        "device_type",
+        "operating_system",
+        "browser",
+        "is_mobile",
+        "user_agent",
+        "event_data"
+    }
 
-    df["session_index"] = (
-        df.groupby("session_identity")["is_new_session"]
-        .cumsum()
+    assert enriched_events["device_type"].isna().sum() == 0
+    assert set(enriched_events["device_type"].unique()).issubset(
+        {"mobile", "tablet", "desktop"}
     )
 
-    df["session_id"] = (
-        df["session_identity"]
-        + "_"
-        + df["session_index"].astype(str)
+
+def save_table(df: pd.DataFrame, name: str) -> None:
+
+    write_table(df, name, OUTPUT_FORMAT)
+
+    if EXPORT_CSV and OUTPUT_FORMAT != "csv":
+        write_table(df, name, "csv")
+
+
+def stream_enriched_events(
+    folder_path: str,
+    fmt: str,
+    chunksize: int,
+    validation_results: List[Dict] = None,
+    schema_index: Dict[str, Dict] = None
+) -> int:
+    """
+    Enriches the input folder chunk by chunk and appends each chunk to the
+    enriched_events table, so only one chunk is held in memory at a time.
+    Row labels continue across chunks, matching a single full-frame write.
+    """
+    rows_written = 0
+    header_written = False
+
+    for chunk in iter_event_chunks(folder_path, chunksize, validation_results, schema_index):
+        enriched = build_enriched_events([chunk])
+        enriched.index += rows_written
+
+        check_enriched_events(enriched)
+
+        write_table(enriched, "enriched_events", fmt, append=header_written)
+        header_written = True
+        rows_written += len(enriched)
+
+    return rows_written
+
+
+def read_enriched_events(fmt: str) -> pd.DataFrame:
+    """
+    Loads the enriched_events table back in row-label order with the dtypes
+    build_enriched_events produces.
+    """
+    if fmt == "csv":
+        df = pd.read_csv(table_path("enriched_events", "csv"), index_col=0, dtype="object")
+
+        df["event_ts"] = pd.to_datetime(df["event_ts"], utc=True, format="ISO8601")
+        df["is_mobile"] = df["is_mobile"].map({"True": True, "False": False})
+
+    else:
+        df = read_table("enriched_events", fmt=fmt).sort_index()
+
+    for col, categories in UA_CATEGORIES.items():
+        df[col] = pd.Categorical(df[col], categories=categories)
+
+    return compact_events(df)
+
+
+# Incremental runs
+#
+# STATE_DIR/state.json records every processed file (name, size, mtime, sha256),
+# the high-water event_ts and the settings the outputs were built with. The
+# typed output tables are snapshotted next to it so the next run can extend
+# them instead of recomputing from scratch.
+
+STATE_FILE = "state.json"
+
+
+def load_pipeline_state(state_dir: str) -> Dict:
+
+    path = os.path.join(state_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return None
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def plan_incremental_run(state: Dict, input_files: List[str]) -> List[str]:
+    """
+    Returns the input files the previous run has not seen, or None when
+    the outputs have to be rebuilt from scratch: no state yet, a processed
+    file changed or disappeared, or a new file sorts before a processed one
+    (which would shift the row labels of existing events).
+    """
+    if state is None:
+        return None
+
+    processed = {entry["name"]: entry for entry in state["files"]}
+    names = [os.path.basename(file_path) for file_path in input_files]
+
+    for name, entry in processed.items():
+        if name not in names:
+            return None
+
+        file_path = input_files[names.index(name)]
+        if file_fingerprint(file_path, entry)["sha256"] != entry["sha256"]:
+            return None
+
+    new_files = [
+        file_path
+        for file_path, name in zip(input_files, names)
+        if name not in processed
+    ]
+
+    if new_files and processed and os.path.basename(new_files[0]) < max(processed):
+        return None
+
+    return new_files
+
+
+def load_snapshot(state_dir: str, table: str) -> pd.DataFrame:
+
+    return pd.read_pickle(os.path.join(state_dir, f"{table}.pkl"))
+
+
+def save_pipeline_state(
+    state_dir: str,
+    input_files: List[str],
+    tables: Dict[str, pd.DataFrame],
+    settings: Dict,
+    known: Dict[str, Dict] = None
+) -> None:
+
+    os.makedirs(state_dir, exist_ok=True)
+
+    for table, df in tables.items():
+        df.to_pickle(os.path.join(state_dir, f"{table}.pkl"))
+
+    # Files already fingerprinted this run (by path, e.g. in the schema index)
+    # are only hashed again if they changed since
+    known = known or {}
+
+    state = {
+        "files": [file_fingerprint(file_path, known.get(file_path)) for file_path in input_files],
+        "watermark": tables["events_with_sessions"]["event_ts"].max().isoformat(),
+        "settings": settings,
+    }
+
+    # Written last so an interrupted run never leaves state pointing at stale snapshots
+    with open(os.path.join(state_dir, STATE_FILE), "w") as f:
+        json.dump(state, f, indent=2)
+
+
+# Sessionization
+
+SESSION_TIMEOUT_MINUTES = 30
+
+from sessionization import encode_identities, sessionize
+
+
+@profile_stage
+def assign_sessions(enriched_events: pd.DataFrame) -> pd.DataFrame:
+    """
+    Session identity:
+    - Identified users → client_id
+    - Anonymous users → per-event anonymous key (no cross-event linking)
+
+    Returns the events sorted by identity and time with session_index,
+    session_id and the integer session_key later stages group on.
+    """
+    identity_codes, decode_identities = encode_identities(enriched_events["client_id"])
+
+    event_ts = enriched_events["event_ts"]
+    order, session_key, session_index = sessionize(
+        identity_codes,
+        event_ts.values.astype("datetime64[ns]", copy=False).view("int64"),
+        timeout_ns=SESSION_TIMEOUT_MINUTES * 60 * 10**9,
+        missing_ts=event_ts.isna().to_numpy()
     )
 
-    return df.drop(
-        columns=[
-            "session_identity",
-            "prev_event_ts",
-            "minutes_since_prev",
-            "is_new_session",
-        ]
+    df = enriched_events.take(order)
+
+    df["session_index"] = session_index
+    df["session_key"] = session_key
+
+    # One id string per session, shared by all of its events
+    first_events = np.flatnonzero(np.diff(session_key, prepend=-1))
+    session_ids = np.array(
+        [
+            f"{identity}_{index}"
+            for identity, index in zip(
+                decode_identities(identity_codes[order][first_events]).tolist(),
+                session_index[first_events].tolist()
+            )
+        ],
+        dtype=object
     )
 
+    df["session_id"] = session_ids[session_key]
 
+    return df
 
-def build_sessions(events_with_sessions: pd.DataFrame) -> pd.DataFrame:
 
-    # Identify first event in each session
-    first_events = (
-        events_with_sessions
-        .sort_values("event_ts")
-        .groupby("session_id")
-        .first()
-        .reset_index()
-    )
 
-    # Session aggregates
-    session_agg = (
-        events_with_sessions
-        .groupby("session_id")
-        .agg(
-            client_id=("client_id", "first"),
-            session_start_ts=("event_ts", "min"),
-            session_end_ts=("event_ts", "max"),
-            event_count=("event_name", "count"),
-
-            # Conversion flag
-
-            has_conversion=(
-                "event_name",
-                lambda x: (x == "checkout_completed").any()
-            ),
+# Landing attributes taken from each session's first event
+LANDING_COLUMNS = {
+    "page_url": "landing_page",
+    "utm_source": "landing_utm_source",
+    "utm_medium": "landing_utm_medium",
+    "utm_campaign": "landing_utm_campaign",
+    "device_type": "landing_device_type",
+    "operating_system": "landing_operating_system",
+    "browser": "landing_browser",
+    "is_mobile": "landing_is_mobile",
+}
+
+
+def _first_valid_positions(valid: np.ndarray, starts: np.ndarray) -> np.ndarray:
+
+    # Position of the first valid row of each run starting at starts, or -1
+    # when the whole run is missing (what groupby first() falls back to)
+    n = len(valid)
+    positions = np.minimum.reduceat(np.where(valid, np.arange(n), n), starts)
+    ends = np.append(starts[1:], n)
+
+    return np.where(positions < ends, positions, -1)
+
+
+def _take_positions(column: pd.Series, positions: np.ndarray) -> np.ndarray:
+
+    # Positional pick keeping the column's dtype; -1 gives a missing value
+    return column.array.take(positions, allow_fill=True)
+
+
+@profile_stage
+def build_sessions(events_with_sessions: pd.DataFrame) -> pd.DataFrame:
+    """
+    One row per session, computed in a single pass over the events in
+    assign_sessions order: each session is a contiguous run of session_key,
+    sorted by time, so aggregates are reductions over run boundaries and
+    landing attributes are picks of each run's first (non-missing) value.
+    """
+    events = events_with_sessions
+    session_key = events["session_key"].to_numpy()
+
+    # Regroup stably if the runs were broken up, so each session keeps its event order
+    if len(session_key) > 1 and (np.diff(session_key) < 0).any():
+        events = events.iloc[np.argsort(session_key, kind="stable")]
+        session_key = events["session_key"].to_numpy()
+
+    if len(events) == 0:
+        columns = [
+            "session_id", "client_id", "session_start_ts", "session_end_ts",
+            "event_count", "has_conversion", "session_duration_seconds",
+        ] + list(LANDING_COLUMNS.values())
+        return pd.DataFrame(columns=columns)
+
+    starts = np.flatnonzero(np.diff(session_key, prepend=session_key[0] - 1))
+
+    event_ts = events["event_ts"]
+    ts = event_ts.values.astype("datetime64[ns]", copy=False).view("int64")
+    missing_ts = event_ts.isna().to_numpy()
+
+    # NaT is the smallest int64, so it only needs masking for the minimum
+    start_ns = np.minimum.reduceat(np.where(missing_ts, np.iinfo(np.int64).max, ts), starts)
+    start_ns[start_ns == np.iinfo(np.int64).max] = np.iinfo(np.int64).min
+    end_ns = np.maximum.reduceat(ts, starts)
+
+    session_start_ts = pd.to_datetime(start_ns, utc=True)
+    session_end_ts = pd.to_datetime(end_ns, utc=True)
+
+    event_name = events["event_name"]
+
+    sessions = pd.DataFrame({
+        "session_id": events["session_id"].to_numpy()[starts],
+        "client_id": _take_positions(
+            events["client_id"],
+            _first_valid_positions(events["client_id"].notna().to_numpy(), starts)
+        ),
+        "session_start_ts": session_start_ts,
+        "session_end_ts": session_end_ts,
+        "event_count": np.add.reduceat(event_name.notna().to_numpy().astype(np.int64), starts),
+
+        # Conversion flag
+        "has_conversion": np.logical_or.reduceat(
+            (event_name == "checkout_completed").to_numpy(), starts
+        ),
+
+        # Duration
+        "session_duration_seconds": (session_end_ts - session_start_ts).total_seconds(),
+    })
+
+    # Landing attributes from first event (first non-missing value per column)
+    for column, landing_column in LANDING_COLUMNS.items():
+        sessions[landing_column] = _take_positions(
+            events[column],
+            _first_valid_positions(events[column].notna().to_numpy(), starts)
         )
-        .reset_index()
+
+    return sessions.iloc[
+        np.argsort(sessions["session_id"].to_numpy(), kind="stable")
+    ].reset_index(drop=True)
+
+def assign_sessions_incremental(
+    previous_events_with_sessions: pd.DataFrame,
+    new_enriched_events: pd.DataFrame
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Extends a previous sessionization with new events.
+    Only sessions that end within SESSION_TIMEOUT_MINUTES of a client's
+    earliest new event can absorb new events, so just those are reopened and
+    re-sessionized together with the new events. Earlier sessions keep their
+    ids and the reopened ones are renumbered after them.
+    Returns all events with sessions, in assign_sessions order, and the
+    re-sessionized events.
+    """
+    previous = previous_events_with_sessions
+
+    reopen_after = (
+        new_enriched_events
+        .groupby("client_id", observed=True)["event_ts"]
+        .min()
+        - timedelta(minutes=SESSION_TIMEOUT_MINUTES)
     )
 
-    # Duration
-    session_agg["session_duration_seconds"] = (
-        session_agg["session_end_ts"]
-        - session_agg["session_start_ts"]
-    ).dt.total_seconds()
+    candidates = previous[previous["client_id"].isin(reopen_after.index)]
+    session_end_ts = candidates.groupby("session_id")["event_ts"].transform("max")
+    reopened = candidates[session_end_ts >= candidates["client_id"].astype(object).map(reopen_after)]
 
-    # Landing attributes from first event
-    sessions = session_agg.merge(
-        first_events[
-            [
-                "session_id",
-                "page_url",
-                "utm_source",
-                "utm_medium",
-                "utm_campaign",
-                "device_type",
-                "operating_system",
-                "browser",
-                "is_mobile",
-            ]
-        ],
-        on="session_id",
-        how="left"
+    kept = previous.drop(index=reopened.index)
+
+    rebuilt = assign_sessions(
+        concat_compact([
+            reopened.drop(columns=["session_index", "session_key", "session_id"]),
+            new_enriched_events,
+        ])
     )
 
-    sessions = sessions.rename(columns={
-        "page_url": "landing_page",
-        "utm_source": "landing_utm_source",
-        "utm_medium": "landing_utm_medium",
-        "utm_campaign": "landing_utm_campaign",
-        "device_type": "landing_device_type",
-        "operating_system": "landing_operating_system",
-        "browser": "landing_browser",
-        "is_mobile": "landing_is_mobile",
-    })
+    # Continue numbering after the sessions that stay closed
+    closed_sessions = (
+        kept[kept["client_id"].isin(reopen_after.index)]
+        .groupby("client_id", observed=True)["session_id"]
+        .nunique()
+    )
+    # client_id is categorical, and mapping a categorical can return one that
+    # fillna cannot extend, so the lookups map plain values
+    offset = rebuilt["client_id"].astype(object).map(closed_sessions).fillna(0).astype(int)
+
+    rebuilt["session_index"] += offset
+    rebuilt["session_id"] = np.where(
+        offset > 0,
+        rebuilt["client_id"].astype(str) + "_" + rebuilt["session_index"].astype(str),
+        rebuilt["session_id"]
+    )
 
-    return sessions
+    # Same order as a full run: stable sort of label-ordered events by identity and time
+    events_with_sessions = concat_compact([kept, rebuilt]).sort_index()
+    identity_codes, _ = encode_identities(events_with_sessions["client_id"])
+    events_with_sessions = events_with_sessions.iloc[
+        np.lexsort((
+            events_with_sessions["event_ts"].values,
+            identity_codes,
+        ))
+    ]
 
-events_with_sessions = assign_sessions(enriched_events)
-sessions = build_sessions(events_with_sessions)
-events_with_sessions.to_csv("events_with_sessions.csv")
-sessions.to_csv("sessions.csv")
+    # Sessions are contiguous in this order, so numbering them by first appearance
+    # gives the same keys a full run would
+    events_with_sessions["session_key"] = pd.factorize(events_with_sessions["session_id"])[0]
 
-# Sanity Checks
+    return events_with_sessions, rebuilt
 
-# Each event has exactly one session
-assert events_with_sessions["session_id"].isna().sum() == 0
 
-# No overlapping sessions per user
-assert (
-    sessions
-    .sort_values(["client_id", "session_start_ts"])
-    .groupby("client_id")["session_start_ts"]
-    .is_monotonic_increasing
-).all()
+def build_sessions_incremental(
+    previous_sessions: pd.DataFrame,
+    previous_events_with_sessions: pd.DataFrame,
+    rebuilt_events: pd.DataFrame
+) -> pd.DataFrame:
 
-# Session duration is non-negative
-assert (sessions["session_duration_seconds"] >= 0).all()
+    # Drop every session that was reopened, then add the rebuilt ones back
+    reopened_ids = previous_events_with_sessions.loc[
+        previous_events_with_sessions.index.intersection(rebuilt_events.index),
+        "session_id"
+    ]
 
-# Conversions
+    sessions = concat_compact(
+        [
+            previous_sessions[~previous_sessions["session_id"].isin(reopened_ids)],
+            build_sessions(rebuilt_events),
+        ],
+        ignore_index=True
+    )
 
-import json
-from typing import Tuple
+    return sessions.sort_values("session_id", kind="stable", ignore_index=True)
+
+def check_sessions(events_with_sessions: pd.DataFrame, sessions: pd.DataFrame) -> None:
+
+    # Each event has exactly one session
+    assert events_with_sessions["session_id"].isna().sum() == 0
+
+    # No overlapping sessions per user
+    assert (
+        sessions
+        .sort_values(["client_id", "session_start_ts"])
+        .groupby("client_id", observed=True)["session_start_ts"]
+        .is_monotonic_increasing
+    ).all()
 
-def extract_transaction_fields(event_data: str) -> Tuple[str, float]:
+    # Session duration is non-negative
+    assert (sessions["session_duration_seconds"] >= 0).all()
 
-    payload = json.loads(event_data)
 
-    transaction_id = payload["transaction_id"]
-    revenue = float(payload["revenue"])
+# Conversions
+
+from payload_decoding import decode_payload_fields
 
-    return transaction_id, revenue
+# event_data fields of a conversion and how each value is converted (None keeps it as decoded)
+TRANSACTION_FIELDS = {
+    "transaction_id": None,
+    "revenue": float,
+}
 
-def build_fact_conversions(events_with_sessions: pd.DataFrame) -> pd.DataFrame:
+@profile_stage
+def build_fact_conversions(events_with_sessions: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    One row per transaction_id, from the first checkout_completed event.
+    Also returns the checkout events whose event_data could not be read,
+    with the reason in payload_error.
+    """
 
     # Filter conversion events
     conversions = events_with_sessions[
         events_with_sessions["event_name"] == "checkout_completed"
     ].copy()
 
-    # Extract transaction_id and revenue
-    conversions[["conversion_id", "revenue"]] = (
-        conversions["event_data"]
-        .apply(lambda x: pd.Series(extract_transaction_fields(x)))
+    # Extract transaction_id and revenue, decoding all payloads in one batch
+    fields, payload_errors = decode_payload_fields(
+        conversions["event_data"],
+        TRANSACTION_FIELDS
     )
+    conversions["conversion_id"] = fields["transaction_id"]
+    conversions["revenue"] = fields["revenue"]
+
+    # Payloads that cannot be decoded are set aside instead of failing the run
+    quarantined = conversions.loc[
+        payload_errors.index,
+        ["client_id", "session_id", "event_ts", "event_data"]
+    ].assign(payload_error=payload_errors)
 
-    conversions = conversions.sort_values("event_ts")
+    conversions = conversions.drop(index=payload_errors.index)
+
+    conversions = conversions.sort_values("event_ts", kind="stable")
 
     # one row per transaction_id
     conversions = (
@@ -401,245 +1089,1148 @@ def build_fact_conversions(events_with_sessions: pd.DataFrame) -> pd.DataFrame:
         "event_ts": "conversion_ts"
     })
 
-    return fact_conversions
+    return fact_conversions, quarantined
 
-fact_conversions = build_fact_conversions(events_with_sessions)
+def check_fact_conversions(fact_conversions: pd.DataFrame, events_with_sessions: pd.DataFrame) -> None:
 
-# Every conversion has a session
-assert fact_conversions["session_id"].isna().sum() == 0
+    # Every conversion has a session
+    assert fact_conversions["session_id"].isna().sum() == 0
 
-# conversion_id is present and unique
-assert fact_conversions["conversion_id"].notna().all()
-assert fact_conversions["conversion_id"].is_unique
+    # conversion_id is present and unique
+    assert fact_conversions["conversion_id"].notna().all()
+    assert fact_conversions["conversion_id"].is_unique
 
-# Revenue is always present and non-negative
-assert fact_conversions["revenue"].notna().all()
-assert (fact_conversions["revenue"] >= 0).all()
+    # Revenue is always present and non-negative
+    assert fact_conversions["revenue"].notna().all()
+    assert (fact_conversions["revenue"] >= 0).all()
 
-# All events are checkout_completed
-assert set(
-    events_with_sessions.loc[
-        events_with_sessions["event_name"] == "checkout_completed",
-        "event_name"
-    ]
-) == {"checkout_completed"}
+    # All events are checkout_completed
+    assert set(
+        events_with_sessions.loc[
+            events_with_sessions["event_name"] == "checkout_completed",
+            "event_name"
+        ]
+    ) == {"checkout_completed"}
 
-fact_conversions.to_csv("fact_conversions.csv")
 
 # Attribution
 
-from datetime import timedelta
-
 ATTRIBUTION_LOOKBACK_DAYS = 7
 
+@profile_stage
 def build_conversion_touchpoints(
     events_with_sessions: pd.DataFrame,
     fact_conversions: pd.DataFrame
 ) -> pd.DataFrame:
-
+    """
+    Touchpoints of each conversion: the client's marketing events in
+    [conversion_ts - ATTRIBUTION_LOOKBACK_DAYS, conversion_ts).
+    Range join: marketing events are sorted once by client and time and each
+    conversion's window is found by binary search, so memory grows with the
+    touchpoints returned instead of with conversions × events per client.
+    Rows follow fact_conversions, and each conversion's touchpoints keep
+    their events_with_sessions order, as the client_id merge returned them.
+    """
     # Keep only events with marketing context
     marketing_events = events_with_sessions[
         events_with_sessions[["utm_source", "utm_medium", "utm_campaign", "utm_content"]]
         .notna()
         .any(axis=1)
-    ].copy()
+        & events_with_sessions["event_ts"].notna()
+    ]
 
-    # Join conversions to events by client_id
-    touchpoints = fact_conversions.merge(
-        marketing_events,
-        on="client_id",
-        suffixes=("_conversion", "_event")
+    # Shared client codes; missing client ids match each other, as they did in the merge
+    client_codes, _ = pd.factorize(
+        pd.concat(
+            [marketing_events["client_id"], fact_conversions["client_id"]],
+            ignore_index=True
+        ),
+        use_na_sentinel=False
     )
+    event_client = client_codes[:len(marketing_events)].astype(np.int64)
+    conversion_client = client_codes[len(marketing_events):].astype(np.int64)
 
-    # Apply temporal constraints
-    touchpoints = touchpoints[
-        (touchpoints["event_ts"] < touchpoints["conversion_ts"]) &
-        (touchpoints["event_ts"] >=
-         touchpoints["conversion_ts"] - timedelta(days=ATTRIBUTION_LOOKBACK_DAYS))
-    ]
+    event_ts = marketing_events["event_ts"].values.astype("datetime64[ns]", copy=False).view("int64")
+    conversion_ts = fact_conversions["conversion_ts"]
+    window_start = (conversion_ts - timedelta(days=ATTRIBUTION_LOOKBACK_DAYS)).values.astype("datetime64[ns]", copy=False).view("int64")
+    window_end = conversion_ts.values.astype("datetime64[ns]", copy=False).view("int64")
+
+    # Dense time ranks make (client, time) a single sortable int64 key
+    distinct_ts = np.unique(event_ts)
+    n_ranks = len(distinct_ts) + 1
+
+    event_key = event_client * n_ranks + np.searchsorted(distinct_ts, event_ts)
+    order = np.argsort(event_key, kind="stable")
+    sorted_key = event_key[order]
+
+    lo = np.searchsorted(sorted_key, conversion_client * n_ranks + np.searchsorted(distinct_ts, window_start))
+    hi = np.searchsorted(sorted_key, conversion_client * n_ranks + np.searchsorted(distinct_ts, window_end))
+    hi = np.where(conversion_ts.isna().to_numpy(), lo, hi)
 
-    return touchpoints[
+    # Expand the windows into (conversion, event) position pairs
+    counts = hi - lo
+    conversion_pos = np.repeat(np.arange(len(fact_conversions)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    event_pos = order[np.repeat(lo, counts) + offsets]
+
+    by_event = np.lexsort((event_pos, conversion_pos))
+    conversion_pos = conversion_pos[by_event]
+    event_pos = event_pos[by_event]
+
+    touchpoints = pd.concat(
         [
-            "conversion_id",
-            "conversion_ts",
-            "event_ts",
-            "utm_source",
-            "utm_medium",
-            "utm_campaign",
-            "utm_content",
-            "session_id_event",
-        ]
-    ].rename(columns={
+            fact_conversions[["conversion_id", "conversion_ts"]]
+            .iloc[conversion_pos]
+            .reset_index(drop=True),
+            marketing_events[
+                ["event_ts", "utm_source", "utm_medium", "utm_campaign", "utm_content", "session_id"]
+            ]
+            .iloc[event_pos]
+            .reset_index(drop=True),
+        ],
+        axis=1
+    )
+
+    return touchpoints.rename(columns={
         "event_ts": "touchpoint_ts",
-        "session_id_event": "touchpoint_session_id"
+        "session_id": "touchpoint_session_id"
     })
 
-def build_direct_attribution(
-    fact_conversions: pd.DataFrame,
-    attributed_conversions: pd.Series,
-    model: str
-) -> pd.DataFrame:
+# Attribution models
+#
+# Single-touch models credit all revenue to one touchpoint, picked per UTM
+# column (the first non-missing value in the model's order). Multi-touch
+# models spread revenue over every touchpoint with a weight function of
+# (position, touchpoint count, age in days), normalized per conversion.
+# A new model is one more entry here; the engine evaluates every model over
+# the same sorted touchpoints.
 
-    # Builds direct attribution rows for conversions with no touchpoints.
+TIME_DECAY_HALF_LIFE_DAYS = 7
+POSITION_BASED_END_SHARE = 0.4  # credit of the first and of the last touchpoint; the middle ones share the rest
 
 
-    missing = fact_conversions[
-        ~fact_conversions["conversion_id"].isin(attributed_conversions)
-    ].copy()
+def linear_weights(position: np.ndarray, count: np.ndarray, age_days: np.ndarray) -> np.ndarray:
 
-    missing["attribution_model"] = model
-    missing["utm_source"] = "direct"
-    missing["utm_medium"] = "none"
-    missing["utm_campaign"] = "direct"
-    missing["utm_content"] = None
+    return np.ones(len(position))
 
-    return missing[
-        [
-            "conversion_id",
-            "attribution_model",
-            "utm_source",
-            "utm_medium",
-            "utm_campaign",
-            "utm_content",
-            "revenue",
-        ]
-    ]
 
+def time_decay_weights(position: np.ndarray, count: np.ndarray, age_days: np.ndarray) -> np.ndarray:
 
-def select_attribution_touchpoints(
-    conversion_touchpoints: pd.DataFrame,
-    model: str
-) -> pd.DataFrame:
+    return 0.5 ** (age_days / TIME_DECAY_HALF_LIFE_DAYS)
 
-    ascending = model == "first_click"
 
-    selected = (
-        conversion_touchpoints
-        .sort_values("touchpoint_ts", ascending=ascending)
-        .groupby("conversion_id", as_index=False)
-        .first()
+def position_based_weights(position: np.ndarray, count: np.ndarray, age_days: np.ndarray) -> np.ndarray:
+
+    # 40/20/40 by default; with one or two touchpoints they share equally
+    is_end = (position == 0) | (position == count - 1)
+    middle = (1 - 2 * POSITION_BASED_END_SHARE) / np.maximum(count - 2, 1)
+
+    return np.where(
+        count <= 2,
+        1.0,
+        np.where(is_end, POSITION_BASED_END_SHARE, middle)
     )
 
-    selected["attribution_model"] = model
-    return selected
 
-def compute_sessions_to_conversion(conversion_touchpoints: pd.DataFrame) -> pd.DataFrame:
+SINGLE_TOUCH_MODELS = ["first_click", "last_click"]
 
-    return (
-        conversion_touchpoints
-        .groupby("conversion_id")
-        .agg(
-            sessions_to_conversion_7d=("touchpoint_session_id", "nunique")
-        )
-        .reset_index()
-    )
+MULTI_TOUCH_MODELS = {
+    "linear": linear_weights,
+    "time_decay": time_decay_weights,
+    "position_based": position_based_weights,
+}
+
+ATTRIBUTION_MODELS = SINGLE_TOUCH_MODELS + list(MULTI_TOUCH_MODELS)
 
+ATTRIBUTION_COLUMNS = [
+    "conversion_id",
+    "attribution_model",
+    "utm_source",
+    "utm_medium",
+    "utm_campaign",
+    "utm_content",
+    "sessions_to_conversion_7d",
+    "revenue",
+]
 
+
+def build_direct_attribution(
+    fact_conversions: pd.DataFrame,
+    attributed_conversions: pd.Series
+) -> pd.DataFrame:
+
+    # Builds direct attribution rows, for every model, for conversions with no touchpoints
+    missing = fact_conversions[
+        ~fact_conversions["conversion_id"].isin(attributed_conversions)
+    ]
+
+    direct = pd.DataFrame({
+        "conversion_id": np.tile(missing["conversion_id"].to_numpy(), len(ATTRIBUTION_MODELS)),
+        "attribution_model": np.repeat(ATTRIBUTION_MODELS, len(missing)),
+        "utm_source": "direct",
+        "utm_medium": "none",
+        "utm_campaign": "direct",
+        "utm_content": None,
+        "sessions_to_conversion_7d": 0,
+        "revenue": np.tile(missing["revenue"].to_numpy(), len(ATTRIBUTION_MODELS)),
+    })
+
+    return direct[ATTRIBUTION_COLUMNS]
+
+
+def _last_valid_positions(valid: np.ndarray, ts: np.ndarray, starts: np.ndarray) -> np.ndarray:
+
+    # Latest valid row of each run; on equal times the earliest row, as a
+    # stable descending sort would put first
+    latest = np.maximum.reduceat(np.where(valid, ts, np.iinfo(np.int64).min), starts)
+    segment = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(valid))))
+
+    return _first_valid_positions(valid & (ts == latest[segment]), starts)
+
+
+@profile_stage
 def build_fact_attribution(
     conversion_touchpoints: pd.DataFrame,
     fact_conversions: pd.DataFrame
 ) -> pd.DataFrame:
+    """
+    Attribution rows for every model in ATTRIBUTION_MODELS.
+    Touchpoints are sorted once by conversion, then time (stable, so ties
+    keep their join order); every model then reduces over the same runs of
+    touchpoints. Single-touch models give one row per conversion, multi-touch
+    models one row per conversion and UTM combination with its share of the
+    revenue. Conversions without touchpoints get direct rows for every model.
+    """
+    if len(conversion_touchpoints) == 0:
+        return sort_fact_attribution(build_direct_attribution(fact_conversions, []))
+
+    conversion_codes, conversion_ids = pd.factorize(conversion_touchpoints["conversion_id"], sort=True)
+    ts = conversion_touchpoints["touchpoint_ts"].values.astype("datetime64[ns]", copy=False).view("int64")
+
+    order = np.lexsort((ts, conversion_codes))
+    touchpoints = conversion_touchpoints.iloc[order].reset_index(drop=True)
+    conversion_codes = conversion_codes[order]
+    ts = ts[order]
+
+    n = len(touchpoints)
+    starts = np.flatnonzero(np.diff(conversion_codes, prepend=-1))
+    count = np.diff(np.append(starts, n))
+    position = np.arange(n) - np.repeat(starts, count)
+
+    revenue = (
+        fact_conversions
+        .set_index("conversion_id")["revenue"]
+        .reindex(conversion_ids)
+        .to_numpy()
+    )
 
-    first_click = select_attribution_touchpoints(
-        conversion_touchpoints,
-        model="first_click"
+    # Distinct touchpoint sessions per conversion
+    session_codes, session_ids = pd.factorize(touchpoints["touchpoint_session_id"])
+    has_session = session_codes >= 0
+    pairs = np.unique(
+        conversion_codes[has_session].astype(np.int64) * max(len(session_ids), 1)
+        + session_codes[has_session]
+    )
+    sessions_to_conversion = np.bincount(
+        pairs // max(len(session_ids), 1),
+        minlength=len(conversion_ids)
     )
 
-    last_click = select_attribution_touchpoints(
-        conversion_touchpoints,
-        model="last_click"
+    attribution = []
+
+    # Single-touch models (UTM values as plain strings, like the direct rows they are stacked with)
+    for model in SINGLE_TOUCH_MODELS:
+        picked = {}
+        for column in UTM_PARAMS:
+            valid = touchpoints[column].notna().to_numpy()
+            positions = (
+                _first_valid_positions(valid, starts)
+                if model == "first_click"
+                else _last_valid_positions(valid, ts, starts)
+            )
+            picked[column] = np.asarray(_take_positions(touchpoints[column], positions), dtype=object)
+
+        attribution.append(pd.DataFrame({
+            "conversion_id": conversion_ids,
+            "attribution_model": model,
+            **picked,
+            "sessions_to_conversion_7d": sessions_to_conversion,
+            "revenue": revenue,
+        }))
+
+    # Multi-touch models: weights of all models, then one grouping by conversion and UTM values
+    if MULTI_TOUCH_MODELS:
+        age_days = (
+            touchpoints["conversion_ts"] - touchpoints["touchpoint_ts"]
+        ).dt.total_seconds().to_numpy() / 86_400
+
+        credit = touchpoints[UTM_PARAMS].assign(conversion_code=conversion_codes)
+        for model, weights in MULTI_TOUCH_MODELS.items():
+            weight = np.asarray(weights(position, count[conversion_codes], age_days), dtype=np.float64)
+            total = np.add.reduceat(weight, starts)
+            credit[model] = weight / total[conversion_codes] * revenue[conversion_codes]
+
+        credit = (
+            credit
+            .groupby(["conversion_code"] + UTM_PARAMS, sort=False, dropna=False, observed=True)
+            .sum()
+            .reset_index()
+        )
+        codes = credit["conversion_code"].to_numpy()
+
+        for model in MULTI_TOUCH_MODELS:
+            attribution.append(pd.DataFrame({
+                "conversion_id": conversion_ids[codes],
+                "attribution_model": model,
+                **{column: credit[column].astype(object) for column in UTM_PARAMS},
+                "sessions_to_conversion_7d": sessions_to_conversion[codes],
+                "revenue": credit[model].to_numpy(),
+            }))
+
+    # Direct fallback for conversions with no touchpoints, from one anti-join
+    attribution.append(build_direct_attribution(fact_conversions, conversion_ids))
+
+    return sort_fact_attribution(
+        pd.concat(attribution, ignore_index=True)[ATTRIBUTION_COLUMNS]
     )
 
-    first_click = first_click.merge(
-        fact_conversions[["conversion_id", "revenue"]],
-        on="conversion_id",
-        how="left"
+def sort_fact_attribution(fact_attribution: pd.DataFrame) -> pd.DataFrame:
+
+    # Row order of build_fact_attribution: attributed rows before direct ones,
+    # then by model, then by conversion_id (a conversion keeps the order of its rows)
+    is_direct = fact_attribution["sessions_to_conversion_7d"] == 0
+
+    return fact_attribution.iloc[
+        np.lexsort((
+            fact_attribution["conversion_id"].to_numpy(),
+            fact_attribution["attribution_model"].to_numpy(),
+            is_direct.to_numpy(),
+        ))
+    ].reset_index(drop=True)
+
+
+def build_fact_attribution_incremental(
+    previous_fact_attribution: pd.DataFrame,
+    events_with_sessions: pd.DataFrame,
+    fact_conversions: pd.DataFrame,
+    rebuilt_events: pd.DataFrame
+) -> pd.DataFrame:
+    """
+    Recomputes attribution only for conversions whose lookback window can see
+    a new or re-sessionized event, i.e. conversions at or after the earliest
+    rebuilt event. Every other conversion keeps its previous rows.
+    """
+    recompute_from = rebuilt_events["event_ts"].min()
+
+    affected = fact_conversions[fact_conversions["conversion_ts"] >= recompute_from]
+
+    window_events = events_with_sessions[
+        events_with_sessions["event_ts"]
+        >= recompute_from - timedelta(days=ATTRIBUTION_LOOKBACK_DAYS)
+    ]
+
+    conversion_touchpoints = build_conversion_touchpoints(
+        events_with_sessions=window_events,
+        fact_conversions=affected
     )
 
-    last_click = last_click.merge(
-        fact_conversions[["conversion_id", "revenue"]],
-        on="conversion_id",
-        how="left"
+    fact_attribution = pd.concat(
+        [
+            previous_fact_attribution[
+                ~previous_fact_attribution["conversion_id"].isin(affected["conversion_id"])
+            ],
+            build_fact_attribution(
+                conversion_touchpoints=conversion_touchpoints,
+                fact_conversions=affected
+            ),
+        ],
+        ignore_index=True
     )
 
-    sessions_to_conversion = compute_sessions_to_conversion(conversion_touchpoints)
+    return sort_fact_attribution(fact_attribution)
 
-    first_click = first_click.merge(
-        sessions_to_conversion,
-        on="conversion_id",
-        how="left"
+
+def attribution_settings() -> Dict:
+
+    # Settings previous attribution rows depend on, read when called so
+    # settings changed after import are what stage keys and state record
+    return {
+        "ATTRIBUTION_LOOKBACK_DAYS": ATTRIBUTION_LOOKBACK_DAYS,
+        "ATTRIBUTION_MODELS": ATTRIBUTION_MODELS,
+        "TIME_DECAY_HALF_LIFE_DAYS": TIME_DECAY_HALF_LIFE_DAYS,
+        "POSITION_BASED_END_SHARE": POSITION_BASED_END_SHARE,
+    }
+
+
+def check_fact_attribution(fact_attribution: pd.DataFrame, fact_conversions: pd.DataFrame) -> None:
+
+    # Each conversion appears at most once per single-touch model
+    assert (
+        fact_attribution[fact_attribution["attribution_model"].isin(SINGLE_TOUCH_MODELS)]
+        .groupby(["conversion_id", "attribution_model"])
+        .size()
+        .max() == 1
     )
 
-    last_click = last_click.merge(
-        sessions_to_conversion,
-        on="conversion_id",
-        how="left"
+    # Multi-touch models credit each UTM combination of a conversion once
+    assert not (
+        fact_attribution[["conversion_id", "attribution_model"] + UTM_PARAMS]
+        .duplicated()
+        .any()
     )
 
-    direct_first = build_direct_attribution(
-        fact_conversions,
-        first_click["conversion_id"],
-        model="first_click"
+    # Only valid models
+    assert set(fact_attribution["attribution_model"]) == set(ATTRIBUTION_MODELS)
+
+    # Revenue reconciliation
+    for model in ATTRIBUTION_MODELS:
+        attributed = fact_attribution.loc[
+            fact_attribution["attribution_model"] == model,
+            "revenue"
+        ].sum()
+
+        original = fact_conversions["revenue"].sum()
+
+        assert abs(attributed - original) < 1e-6
+
+
+# Partitioned execution
+#
+# Sessions, conversions and attribution never combine events of different
+# clients: sessions and touchpoints are per client, and conversions without
+# a client id only join anonymous events. So the enriched events are split
+# by a hash of client_id into PARTITIONS shards, the anonymous events into a
+# shard of their own, and each shard runs the whole chain in a worker
+# process. Shards and results travel as pickled spill files. The merged
+# tables are put back in the order of a single-process run, and the few
+# transactions whose checkout events landed in more than one shard (their
+# events carry different client ids) are rebuilt from all of their events.
+
+import pickle
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+PARTITION_TABLES = [
+    "events_with_sessions",
+    "sessions",
+    "fact_conversions",
+    "quarantined_conversions",
+    "fact_attribution",
+]
+
+
+def shard_events(client_id: pd.Series, partitions: int) -> np.ndarray:
+    """
+    Shard of each event: a stable hash of str(client_id) (the session
+    identity) modulo partitions, or shard `partitions` for events without
+    a client id.
+    """
+    values, uniques = pd.factorize(client_id)
+    hashes = pd.util.hash_array(np.asarray(uniques.astype(str), dtype=object))
+
+    # Code -1 (no client id) picks the appended anonymous shard
+    return np.append((hashes % partitions).astype(np.int64), partitions)[values]
+
+
+def _spill(obj, path: str) -> str:
+
+    with open(path, "wb") as f:
+        pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return path
+
+
+def _unspill(path: str):
+
+    with open(path, "rb") as f:
+        return pickle.load(f)
+
+
+def run_partition(shard_path: str, profile: bool) -> Tuple[Dict[str, str], Dict]:
+    """
+    Worker task: sessions, conversions and attribution of the enriched events
+    spilled to shard_path. Each table is spilled next to it; returns their
+    paths and the task timing, with the stage timings recorded here.
+    """
+    PROFILER.enabled = profile
+    PROFILER.reset()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    enriched_events = _unspill(shard_path)
+
+    events_with_sessions = assign_sessions(enriched_events)
+    sessions = build_sessions(events_with_sessions)
+    fact_conversions, quarantined_conversions = build_fact_conversions(events_with_sessions)
+    fact_attribution = build_fact_attribution(
+        conversion_touchpoints=build_conversion_touchpoints(
+            events_with_sessions=events_with_sessions,
+            fact_conversions=fact_conversions
+        ),
+        fact_conversions=fact_conversions
     )
 
-    direct_last = build_direct_attribution(
-        fact_conversions,
-        last_click["conversion_id"],
-        model="last_click"
+    tables = {
+        "events_with_sessions": events_with_sessions,
+        "sessions": sessions,
+        "fact_conversions": fact_conversions,
+        "quarantined_conversions": quarantined_conversions,
+        "fact_attribution": fact_attribution,
+    }
+    paths = {name: _spill(df, f"{shard_path}.{name}") for name, df in tables.items()}
+
+    timing = {
+        "pid": os.getpid(),
+        "rows": len(enriched_events),
+        "wall_seconds": time.perf_counter() - wall_start,
+        "cpu_seconds": time.process_time() - cpu_start,
+        "stages": PROFILER.snapshot(),
+    }
+
+    return paths, timing
+
+
+def _concat_parts(frames: List[pd.DataFrame]) -> pd.DataFrame:
+
+    # Empty parts carry no dtypes worth keeping and would widen the others to object
+    non_empty = [frame for frame in frames if len(frame)]
+
+    return concat_compact(non_empty or frames[:1])
+
+
+@profile_stage
+def merge_partitions(enriched_events: pd.DataFrame, parts: List[Dict[str, pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
+    """
+    Concatenates the per-shard tables into the tables a single-process run
+    builds from enriched_events, in the same order with the same labels.
+    """
+    # Session keys made unique across shards, then renumbered in the final order
+    offset = 0
+    frames = []
+    for part in parts:
+        events = part["events_with_sessions"]
+        frames.append(events.assign(session_key=events["session_key"].to_numpy() + offset))
+        offset += int(events["session_key"].max()) + 1 if len(events) else 0
+
+    events_with_sessions = _concat_parts(frames)
+
+    # An identity's events are contiguous and ordered within its shard, so a
+    # stable sort on the global identity codes restores assign_sessions order
+    identity_codes, _ = encode_identities(enriched_events["client_id"])
+    positions = enriched_events.index.get_indexer(events_with_sessions.index)
+    events_with_sessions = events_with_sessions.take(
+        np.argsort(identity_codes[positions], kind="stable")
     )
 
-    direct_first["sessions_to_conversion_7d"] = 0
-    direct_last["sessions_to_conversion_7d"] = 0
+    session_key = events_with_sessions["session_key"].to_numpy()
+    events_with_sessions["session_key"] = np.cumsum(np.diff(session_key, prepend=-1) != 0) - 1
 
-    attribution = pd.concat(
-        [first_click, last_click, direct_first, direct_last],
-        ignore_index=True
+    sessions = _concat_parts([part["sessions"] for part in parts])
+    sessions = sessions.iloc[
+        np.argsort(sessions["session_id"].to_numpy(), kind="stable")
+    ].reset_index(drop=True)
+
+    quarantined_conversions = _concat_parts([part["quarantined_conversions"] for part in parts])
+    quarantined_conversions = quarantined_conversions.take(
+        np.argsort(events_with_sessions.index.get_indexer(quarantined_conversions.index), kind="stable")
     )
 
-    return attribution[
-        [
-            "conversion_id",
-            "attribution_model",
-            "utm_source",
-            "utm_medium",
-            "utm_campaign",
-            "utm_content",
-            "sessions_to_conversion_7d",
-            "revenue",
+    fact_conversions = _concat_parts([part["fact_conversions"] for part in parts])
+    fact_attribution = _concat_parts([part["fact_attribution"] for part in parts])
+
+    # A transaction seen in several shards is rebuilt from all of its checkout events
+    split = fact_conversions.loc[fact_conversions["conversion_id"].duplicated(), "conversion_id"].unique()
+    if len(split):
+        rebuilt_conversions, _ = build_fact_conversions(
+            events_with_sessions[events_with_sessions["event_name"] == "checkout_completed"]
+        )
+        rebuilt_conversions = rebuilt_conversions[rebuilt_conversions["conversion_id"].isin(split)]
+
+        fact_conversions = pd.concat(
+            [fact_conversions[~fact_conversions["conversion_id"].isin(split)], rebuilt_conversions]
+        )
+        fact_attribution = pd.concat(
+            [
+                fact_attribution[~fact_attribution["conversion_id"].isin(split)],
+                build_fact_attribution(
+                    conversion_touchpoints=build_conversion_touchpoints(
+                        events_with_sessions=events_with_sessions,
+                        fact_conversions=rebuilt_conversions
+                    ),
+                    fact_conversions=rebuilt_conversions
+                ),
+            ]
+        )
+
+    return {
+        "events_with_sessions": events_with_sessions,
+        "sessions": sessions,
+        "fact_conversions": fact_conversions.sort_values("conversion_id", kind="stable").reset_index(drop=True),
+        "quarantined_conversions": quarantined_conversions,
+        "fact_attribution": sort_fact_attribution(fact_attribution),
+    }
+
+
+def run_partitioned(
+    enriched_events: pd.DataFrame,
+    partitions: int = None,
+    workers: int = None
+) -> Tuple[Dict[str, pd.DataFrame], Dict]:
+    """
+    Runs sessions, conversions and attribution shard by shard across a pool
+    of worker processes. Returns the merged tables and a timing report with
+    the rows and time of each worker. partitions and workers default to
+    PARTITIONS and PARTITION_WORKERS.
+    """
+    # Worker timings are summarized the way the validator's are
+    from data_validation_framework import summarize_worker_timings
+
+    partitions = PARTITIONS if partitions is None else partitions
+    workers = PARTITION_WORKERS if workers is None else workers
+
+    started = time.perf_counter()
+    spill_dir = tempfile.mkdtemp(prefix="partitions-", dir=SPILL_DIR)
+
+    try:
+        shard = shard_events(enriched_events["client_id"], partitions)
+        shard_paths = [
+            _spill(enriched_events.take(np.flatnonzero(shard == i)), os.path.join(spill_dir, f"shard-{i}"))
+            for i in range(partitions + 1)
+            if (shard == i).any()
         ]
-    ]
 
-conversion_touchpoints = build_conversion_touchpoints(
-    events_with_sessions=events_with_sessions,
-    fact_conversions=fact_conversions
-)
+        with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count(), len(shard_paths) or 1)) as pool:
+            results = list(pool.map(run_partition, shard_paths, [PROFILER.enabled] * len(shard_paths)))
+
+        parts = [
+            {name: _unspill(path) for name, path in paths.items()}
+            for paths, _ in results
+        ]
+        timings = [timing for _, timing in results]
+
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+
+    tables = merge_partitions(enriched_events, parts)
+
+    return tables, summarize_worker_timings(timings, time.perf_counter() - started)
+
+
+# Pipeline
+#
+# The stages form a graph: each table below is built from the tables it
+# depends on the first time it is asked for, then kept on the pipeline
+# object. Asking for sessions runs ingestion and sessionization only;
+# asking for fact_attribution runs everything upstream of it once. Each
+# table is checked and saved as it is built. Importing this module runs
+# nothing; run() builds every table, as running the script does.
+
+from functools import cached_property
+
+OUTPUT_TABLES = [
+    "enriched_events",
+    "events_with_sessions",
+    "sessions",
+    "fact_conversions",
+    "quarantined_conversions",
+    "fact_attribution",
+]
+
+
+# Default of cache_dir, which reads STAGE_CACHE_DIR; None there disables the cache
+USE_STAGE_CACHE_DIR = object()
+
+
+class TransformationPipeline:
+
+    def __init__(
+        self,
+        folder_path: str = None,
+        incremental: bool = None,
+        streaming: bool = None,
+        validate: bool = None,
+        partitions: int = None,
+        workers: int = None,
+        cache_dir: str = USE_STAGE_CACHE_DIR
+    ):
+        # Settings not passed are read from the module when the pipeline is built
+        if cache_dir is USE_STAGE_CACHE_DIR:
+            cache_dir = STAGE_CACHE_DIR
+        if validate is None:
+            validate = VALIDATE_INPUTS
+
+        self.folder_path = FOLDER_PATH if folder_path is None else folder_path
+        self.incremental = INCREMENTAL_MODE if incremental is None else incremental
+        self.streaming = STREAMING_MODE if streaming is None else streaming
+        self.partitions = PARTITIONS if partitions is None else partitions
+        self.workers = PARTITION_WORKERS if workers is None else workers
+        self.cache = StageCache(cache_dir, STAGE_CACHE_MAX_BYTES) if cache_dir else None
+
+        # Conversions and attribution of a partitioned run come with its sessions
+        self._partition_tables = None
+
+        # Filled with one part 1 validation result per file as the files are read
+        self.validation_results = [] if validate else None
+
+    @cached_property
+    def input_files(self) -> List[str]:
+
+        return list_input_files(self.folder_path)
+
+    @cached_property
+    def pipeline_state(self) -> Dict:
+
+        return load_pipeline_state(STATE_DIR) if self.incremental else None
+
+    @cached_property
+    def incremental_files(self) -> List[str]:
+        """
+        Files an incremental run adds to the previous outputs ([] when they
+        are up to date); None for a run from scratch.
+        """
+        return plan_incremental_run(self.pipeline_state, self.input_files) if self.incremental else None
+
+    @property
+    def up_to_date(self) -> bool:
+
+        return self.incremental_files == []
+
+    @cached_property
+    def schema_index(self) -> Dict[str, Dict]:
+
+        # Header and sample dtypes of each input file, reused from the part 1 index
+        # while a file is unchanged; settles each file's columns before it is parsed
+        schema_index = build_schema_index(self.input_files, SCHEMA_INDEX_PATH)
+        print("schema drift:", drift_transitions(schema_index))
+
+        return schema_index
+
+    @cached_property
+    def stage_keys(self) -> Dict[str, str]:
+        """
+        Stage cache key of each stage of a run from scratch. A key covers the
+        stage's inputs (the input files' sha256, or the keys of the stages it
+        reads), the settings it uses and the source of the code it runs, so
+        a change only recomputes the stages at and after the one it affects.
+        """
+        import payload_decoding
+        import sessionization
+        import timestamp_parsing
+
+        enrichment_params = {
+            "CLIENT_ID_COLUMNS": CLIENT_ID_COLUMNS,
+            "INPUT_COLUMNS": INPUT_COLUMNS,
+            "UTM_PARAMS": UTM_PARAMS,
+            "UA_RULES": UA_RULES,
+            "UA_DEFAULTS": UA_DEFAULTS,
+            "UA_CATEGORIES": UA_CATEGORIES,
+            "COMPACT_COLUMNS": COMPACT_COLUMNS,
+            "VALIDATE_INPUTS": self.validation_results is not None,
+        }
+        enrichment_code = [
+            build_enriched_events, read_input_file, iter_event_chunks, input_usecols,
+            resolve_client_id, client_id_column, extract_utm_columns, _utm_from_query,
+            extract_utm_params, extract_ua_columns, parse_user_agent, _match_rules,
+            UserAgentClassifier, compact_events, timestamp_parsing,
+        ]
+
+        # Validation results are cached with the events they were computed on
+        if self.validation_results is not None:
+            import data_validation_framework as validator
+            import validation_rules
+
+            enrichment_params["SCHEMA_CONTRACT"] = validator.SCHEMA_CONTRACT
+            enrichment_code += [
+                validator.validate_events_csv, validator.summarize_chunk, validator.merge_chunk_summaries,
+                validator.check_schema, validator.check_column_rules, validator.check_event_semantics,
+                validation_rules,
+            ]
+
+        keys = {}
+        keys["enriched_events"] = stage_key(
+            "enriched_events",
+            [self.schema_index[file_path]["sha256"] for file_path in self.input_files],
+            enrichment_params,
+            enrichment_code
+        )
+        keys["sessions"] = stage_key(
+            "sessions",
+            [keys["enriched_events"]],
+            {"SESSION_TIMEOUT_MINUTES": SESSION_TIMEOUT_MINUTES, "LANDING_COLUMNS": LANDING_COLUMNS},
+            [assign_sessions, build_sessions, _first_valid_positions, _take_positions, sessionization]
+        )
+        keys["conversions"] = stage_key(
+            "conversions",
+            [keys["sessions"]],
+            {"TRANSACTION_FIELDS": TRANSACTION_FIELDS},
+            [build_fact_conversions, payload_decoding]
+        )
+        keys["fact_attribution"] = stage_key(
+            "fact_attribution",
+            [keys["sessions"], keys["conversions"]],
+            {**attribution_settings(), "UTM_PARAMS": UTM_PARAMS},
+            [
+                build_conversion_touchpoints, build_fact_attribution, build_direct_attribution,
+                sort_fact_attribution, _first_valid_positions, _last_valid_positions, _take_positions,
+                *MULTI_TOUCH_MODELS.values(),
+            ]
+        )
+
+        return keys
+
+    def _cached(self, stage: str, build) -> Tuple[object, bool]:
+        """
+        build()'s result, loaded from the stage cache instead when the
+        stage's key is there. Returns it and whether it was loaded.
+        Incremental runs build on their own state and skip the cache.
+        """
+        if self.cache is None or self.incremental_files is not None:
+            return build(), False
+
+        key = self.stage_keys[stage]
+        value = self.cache.get(stage, key)
+        if value is not None:
+            return value, True
+
+        value = build()
+        self.cache.put(stage, key, value)
+
+        return value, False
+
+    @cached_property
+    def previous_events_with_sessions(self) -> pd.DataFrame:
+
+        return load_snapshot(STATE_DIR, "events_with_sessions")
+
+    def _read_inputs(self, read) -> pd.DataFrame:
+
+        # The user agent cache is shared by every run on this machine
+        if UA_CACHE_PATH:
+            UA_CLASSIFIER.load(UA_CACHE_PATH)
+
+        events = read()
+
+        if self.validation_results is not None:
+            print(self.validation_results)
+
+        if UA_CACHE_PATH:
+            UA_CLASSIFIER.save(UA_CACHE_PATH)
+        print("user agent cache:", UA_CLASSIFIER.stats())
+
+        return events
+
+    @cached_property
+    def new_enriched_events(self) -> pd.DataFrame:
+        """
+        Incremental runs: the enriched events of the new input files.
+        """
+        if self.up_to_date:
+            raise RuntimeError(f"No new input files since {self.pipeline_state['watermark']}; outputs are up to date")
+
+        new_enriched_events = self._read_inputs(
+            lambda: build_enriched_events(
+                [
+                    read_input_file(file_path, self.validation_results, self.schema_index[file_path])
+                    for file_path in self.incremental_files
+                ]
+            )
+        )
+
+        # New events continue the row labels of the previous run, as they would in a full run
+        new_enriched_events.index += len(self.previous_events_with_sessions)
+
+        check_enriched_events(new_enriched_events)
+
+        return new_enriched_events
+
+    def _enrich_inputs(self) -> Tuple[pd.DataFrame, List[Dict]]:
+        """
+        Reads and enriches every input file and saves enriched_events.
+        Returns it with the validation results of the files.
+        """
+        if self.streaming:
+            def read():
+                stream_enriched_events(
+                    self.folder_path,
+                    OUTPUT_FORMAT,
+                    CHUNK_SIZE,
+                    self.validation_results,
+                    self.schema_index
+                )
+                return read_enriched_events(OUTPUT_FORMAT)
+
+            enriched_events = self._read_inputs(read)
+
+            if EXPORT_CSV and OUTPUT_FORMAT != "csv":
+                write_table(enriched_events, "enriched_events", "csv")
+
+        else:
+            enriched_events = self._read_inputs(
+                lambda: build_enriched_events(
+                    [
+                        read_input_file(file_path, self.validation_results, self.schema_index[file_path])
+                        for file_path in self.input_files
+                    ]
+                )
+            )
+            # saving incase of later need
+            save_table(enriched_events, "enriched_events")
+
+            # Sanity Checks
+            check_enriched_events(enriched_events)
+
+        return enriched_events, self.validation_results
+
+    @cached_property
+    def enriched_events(self) -> pd.DataFrame:
+
+        if self.incremental_files is not None:
+            enriched_events = concat_compact(
+                [
+                    self.previous_events_with_sessions[self.new_enriched_events.columns],
+                    self.new_enriched_events,
+                ]
+            ).sort_index()
+
+            save_table(enriched_events, "enriched_events")
+
+        else:
+            (enriched_events, validation_results), cached = self._cached("enriched_events", self._enrich_inputs)
+
+            if cached:
+                if self.validation_results is not None:
+                    self.validation_results.extend(validation_results)
+                    print(self.validation_results)
+
+                save_table(enriched_events, "enriched_events")
+
+        report_memory("enriched_events", enriched_events)
 
-fact_attribution = build_fact_attribution(
-    conversion_touchpoints=conversion_touchpoints,
-    fact_conversions=fact_conversions
-)
+        return enriched_events
 
-# Each conversion appears at most once per model
-assert (
-    fact_attribution
-    .groupby(["conversion_id", "attribution_model"])
-    .size()
-    .max() == 1
-)
+    def _sessionize(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
 
-# Only valid models
-assert set(fact_attribution["attribution_model"]) == {"first_click", "last_click"}
+        if self.partitions > 1 and len(self.enriched_events):
+            tables, worker_report = run_partitioned(self.enriched_events, self.partitions, self.workers)
+            print("partitions:", worker_report)
 
-# Revenue reconciliation
-for model in ["first_click", "last_click"]:
-    attributed = fact_attribution.loc[
-        fact_attribution["attribution_model"] == model,
-        "revenue"
-    ].sum()
+            self._partition_tables = tables
+            return tables["events_with_sessions"], tables["sessions"]
 
-    original = fact_conversions["revenue"].sum()
+        events_with_sessions = assign_sessions(self.enriched_events)
 
-    assert abs(attributed - original) < 1e-6
+        return events_with_sessions, build_sessions(events_with_sessions)
 
-fact_attribution.to_csv('fact_attribution.csv')
+    @cached_property
+    def _sessionized(self) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """
+        (events_with_sessions, sessions, rebuilt_events); rebuilt_events are
+        the events whose sessions an incremental run rebuilt, None otherwise.
+        """
+        if self.incremental_files is not None:
+            if self.pipeline_state["settings"]["SESSION_TIMEOUT_MINUTES"] != SESSION_TIMEOUT_MINUTES:
+                raise ValueError(
+                    f"SESSION_TIMEOUT_MINUTES changed since the last run; delete {STATE_DIR} to rebuild from scratch"
+                )
+
+            events_with_sessions, rebuilt_events = assign_sessions_incremental(
+                self.previous_events_with_sessions,
+                self.new_enriched_events
+            )
+            sessions = build_sessions_incremental(
+                load_snapshot(STATE_DIR, "sessions"),
+                self.previous_events_with_sessions,
+                rebuilt_events
+            )
+
+        else:
+            (events_with_sessions, sessions), _ = self._cached("sessions", self._sessionize)
+            rebuilt_events = None
+
+        # session_key is an in-memory grouping key; the written table keeps the string session_id
+        save_table(events_with_sessions.drop(columns="session_key"), "events_with_sessions")
+        save_table(sessions, "sessions")
+
+        report_memory("events_with_sessions", events_with_sessions)
+        report_memory("sessions", sessions)
+
+        check_sessions(events_with_sessions, sessions)
+
+        return events_with_sessions, sessions, rebuilt_events
+
+    @property
+    def events_with_sessions(self) -> pd.DataFrame:
+
+        return self._sessionized[0]
+
+    @property
+    def sessions(self) -> pd.DataFrame:
+
+        return self._sessionized[1]
+
+    @cached_property
+    def _conversions(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+
+        def build():
+            if self._partition_tables is not None:
+                return self._partition_tables["fact_conversions"], self._partition_tables["quarantined_conversions"]
+            return build_fact_conversions(self.events_with_sessions)
+
+        (fact_conversions, quarantined_conversions), _ = self._cached("conversions", build)
+
+        if len(quarantined_conversions):
+            print(f"Quarantined {len(quarantined_conversions)} conversion events with unreadable event_data")
+
+        save_table(quarantined_conversions, "quarantined_conversions")
+
+        check_fact_conversions(fact_conversions, self.events_with_sessions)
+
+        save_table(fact_conversions, "fact_conversions")
+
+        report_memory("fact_conversions", fact_conversions)
+
+        return fact_conversions, quarantined_conversions
+
+    @property
+    def fact_conversions(self) -> pd.DataFrame:
+
+        return self._conversions[0]
+
+    @property
+    def quarantined_conversions(self) -> pd.DataFrame:
+
+        return self._conversions[1]
+
+    @cached_property
+    def conversion_touchpoints(self) -> pd.DataFrame:
+
+        return build_conversion_touchpoints(
+            events_with_sessions=self.events_with_sessions,
+            fact_conversions=self.fact_conversions
+        )
+
+    @cached_property
+    def fact_attribution(self) -> pd.DataFrame:
+
+        if self.incremental_files is not None:
+            for setting, value in attribution_settings().items():
+                if self.pipeline_state["settings"].get(setting) != value:
+                    raise ValueError(
+                        f"{setting} changed since the last run; delete {STATE_DIR} to rebuild from scratch"
+                    )
+
+            fact_attribution = build_fact_attribution_incremental(
+                previous_fact_attribution=load_snapshot(STATE_DIR, "fact_attribution"),
+                events_with_sessions=self.events_with_sessions,
+                fact_conversions=self.fact_conversions,
+                rebuilt_events=self._sessionized[2]
+            )
+
+        else:
+            def build():
+                if self._partition_tables is not None:
+                    return self._partition_tables["fact_attribution"]
+                return build_fact_attribution(
+                    conversion_touchpoints=self.conversion_touchpoints,
+                    fact_conversions=self.fact_conversions
+                )
+
+            fact_attribution, _ = self._cached("fact_attribution", build)
+
+        check_fact_attribution(fact_attribution, self.fact_conversions)
+
+        save_table(fact_attribution, "fact_attribution")
+
+        report_memory("fact_attribution", fact_attribution)
+
+        return fact_attribution
+
+    @cached_property
+    def daily_kpis(self) -> pd.DataFrame:
+        """
+        Per-day metrics of the output tables; the ones that changed are
+        appended to the KPI store.
+        """
+        daily_kpis = build_daily_kpis(
+            self.events_with_sessions,
+            self.sessions,
+            self.fact_conversions,
+            self.fact_attribution
+        )
+
+        appended = append_daily_kpis(KPI_STORE_PATH, daily_kpis)
+        print(f"daily KPIs: {daily_kpis['date'].nunique()} days, {appended} values appended to {KPI_STORE_PATH}")
+
+        return daily_kpis
+
+    def run(self) -> None:
+        """
+        Builds and saves every output table, then the incremental state and
+        the run manifest.
+        """
+        if self.up_to_date:
+            print("No new input files since", self.pipeline_state["watermark"], "- outputs are up to date")
+            return
+
+        for table in OUTPUT_TABLES:
+            getattr(self, table)
+
+        self.daily_kpis
+
+        # Written last, so it only describes complete sets of tables
+        write_table_manifest(
+            profile_stage(build_table_manifest)(
+                {
+                    # As written: session_key is never saved
+                    table: getattr(self, table).drop(columns="session_key", errors="ignore")
+                    for table in OUTPUT_TABLES
+                },
+                OUTPUT_FORMAT,
+                latest_input_day=input_file_day(self.input_files[-1]) if self.input_files else None
+            ),
+            TABLE_MANIFEST_PATH
+        )
 
+        if self.incremental:
+            save_pipeline_state(
+                STATE_DIR,
+                self.input_files,
+                tables={
+                    "events_with_sessions": self.events_with_sessions,
+                    "sessions": self.sessions,
+                    "fact_attribution": self.fact_attribution,
+                },
+                settings={
+                    "SESSION_TIMEOUT_MINUTES": SESSION_TIMEOUT_MINUTES,
+                    **attribution_settings(),
+                },
+                known=self.schema_index
+            )
+
+        if self.cache is not None:
+            print("stage cache:", self.cache.report())
+
+        if PROFILER.enabled:
+            manifest_path = PROFILER.write_run_manifest(
+                RUN_MANIFEST_DIR,
+                "transformation",
+                tables={
+                    table: len(getattr(self, table))
+                    for table in OUTPUT_TABLES
+                    if table != "quarantined_conversions"
+                },
+                stage_cache=self.cache.stats if self.cache is not None else None
+            )
+            print("run manifest:", manifest_path)
+
+
+def main() -> None:
+
+    PROFILER.enabled = PROFILE_STAGES
+    TransformationPipeline().run()
+
+
+if __name__ == "__main__":
+    main()
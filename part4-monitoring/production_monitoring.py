@@ -1,35 +1,104 @@
 # Part 4: KPI Monitoring
 # Business Metrics
+import os
+import sys
+
 import pandas as pd
 
-fact_conversions = pd.read_csv("fact_conversions.csv")
-fact_attribution = pd.read_csv("fact_attribution.csv")
-sessions = pd.read_csv("sessions.csv")
-events_with_sessions = pd.read_csv("events_with_sessions.csv")
+# The table storage layer lives with the transformation stage that writes the tables
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "part2-transformation"))
+from kpi_store import SOURCE_COLUMNS, build_daily_kpis, kpi_series, load_daily_kpis
+from table_manifest import load_table_manifest
+from table_storage import read_table
 
-def compute_baseline(df, date_col, value_col, lookback_days=7):
+# Run manifests are written by the part 1 stage profiler
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "part1-data-quality"))
+from stage_profiler import PROFILER, load_run_manifests, profile_stage
 
-    return (
-        df
-        .sort_values(date_col)
-        .tail(lookback_days)[value_col]
-        .mean()
-    )
+OUTPUT_DIR = "."  # Edit path to the folder the transformation stage wrote its tables to
+RUN_MANIFEST_DIR = os.path.join(OUTPUT_DIR, "run_manifests")
+KPI_STORE_PATH = os.path.join(OUTPUT_DIR, "daily_kpis.csv")  # Daily metrics the transformation appends to; business checks read only this
+TABLE_MANIFEST_PATH = os.path.join(OUTPUT_DIR, "table_manifest.json")  # Row counts and rows per day of each table; health checks read only this
+USE_QUERY_BACKEND = True  # Without a KPI store, compute the daily metrics in DuckDB (when installed) instead of pandas
+
+BASELINE_DAYS = 7  # Days before the monitored day whose mean is its baseline
+
+FRESHNESS_MAX_HOURS = 36  # Alert when the newest event is older than this
+VOLUME_DROP_RATIO = 0.5  # Alert when a day has fewer events than this share of the median of the days before it
+
+STAGE_HISTORY_RUNS = 7  # Earlier runs each stage's timing is compared against
+STAGE_SLOWDOWN_FACTOR = 1.5  # Alert when a stage takes this many times its historical median time per row
+STAGE_MIN_SECONDS = 1.0  # Stages faster than this are not alerted on, their timings are mostly noise
+
+PROFILE_STAGES = True  # Record time, CPU, peak memory and rows of each check and save them as a run manifest in RUN_MANIFEST_DIR
+
+@profile_stage
+def load_monitored_tables(output_dir=OUTPUT_DIR, columns=SOURCE_COLUMNS):
+    """
+    The tables in columns (table name: columns to read), read concurrently
+    and projected to those columns. Only needed when the daily KPI store is
+    missing and business metrics are computed from the tables themselves
+    without the DuckDB query backend.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    # pyarrow decodes outside the GIL, so threads read the tables in parallel
+    with ThreadPoolExecutor(max_workers=len(columns)) as executor:
+        futures = {
+            table: executor.submit(read_table, table, output_dir, columns=table_columns)
+            for table, table_columns in columns.items()
+        }
+        return {table: future.result() for table, future in futures.items()}
+
+def compute_baseline(daily, run_date, lookback_days=BASELINE_DAYS):
+    """
+    Mean of a daily series over the lookback_days calendar days before
+    run_date; days missing from the series are left out.
+    """
+    run_date = pd.Timestamp(run_date)
+    window = daily[(daily.index >= run_date - pd.Timedelta(days=lookback_days)) & (daily.index < run_date)]
 
+    return window.mean()
+
+def latest_complete_day(daily_kpis, table_manifest):
+    """
+    The newest day the tables fully cover: the day of the newest input file
+    when the table manifest records it, otherwise the day before the newest
+    event's, since events past midnight spill into a day the files only
+    partly cover. Without a manifest, the latest day in the KPI store.
+    """
+    manifest = table_manifest or {}
+
+    if manifest.get("latest_input_day"):
+        return pd.Timestamp(manifest["latest_input_day"]).date()
+
+    max_ts = manifest.get("tables", {}).get("events_with_sessions", {}).get("max_ts")
+    if max_ts:
+        return (pd.Timestamp(max_ts).tz_convert("UTC").normalize() - pd.Timedelta(days=1)).date()
+
+    if len(daily_kpis):
+        return pd.Timestamp(daily_kpis["date"].max()).date()
+
+    return None
+
+@profile_stage
 def monitor_business_metrics(
-    fact_conversions: pd.DataFrame,
-    fact_attribution: pd.DataFrame,
+    daily_kpis: pd.DataFrame,
     run_date
 ):
     alerts = []
 
+    if len(daily_kpis) == 0:
+        return [{
+            "metric": "daily_kpis",
+            "severity": "critical",
+            "message": f"No daily KPIs recorded in {KPI_STORE_PATH}"
+        }]
+
     # Daily revenue
-    daily_rev = fact_conversions["revenue"].sum()
-    baseline_rev = compute_baseline(
-        fact_conversions,
-        "conversion_ts",
-        "revenue"
-    )
+    daily_revenue = kpi_series(daily_kpis, "revenue")
+    daily_rev = daily_revenue.get(pd.Timestamp(run_date), 0.0)
+    baseline_rev = compute_baseline(daily_revenue, run_date)
 
     if baseline_rev > 0:
         delta = (daily_rev - baseline_rev) / baseline_rev
@@ -40,14 +109,11 @@ def monitor_business_metrics(
                 "message": f"Revenue changed {delta:.1%} vs baseline"
             })
 
-    # Direct attribution share
-    direct_share = (
-        fact_attribution
-        .query("utm_source == 'direct'")
-        .groupby("attribution_model")["revenue"]
-        .sum()
-        / fact_attribution.groupby("attribution_model")["revenue"].sum()
-    )
+    # Direct attribution share of the day, per model
+    direct_share = pd.Series({
+        model: kpi_series(daily_kpis, "direct_share", model).get(pd.Timestamp(run_date), 0.0)
+        for model in daily_kpis.loc[daily_kpis["metric"] == "direct_share", "attribution_model"].unique()
+    }, dtype=float)
 
     if (direct_share > 0.7).any():
         alerts.append({
@@ -59,28 +125,34 @@ def monitor_business_metrics(
     return alerts
 
 #Pipeline health
-def monitor_pipeline_health(
-    events_with_sessions,
-    sessions,
-    fact_conversions
-):
+@profile_stage
+def monitor_pipeline_health(table_manifest):
     alerts = []
 
-    if len(events_with_sessions) == 0:
+    if table_manifest is None:
+        return [{
+            "metric": "table_manifest",
+            "severity": "critical",
+            "message": f"No table manifest at {TABLE_MANIFEST_PATH}"
+        }]
+
+    rows = {table: stats["rows"] for table, stats in table_manifest["tables"].items()}
+
+    if rows.get("events_with_sessions", 0) == 0:
         alerts.append({
             "metric": "events_volume",
             "severity": "critical",
             "message": "No events ingested"
         })
 
-    if len(fact_conversions) == 0:
+    if rows.get("fact_conversions", 0) == 0:
         alerts.append({
             "metric": "conversions",
             "severity": "critical",
             "message": "No conversions detected"
         })
 
-    if len(sessions) == 0:
+    if rows.get("sessions", 0) == 0:
         alerts.append({
             "metric": "sessions",
             "severity": "critical",
@@ -89,36 +161,132 @@ def monitor_pipeline_health(
 
     return alerts
 
+#Freshness and daily volume
+@profile_stage
+def monitor_freshness(table_manifest, now=None):
+    alerts = []
+
+    events = (table_manifest or {}).get("tables", {}).get("events_with_sessions", {})
+    if not events.get("max_ts"):
+        return alerts
+
+    now = now or pd.Timestamp.now(tz="UTC")
+    lag_hours = (now - pd.Timestamp(events["max_ts"])).total_seconds() / 3600
+
+    if lag_hours > FRESHNESS_MAX_HOURS:
+        alerts.append({
+            "metric": "freshness",
+            "severity": "critical",
+            "message": f"Newest event is {lag_hours:.0f}h old ({events['max_ts']})"
+        })
+
+    return alerts
+
+@profile_stage
+def monitor_daily_volume(table_manifest, run_date=None):
+    alerts = []
+
+    events = (table_manifest or {}).get("tables", {}).get("events_with_sessions", {})
+    if not events.get("rows_per_day"):
+        return alerts
+
+    # Every calendar day from the first to the last, so a day without events counts as zero
+    daily = pd.Series(events["rows_per_day"], dtype=float)
+    daily.index = pd.to_datetime(daily.index)
+    daily = daily.reindex(pd.date_range(daily.index.min(), daily.index.max(), freq="D"), fill_value=0)
+
+    # Only the monitored day is judged, so a past dip is not alerted on again every run
+    if run_date is None:
+        run_date = latest_complete_day(pd.DataFrame(), table_manifest)
+    day = pd.Timestamp(run_date)
+
+    count = daily.get(day, 0.0)
+    previous = daily[(daily.index >= day - pd.Timedelta(days=BASELINE_DAYS)) & (daily.index < day)]
+    if previous.empty:
+        return alerts
+
+    baseline = previous.median()
+    if baseline > 0 and count < VOLUME_DROP_RATIO * baseline:
+        alerts.append({
+            "metric": f"daily_events:{day.date()}",
+            "severity": "critical" if count == 0 else "warning",
+            "message": f"{int(count)} events on {day.date()}, {count / baseline:.0%} of the {BASELINE_DAYS}-day median"
+        })
+
+    return alerts
+
+#Stage performance
+def _seconds_per_row(stage):
+    # Time per input row, so a bigger batch is not mistaken for a slowdown
+    return stage["wall_seconds"] / stage["rows_in"] if stage.get("rows_in") else stage["wall_seconds"]
+
+@profile_stage
+def monitor_stage_performance(run_manifests):
+    alerts = []
+
+    if len(run_manifests) < 2:
+        return alerts
+
+    latest = run_manifests[-1]
+    history = run_manifests[-1 - STAGE_HISTORY_RUNS:-1]
+
+    for stage in latest["stages"]:
+        previous = [
+            _seconds_per_row(past_stage)
+            for manifest in history
+            for past_stage in manifest["stages"]
+            if past_stage["stage"] == stage["stage"]
+        ]
+        if not previous or stage["wall_seconds"] < STAGE_MIN_SECONDS:
+            continue
+
+        baseline = pd.Series(previous).median()
+        if baseline > 0 and _seconds_per_row(stage) > STAGE_SLOWDOWN_FACTOR * baseline:
+            alerts.append({
+                "metric": f"stage_time:{stage['stage']}",
+                "severity": "warning",
+                "message": (
+                    f"{stage['stage']} took {stage['wall_seconds']:.1f}s, "
+                    f"{_seconds_per_row(stage) / baseline:.1f}x its median time per row "
+                    f"over the last {len(previous)} runs"
+                )
+            })
+
+    return alerts
+
 from datetime import date
 
 def run_daily_monitoring(
-    fact_conversions,
-    fact_attribution,
-    sessions,
-    events_with_sessions
+    daily_kpis,
+    table_manifest,
+    run_manifests=(),
+    run_date=None
 ):
     alerts = []
 
+    # The latest complete day, unless a day is given; a partial trailing
+    # day would read as a collapse in revenue
+    if run_date is None:
+        run_date = latest_complete_day(daily_kpis, table_manifest)
+
     alerts.extend(
         monitor_business_metrics(
-            fact_conversions,
-            fact_attribution,
-            run_date=date.today()
+            daily_kpis,
+            run_date=run_date
         )
     )
 
-    alerts.extend(
-        monitor_pipeline_health(
-            events_with_sessions,
-            sessions,
-            fact_conversions
-        )
-    )
+    alerts.extend(monitor_pipeline_health(table_manifest))
+    alerts.extend(monitor_freshness(table_manifest))
+    alerts.extend(monitor_daily_volume(table_manifest, run_date))
+
+    alerts.extend(monitor_stage_performance(list(run_manifests)))
 
     status = "PASS" if len(alerts) == 0 else "FAIL"
 
     return {
         "run_date": str(date.today()),
+        "kpi_date": str(run_date),
         "status": status,
         "alert_count": len(alerts),
         "alerts": alerts
@@ -126,18 +294,44 @@ def run_daily_monitoring(
 
 def main():
 
+    PROFILER.enabled = PROFILE_STAGES
+
+    daily_kpis = profile_stage(load_daily_kpis)(KPI_STORE_PATH)
+
+    # Without a KPI store, the daily metrics are computed from the tables:
+    # in DuckDB, out of core, when it is installed, otherwise in memory.
+    # The query backend is only imported here, so runs with a KPI store never load it
+    if len(daily_kpis) == 0 and os.path.exists(TABLE_MANIFEST_PATH):
+        import query_backend
+
+        if USE_QUERY_BACKEND and query_backend.available():
+            daily_kpis = profile_stage(query_backend.daily_kpis)(OUTPUT_DIR)
+        else:
+            daily_kpis = profile_stage(build_daily_kpis)(**load_monitored_tables(OUTPUT_DIR))
+
     monitoring_report = run_daily_monitoring(
-        fact_conversions=fact_conversions,
-        fact_attribution=fact_attribution,
-        sessions=sessions,
-        events_with_sessions=events_with_sessions
+        daily_kpis=daily_kpis,
+        table_manifest=profile_stage(load_table_manifest)(TABLE_MANIFEST_PATH),
+        run_manifests=profile_stage(load_run_manifests)(RUN_MANIFEST_DIR, "transformation")
     )
 
     print(monitoring_report)
 
+    # Written before failing, so runs that raise alerts are timed too
+    if PROFILER.enabled:
+        manifest_path = PROFILER.write_run_manifest(
+            RUN_MANIFEST_DIR,
+            "monitoring",
+            status=monitoring_report["status"],
+            alert_count=monitoring_report["alert_count"]
+        )
+        print("run manifest:", manifest_path)
+
     if monitoring_report["status"] == "FAIL":
         raise RuntimeError(
             f"Data monitoring failed with {monitoring_report['alert_count']} alerts"
         )
-    if __name__ == "__main__":
-      main()
\ No newline at end of file
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file